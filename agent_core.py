@@ -1,6 +1,10 @@
 # agent_core.py
 import time
+import threading
 from collections import defaultdict
+import contextvars
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import planner
 import coder
 import executor
@@ -8,45 +12,200 @@ import verifier
 import memory_manager
 import error_handler
 import diagnostician # NEW
-from llm_interface import LLMProvider
-from typing import Callable, Optional, List, Dict, Any
+import diagnosis_cache
+from error_handler import ErrorFingerprint
+import preflight
+import checkpoint
+import tracing
+from llm_interface import LLMProvider, CachedProvider, ModelPinnedProvider, find_wrapper, bypass_cache, abort_on, abort_requested
+from settings import (MAX_PARALLEL_STEPS, PIPELINE_CODEGEN, STREAM_SCRIPT_OUTPUT, SCRIPT_LIMITS, REPAIR_COMMAND_LIMITS, SCRIPT_REPAIR_ATTEMPTS,
+                      RETRY_BACKOFF_CAP_SECONDS, RETRY_DEADLINE_SECONDS, CHECKPOINT_ENABLED,
+                      DIAGNOSIS_CACHE_ENABLED)
+from typing import Callable, Optional, List, Dict, Any, Set, Tuple
+from concurrent.futures import Future
+
+# Steps whose code only depends on the plan, not on results of earlier steps, so it can be generated ahead of time.
+PREFETCHABLE_TASKS = ("CREATE_NEW_TOOL", "CREATE_VERIFICATION_TOOL")
+
+# Errors that mean a verification script is itself broken rather than that the goal was not met.
+VERIFIER_BUG_ERRORS = ("SyntaxError", "IndentationError", "NameError", "UnboundLocalError", "ImportError", "ModuleNotFoundError")
+
+def _step_number(value: Any) -> Optional[int]:
+    """LLM 返回的步骤编号可能是整数或数字字符串；其他值返回 None。"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+class _StepLogRouter:
+    """
+    并行执行步骤时保证日志按步骤分组、按步骤顺序输出：
+    当前最靠前的未完成步骤的日志直接输出，其余步骤的日志先缓存，轮到它们时再整段输出。
+    """
+    def __init__(self, log_func: Callable[[str], None], step_numbers: List[int]):
+        self._log = log_func
+        self._order = list(step_numbers)
+        self._head = 0
+        self._buffers: Dict[int, List[str]] = {n: [] for n in step_numbers}
+        self._finished: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def logger_for(self, step_number: int) -> Callable[[str], None]:
+        def _log(message: str):
+            with self._lock:
+                if self._head < len(self._order) and self._order[self._head] == step_number:
+                    self._log(message)
+                else:
+                    self._buffers[step_number].append(message)
+        return _log
+
+    def finish(self, step_number: int):
+        with self._lock:
+            self._finished.add(step_number)
+            while self._head < len(self._order) and self._order[self._head] in self._finished:
+                self._head += 1
+                if self._head < len(self._order):
+                    self._flush(self._order[self._head])
+
+    def flush_all(self):
+        with self._lock:
+            for step_number in self._order[self._head:]:
+                self._flush(step_number)
+            self._head = len(self._order)
+
+    def _flush(self, step_number: int):
+        for message in self._buffers[step_number]:
+            self._log(message)
+        self._buffers[step_number].clear()
+
+class _ThreadRoutedLog:
+    """
+    Agent.log：在工作线程上运行的步骤通过各自的 _StepLogRouter logger 输出（见 local.step_log），其余情况输出到基础日志。
+    resolve() 返回当前线程的输出目标，供 executor 交给读取子进程输出的线程使用。
+    """
+    def __init__(self, base_log: Callable[[str], None], local: threading.local):
+        self._base_log = base_log
+        self._local = local
+
+    def resolve(self) -> Callable[[str], None]:
+        return getattr(self._local, 'step_log', None) or self._base_log
+
+    def __call__(self, message: str):
+        self.resolve()(message)
 
 class Agent:
     # ... __init__ and _execute_with_retry are the same as before ...
-    def __init__(self, goal: str, llm_provider: LLMProvider, log_func: Callable[[str], None], verify: bool = False, previous_context: Optional[Dict] = None):
+    def __init__(self, goal: str, llm_provider: LLMProvider, log_func: Callable[[str], None], verify: bool = False, previous_context: Optional[Dict] = None,
+                 max_parallel_steps: int = MAX_PARALLEL_STEPS, pipeline: bool = PIPELINE_CODEGEN,
+                 script_limits: Optional[Dict[str, Any]] = None, checkpoint_enabled: bool = CHECKPOINT_ENABLED,
+                 model: Optional[str] = None):
         self.goal = goal
-        self.llm_provider = llm_provider
-        self.log = log_func
+        # A per-task model leaves the shared provider instance (and every other task using it) untouched.
+        self.llm_provider = ModelPinnedProvider(llm_provider, model) if model else llm_provider
+        self._base_log = log_func
+        self._log_local = threading.local()
+        self.log = _ThreadRoutedLog(log_func, self._log_local)
+        self.max_parallel_steps = max_parallel_steps
+        self.pipeline = pipeline
+        # settings.SCRIPT_LIMITS, then the provider's "script_limits", then this task's overrides.
+        self.script_limits = executor.ResourceLimits.from_config(
+            SCRIPT_LIMITS, llm_provider.config.get('script_limits'), script_limits)
+        self.command_limits = executor.ResourceLimits.from_config(REPAIR_COMMAND_LIMITS)
         self.verify = verify
         self.previous_context = previous_context
         self.plan: Optional[List[Dict[str, Any]]] = None
         self.max_retries = 3
+        self.retry_deadline = RETRY_DEADLINE_SECONDS
         self.final_code_for_step = {}
         self.failure_reason = ""
+        self.repair_attempts = SCRIPT_REPAIR_ATTEMPTS
+        self._repair_lock = threading.Lock()
+        self.inline_repairs = 0     # failed scripts fixed by the inner repair loop
+        self.repair_llm_calls = 0   # coder calls spent in the inner repair loop
+        self.llm_calls_saved = 0    # estimated calls avoided by not escalating to the diagnostician
+        self.checkpoint: Optional[checkpoint.Checkpoint] = None
+        if checkpoint_enabled:
+            self.checkpoint = checkpoint.Checkpoint.create(goal, self.llm_provider.get_name(), self.llm_provider.selected_model,
+                                                           verify, previous_context)
+        self._resuming = False
+        self._reuse_journal_code = False  # only code saved by the interrupted run being resumed is reused
+
+    @classmethod
+    def from_checkpoint(cls, journal: checkpoint.Checkpoint, llm_provider: LLMProvider,
+                        log_func: Callable[[str], None], **kwargs) -> 'Agent':
+        """从检查点恢复：沿用已保存的计划和代码，从第一个未完成的步骤继续。默认使用运行开始时的模型。"""
+        data = journal.data
+        kwargs.setdefault('model', data.get('model'))
+        agent = cls(data['goal'], llm_provider, log_func, data.get('verify', False), data.get('previous_context'),
+                    checkpoint_enabled=False, **kwargs)
+        agent.checkpoint = journal
+        agent.plan = data['plan']
+        agent.final_code_for_step = journal.code_by_step()
+        agent._resuming = agent.plan is not None
+        agent._reuse_journal_code = agent._resuming
+        return agent
 
     def _execute_with_retry(self, func, *args, **kwargs):
-        # ... (unchanged)
-        error_counts = defaultdict(int)
-        while True:
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                strategy = error_handler.analyze_error(e, self.log)
-                error_fingerprint = strategy.error_fingerprint
-                error_counts[error_fingerprint] += 1
-                self.log(f"💡 错误处理策略: {strategy.suggestion}")
-                if error_counts[error_fingerprint] >= self.max_retries:
-                    self.log(f"‼️ 错误 '{error_fingerprint}' 重复出现 {self.max_retries} 次，终止当前操作。")
-                    raise e
-                if strategy.should_retry:
-                    if strategy.retry_delay > 0:
-                        self.log(f"⏳ 等待 {strategy.retry_delay} 秒...")
-                        time.sleep(strategy.retry_delay)
-                    self.log(f"🔄 正在重试 (尝试 {error_counts[error_fingerprint] + 1}/{self.max_retries})...")
-                else:
-                    raise e
+        """
+        带退避的重试：等待时间为带 full jitter 的指数退避（服务端给出 Retry-After 时以其为准）。
+        网络、限流等临时性错误一直重试到本次操作的截止时间 retry_deadline 用完为止；
+        其他可重试错误仍按 max_retries 限制重复次数。
+        """
+        # One span per operation records how many retries it took; each attempt is a child span.
+        with tracing.span("agent.retry", operation=getattr(func, '__name__', repr(func))) as span:
+            error_counts = defaultdict(int)
+            deadline = time.monotonic() + self.retry_deadline
+            retries = 0
+            while True:
+                try:
+                    # A retry must not be answered with the cached completion that just failed.
+                    with bypass_cache() if retries else nullcontext():
+                        result = func(*args, **kwargs)
+                    span.set(retries=retries)
+                    return result
+                except Exception as e:
+                    strategy = error_handler.analyze_error(e, self.log)
+                    error_fingerprint = strategy.error_fingerprint
+                    error_counts[error_fingerprint] += 1
+                    attempt = error_counts[error_fingerprint]
+                    self.log(f"💡 错误处理策略: {strategy.suggestion}")
+                    span.set(retries=retries, last_error=error_fingerprint)
+                    if not strategy.should_retry or abort_requested():
+                        raise e
+                    if not strategy.transient and attempt >= self.max_retries:
+                        self.log(f"‼️ 错误 '{error_fingerprint}' 重复出现 {self.max_retries} 次，终止当前操作。")
+                        raise e
+                    delay = error_handler.backoff_delay(strategy, attempt, RETRY_BACKOFF_CAP_SECONDS)
+                    remaining = deadline - time.monotonic()
+                    if delay > remaining:
+                        self.log(f"‼️ 本次操作的重试时限 ({self.retry_deadline} 秒) 已用完，终止当前操作。")
+                        raise e
+                    if delay > 0:
+                        self.log(f"⏳ 退避等待 {delay:.1f} 秒...")
+                        time.sleep(delay)
+                    retries += 1
+                    limit = "" if strategy.transient else f"/{self.max_retries}"
+                    self.log(f"🔄 正在重试 (尝试 {attempt + 1}{limit}，剩余时限 {max(0.0, deadline - time.monotonic()):.0f} 秒)...")
 
+    @tracing.traced("agent.run", lambda self: {"goal_chars": len(self.goal), "verify": self.verify,
+                                               "provider": self.llm_provider.get_name()})
     def run(self) -> bool:
+        success = self._run_with_diagnostics()
+        tracing.current().set(success=success, llm_calls_saved=self.llm_calls_saved,
+                              run_id=self.checkpoint.run_id if self.checkpoint else None)
+        if self.checkpoint:
+            try:
+                self.checkpoint.finish(success, self.failure_reason)
+            except OSError as e:
+                self.log(f"⚠️ 无法更新检查点: {e}")
+            if not success and self.checkpoint.data['plan'] is not None:
+                self.log(f"💾 检查点已保存，可从未完成的步骤继续: python main.py --resume {self.checkpoint.run_id}")
+        return success
+
+    def _run_with_diagnostics(self) -> bool:
         """The main agent loop, now with a meta-level diagnostic loop."""
         try:
             # The primary execution flow
@@ -57,14 +216,18 @@ class Agent:
             self.log(f"💥 Agent遇到无法恢复的错误，正在启动诊断... 错误详情: {fatal_error}")
             self.log("="*53)
             
-            # Construct context for the diagnostician
+            # Construct context for the diagnostician; for script failures the stderr is what matters
+            error_log = str(fatal_error)
+            if isinstance(fatal_error, executor.ScriptError) and fatal_error.output:
+                error_log += "\n" + fatal_error.output[-4000:]
             context = {
                 "goal": self.goal,
                 "failed_step": self.last_failed_step if hasattr(self, 'last_failed_step') else "N/A",
-                "error_log": str(fatal_error)
+                "error_log": error_log
             }
+            fingerprint = error_handler.fingerprint_error(fatal_error)
             
-            repair_plan = diagnostician.diagnose_and_plan(context, self.llm_provider, self.log)
+            repair_plan = diagnostician.diagnose_and_plan(context, self.llm_provider, self.log, fingerprint)
             
             if not repair_plan:
                 self.log("❌ 诊断失败，无法生成修复计划。任务彻底终止。")
@@ -75,9 +238,17 @@ class Agent:
                 repair_success = self._execute_repair_plan(repair_plan['plan'])
                 if repair_success:
                     self.log("✅ 自我修复成功！正在重试原始任务...")
-                    # After successful repair, try the whole task again
-                    return self._run_primary_task()
+                    # After successful repair, try the whole task again; the plan only counts as working if that succeeds
+                    try:
+                        result = self._run_primary_task()
+                    except Exception as retry_error:
+                        self._record_diagnosis(fingerprint, False)
+                        self.log(f"❌ 修复后重试原始任务仍然失败: {retry_error}。任务终止。")
+                        return False
+                    self._record_diagnosis(fingerprint, result)
+                    return result
                 else:
+                    self._record_diagnosis(fingerprint, False)
                     self.log("❌ 自我修复失败。任务终止。")
                     return False
             elif repair_plan.get("strategy") == "REQUEST_USER_INTERVENTION":
@@ -92,6 +263,16 @@ class Agent:
                 self.log("❓ 未知的诊断策略。任务终止。")
                 return False
 
+    def _record_diagnosis(self, fingerprint: ErrorFingerprint, success: bool):
+        if not DIAGNOSIS_CACHE_ENABLED:
+            return
+        cache = diagnosis_cache.get_cache()
+        if cache.record_outcome(fingerprint, success):
+            self.log("🗑️ 该修复计划未能解决问题，已从诊断缓存中移除。")
+        stats = cache.stats()
+        self.log(f"📚 诊断缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']:.0%}, "
+                 f"已验证计划 {stats['proven']} 个, 淘汰 {stats['evictions']} 个")
+
     def _run_primary_task(self) -> bool:
         """The original task execution logic."""
         self.log("=" * 50)
@@ -107,23 +288,208 @@ class Agent:
         self.log("=" * 50)
         # End of unchanged block
 
-        plan_goal = self._prepare_planning_goal()
-        self.plan = self._execute_with_retry(planner.create_plan, plan_goal, self.llm_provider, self.log)
-        if not self.plan:
-            raise Exception("无法创建计划。") # Let the outer loop handle this
+        if self._resuming:
+            # Only the first attempt resumes; a retry after self-repair plans from scratch as before.
+            self._resuming = False
+            self.log(f"♻️ 从检查点 {self.checkpoint.run_id} 继续，已完成 {self.checkpoint.progress()} 个步骤，沿用保存的计划。")
+        else:
+            self._reuse_journal_code = False
+            plan_goal = self._prepare_planning_goal()
+            self.plan = self._execute_with_retry(planner.create_plan, plan_goal, self.llm_provider, self.log)
+            if not self.plan:
+                raise Exception("无法创建计划。") # Let the outer loop handle this
+            self._checkpoint(lambda journal: journal.record_plan(self.plan))
 
+        dependencies = self._plan_dependencies(self.plan)
         self.log("\n📑 已生成计划:")
         for step in self.plan:
-            self.log(f"  - {step['step_number']}: {step['task']} - {step.get('details') or step.get('description') or step.get('tool_to_modify')}")
+            deps = dependencies[step['step_number']]
+            deps_note = f" (依赖: {', '.join(map(str, sorted(deps)))})" if deps and step.get('depends_on') is not None else ""
+            self.log(f"  - {step['step_number']}: {step['task']} - {step.get('details') or step.get('description') or step.get('tool_to_modify')}{deps_note}")
         
-        for step in self.plan:
-            self.last_failed_step = step # Store context in case of failure
-            self.log(f"\n--- 正在执行步骤 {step['step_number']}: {step['task']} ---")
-            self._execute_step(step)
+        if self.max_parallel_steps > 1 and not self._is_sequential(dependencies):
+            self._run_plan_parallel(dependencies)
+        else:
+            self._run_plan_sequential()
 
         self.log("\n🎉 所有步骤执行完毕，任务成功完成！")
+        self._log_cache_stats()
+        self._log_repair_stats()
         return True
+
+    def _checkpoint(self, record: Callable[[checkpoint.Checkpoint], None]):
+        # The journal is best effort: a full disk must not fail the task itself.
+        if self.checkpoint:
+            try:
+                record(self.checkpoint)
+            except OSError as e:
+                self.log(f"⚠️ 无法写入检查点: {e}")
+
+    def _step_done(self, step: Dict[str, Any]) -> bool:
+        """该步骤在之前的运行中已经成功完成（从检查点恢复时）。"""
+        if self.checkpoint and self.checkpoint.step_status(step['step_number']) == checkpoint.SUCCEEDED:
+            self.log(f"\n⏭️ 步骤 {step['step_number']}: {step['task']} 已在之前的运行中完成，跳过。")
+            return True
+        return False
+
+    def _log_cache_stats(self):
+        cached = find_wrapper(self.llm_provider, CachedProvider)
+        if cached:
+            stats = cached.cache_stats()
+            self.log(f"🗄️ LLM缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+                     f"命中率 {stats['hit_rate']:.0%}, 累计节省约 {stats['saved_seconds']:.1f} 秒")
     
+    def _log_repair_stats(self):
+        if self.repair_llm_calls:
+            self.log(f"🩹 内部修复: 成功修复 {self.inline_repairs} 个脚本, 使用 {self.repair_llm_calls} 次LLM调用, "
+                     f"估计节省 {self.llm_calls_saved} 次LLM调用（相比诊断、重新规划并重新生成代码）。")
+
+    def _escalation_cost(self) -> int:
+        """诊断路径的LLM调用数估计：诊断 + 重新规划 + 重新生成计划中每一步的代码。"""
+        generated = sum(1 for step in (self.plan or []) if step['task'] != "USE_EXISTING_TOOL")
+        return 2 + generated
+
+    def _repairable(self, step: Dict[str, Any], error_output: str) -> bool:
+        """
+        验证脚本失败通常说明目标没有达成；让LLM“修复”它只会削弱检查直到通过。
+        因此验证步骤只在脚本本身有缺陷（VERIFIER_BUG_ERRORS，例如 NameError）时才做内部修复，
+        断言失败或其他异常都交给诊断流程。
+        """
+        if step['task'] != "CREATE_VERIFICATION_TOOL":
+            return True
+        parsed = error_handler.parse_traceback(error_output)
+        if parsed is not None and parsed.exception in VERIFIER_BUG_ERRORS:
+            return True
+        self.log("🔍 验证未通过，不对验证脚本做内部修复。")
+        return False
+
+    def _repair_script(self, step: Dict[str, Any], script_code: str, error_output: str) -> Optional[str]:
+        """把报错和失败的代码交给 coder 修复；无法得到可用代码时返回 None。"""
+        task = step.get('details') or step.get('modification_details') or step.get('description') or ''
+        request = (f"这段代码是为了完成以下任务: {task}\n"
+                   f"运行时失败了，错误输出（stderr）如下:\n```\n{error_output[-4000:]}\n```\n"
+                   "请找出根本原因并修复，返回完整的代码。")
+        def modify_code():
+            try:
+                return coder.modify_code(script_code, request, self.llm_provider, self.log)
+            except preflight.PreflightError as e:
+                self.log(f"⚠️ 修复后的代码仍未通过预检查: {e}")
+                return None
+        # Only transient errors reach the retry loop; pre-flight failures already cost their own fix rounds.
+        return self._execute_with_retry(modify_code)
+
+    def _run_plan_sequential(self):
+        """
+        按顺序执行步骤。开启流水线模式时，执行第N步的同时在后台为第N+1步生成代码；
+        一旦某一步失败，尚未使用的预取结果会被取消或丢弃，正在进行的预取请求也会尽快停止。
+        """
+        prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-prefetch") if self.pipeline else None
+        prefetched: Dict[int, Tuple[Future, List[str]]] = {}
+        abandoned = threading.Event()
+        try:
+            for index, step in enumerate(self.plan):
+                if self._step_done(step):
+                    continue
+                self.last_failed_step = step # Store context in case of failure
+                self.log(f"\n--- 正在执行步骤 {step['step_number']}: {step['task']} ---")
+                if prefetcher and index + 1 < len(self.plan):
+                    next_step = self.plan[index + 1]
+                    if next_step['task'] in PREFETCHABLE_TASKS:
+                        buffer: List[str] = []
+                        # copy_context() so the prefetch's spans join this run's trace
+                        future = prefetcher.submit(contextvars.copy_context().run, self._prefetch_code, next_step, buffer,
+                                                   self._plan_generation(), abandoned)
+                        prefetched[next_step['step_number']] = (future, buffer)
+                self._execute_step(step, prefetched.pop(step['step_number'], None))
+        finally:
+            if prefetcher:
+                abandoned.set()
+                for future, _ in prefetched.values():
+                    future.cancel()
+                prefetcher.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch_code(self, step: Dict[str, Any], buffer: List[str], generation: Optional[int],
+                       abandoned: threading.Event) -> Optional[str]:
+        # Logs are held back until the step actually starts so they do not interleave with the running step.
+        self._log_local.step_log = buffer.append
+        try:
+            with abort_on(abandoned):
+                return self._get_code_for_step(step, generation)
+        finally:
+            self._log_local.step_log = None
+
+    def _plan_dependencies(self, plan: List[Dict[str, Any]]) -> Dict[int, Set[int]]:
+        """
+        根据步骤的 depends_on 计算依赖关系。没有 depends_on 的步骤依赖上一个步骤；
+        只允许依赖排在前面的步骤，因此依赖图一定无环。"2" 这样的数字字符串按编号处理；
+        无法识别的编号改为依赖上一个步骤，宁可少并行也不能提前执行。
+        """
+        step_numbers = {step['step_number'] for step in plan}
+        dependencies: Dict[int, Set[int]] = {}
+        previous = None
+        for step in plan:
+            number = step['step_number']
+            raw = step.get('depends_on')
+            if raw is None:
+                dependencies[number] = {previous} if previous is not None else set()
+            else:
+                raw = raw if isinstance(raw, list) else [raw]
+                parsed = [_step_number(d) for d in raw]
+                valid = {d for d in parsed if d in step_numbers and d < number}
+                if valid != set(parsed):
+                    self.log(f"⚠️ 步骤 {number} 的 depends_on {raw} 包含无效编号，改为依赖上一个步骤。")
+                    if previous is not None:
+                        valid.add(previous)
+                dependencies[number] = valid
+            previous = number
+        return dependencies
+
+    def _is_sequential(self, dependencies: Dict[int, Set[int]]) -> bool:
+        numbers = [step['step_number'] for step in self.plan]
+        return all(dependencies[n] == ({numbers[i - 1]} if i else set()) for i, n in enumerate(numbers))
+
+    def _run_plan_parallel(self, dependencies: Dict[int, Set[int]]):
+        """按依赖关系并行执行步骤，最多同时运行 max_parallel_steps 个。任一步骤失败后不再启动新步骤。"""
+        self.log(f"\n🔀 计划包含可并行的步骤，最多同时执行 {self.max_parallel_steps} 个步骤。")
+        steps = {step['step_number']: step for step in self.plan}
+        router = _StepLogRouter(self._base_log, [step['step_number'] for step in self.plan])
+        done: Set[int] = {step['step_number'] for step in self.plan if self._step_done(step)}
+        pending = {number: deps for number, deps in dependencies.items() if number not in done}
+        for number in done:
+            router.finish(number)
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=self.max_parallel_steps, thread_name_prefix="agent-step") as pool:
+            while pending or running:
+                if failure is None:
+                    for number in sorted(pending):
+                        if pending[number] <= done:
+                            del pending[number]
+                            running[pool.submit(contextvars.copy_context().run, self._run_step_on_worker, steps[number], router)] = number
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    number = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        done.add(number)
+                    elif failure is None or number < failure[0]:
+                        failure = (number, error)
+        router.flush_all()
+        if failure:
+            self.last_failed_step = steps[failure[0]]
+            raise failure[1]
+
+    def _run_step_on_worker(self, step: Dict[str, Any], router: _StepLogRouter):
+        self._log_local.step_log = router.logger_for(step['step_number'])
+        try:
+            self.log(f"\n--- 正在执行步骤 {step['step_number']}: {step['task']} ---")
+            self._execute_step(step)
+        finally:
+            self._log_local.step_log = None
+            router.finish(step['step_number'])
+
     def _execute_repair_plan(self, plan: List[Dict[str, Any]]) -> bool:
         """Executes the steps from the diagnostician's plan."""
         for step in plan:
@@ -132,13 +498,24 @@ class Agent:
             success = False
             
             if task_type == "RUN_COMMAND":
-                success, output = executor.run_command(step['command'], self.log)
-                self.log(f"命令输出:\n{output}")
+                success, output, _ = executor.run_command(step['command'], self.log, limits=self.command_limits)
+                if not STREAM_SCRIPT_OUTPUT:
+                    self.log(f"命令输出:\n{output}")
             elif task_type == "WRITE_AND_EXECUTE_SCRIPT":
-                code = coder.create_code(step['details'], self.llm_provider, self.log)
+                try:
+                    code = self._execute_with_retry(coder.create_code, step['details'], self.llm_provider, self.log)
+                except preflight.PreflightError as e:
+                    self.log(f"⚠️ 修复脚本未通过预检查: {e}")
+                    code = None
+                except Exception as e:
+                    self.log(f"⚠️ 无法生成修复脚本: {e}")
+                    code = None
                 if code:
-                    success, output = executor.run_script(code, "repair_script.py", self.log)
-                    self.log(f"修复脚本输出:\n{output}")
+                    success, output, _ = executor.run_script(code, "repair_script.py", self.log, limits=self.script_limits)
+                    if not STREAM_SCRIPT_OUTPUT:
+                        self.log(f"修复脚本输出:\n{output}")
+            # A repair step may have installed packages; let the pre-flight import check see them.
+            preflight.invalidate()
             
             if not success:
                 self.log(f"❌ 修复步骤 '{step['description']}' 失败。")
@@ -166,25 +543,80 @@ class Agent:
             )
             return context_prompt
 
-    def _execute_step(self, step: Dict[str, Any]):
-        script_code = self._get_code_for_step(step)
+    @tracing.traced("agent.step", lambda self, step, prefetched=None: {"step_number": step['step_number'], "task": step['task'],
+                                                                     "prefetched": prefetched is not None})
+    def _execute_step(self, step: Dict[str, Any], prefetched: Optional[Tuple[Future, List[str]]] = None):
+        if prefetched:
+            future, buffer = prefetched
+            try:
+                script_code = future.result()
+            finally:
+                self.log("⏩ 使用后台预取的代码，生成过程日志如下:")
+                for message in buffer:
+                    self.log(message)
+        else:
+            script_code = self._get_code_for_step(step)
         step_number = step['step_number']
         self.final_code_for_step[step_number] = script_code
         if not script_code:
             raise ValueError("Code generation or retrieval failed for the step.")
-        unique_id = int(time.time() * 1000)
+        unique_id = f"{int(time.time() * 1000)}_{step_number}"
         script_name = f"{step.get('suggested_name', 'tool')}_{unique_id}.py"
-        success, output = executor.run_script(script_code, script_name, self.log)
-        self.log("执行输出:\n" + "-" * 20 + f"\n{output if output else '[无输出]'}\n" + "-" * 20)
+        success, output, limit_hit = self._run_step_script(script_code, script_name)
+        attempts = 0
+        while not success and attempts < self.repair_attempts and self._repairable(step, output):
+            attempts += 1
+            self.log(f"🩹 脚本执行失败，正在根据错误输出修复代码 ({attempts}/{self.repair_attempts})...")
+            with self._repair_lock:
+                self.repair_llm_calls += 1
+            repaired = self._repair_script(step, script_code, output)
+            if not repaired:
+                break
+            script_code = repaired
+            self.final_code_for_step[step_number] = script_code
+            self._checkpoint(lambda journal: journal.record_code(step, script_code, journal.generation))
+            success, output, limit_hit = self._run_step_script(script_code, script_name)
+            if success:
+                with self._repair_lock:
+                    self.inline_repairs += 1
+                    self.llm_calls_saved += max(0, self._escalation_cost() - attempts)
+                self.log(f"✅ 内部修复成功（第 {attempts} 次尝试），无需启动诊断流程。")
+        tracing.current().set(repair_attempts=attempts, success=success)
         if not success:
             self.failure_reason = output
-            raise ChildProcessError(f"脚本执行失败。")
+            self._checkpoint(lambda journal: journal.record_step(step_number, checkpoint.FAILED, output))
+            if limit_hit:
+                raise executor.ResourceLimitError(limit_hit, self.script_limits, output)
+            raise executor.ScriptError("脚本执行失败。", output)
         if step['task'] in ["CREATE_NEW_TOOL", "MODIFY_EXISTING_TOOL"]:
             self.log("✨ 新工具执行成功！正在自动保存...")
             memory_manager.save_tool(step['suggested_name'], step['description'], script_code, self.log)
+        self._checkpoint(lambda journal: journal.record_step(step_number, checkpoint.SUCCEEDED))
+
+    def _run_step_script(self, script_code: str, script_name: str) -> executor.ExecutionResult:
+        result = executor.run_script(script_code, script_name, self.log, limits=self.script_limits)
+        if not STREAM_SCRIPT_OUTPUT:
+            # When streaming, every line has already been logged while the script ran.
+            self.log("执行输出:\n" + "-" * 20 + f"\n{result.output if result.output else '[无输出]'}\n" + "-" * 20)
+        return result
+
+    def _plan_generation(self) -> Optional[int]:
+        return self.checkpoint.generation if self.checkpoint else None
 
-    def _get_code_for_step(self, step: Dict[str, Any]) -> Optional[str]:
-        return self._execute_with_retry(self._get_code_for_step_logic, step)
+    def _get_code_for_step(self, step: Dict[str, Any], generation: Optional[int] = None) -> Optional[str]:
+        """generation: 调用方决定生成这段代码时的计划代数（后台预取在提交时记下），默认为当前计划。"""
+        if generation is None:
+            generation = self._plan_generation()
+        saved = self.checkpoint.code_for(step) if self._reuse_journal_code and self.checkpoint else None
+        if saved:
+            self.log(f"♻️ 使用检查点中保存的步骤 {step['step_number']} 代码，无需重新生成。")
+            return saved
+        code = self._execute_with_retry(self._get_code_for_step_logic, step)
+        if code:
+            # Recorded as soon as it exists, so code prefetched for a step that never started is not lost either.
+            # A prefetch abandoned by a failed step may finish after a re-plan; record_code drops that stale write.
+            self._checkpoint(lambda journal: journal.record_code(step, code, generation))
+        return code
 
     def _get_code_for_step_logic(self, step: Dict[str, Any]) -> Optional[str]:
         task_type = step['task']
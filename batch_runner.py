@@ -0,0 +1,144 @@
+# batch_runner.py
+"""
+无界面批量模式：从 JSONL 文件（或标准输入）逐行读取任务目标，用一组并发的 Agent 执行，
+并把每个目标的结果（是否成功、耗时、LLM调用次数、最终代码）以 JSONL 追加写入输出文件。
+
+输入每行一个 JSON 对象：目标文本取 "goal"，否则取 "title" 和 "body"；编号取 "id" 或 "request_id"，
+都没有时使用行号。输入按行流式读取，同时在途的目标不超过 concurrency 个。
+输出文件中已有结果的编号会被跳过，因此中断后用同样的命令重新运行即可继续。
+"""
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Callable, ContextManager, Dict, Iterator, Optional, Set, TextIO
+
+from agent_core import Agent
+from llm_interface import LLMProvider, CountingProvider
+from settings import BATCH_CONCURRENCY
+
+def iter_goals(stream: TextIO, log_func: Callable[[str], None] = print) -> Iterator[Dict]:
+    """逐行解析输入；空行跳过，无法解析、不是对象或字符串、没有目标的行记录日志后跳过。"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            log_func(f"⚠️ 第 {line_number} 行不是有效的JSON，已跳过: {e}")
+            continue
+        if isinstance(entry, str):
+            entry = {"goal": entry}
+        if not isinstance(entry, dict):
+            log_func(f"⚠️ 第 {line_number} 行应为JSON对象或字符串，已跳过。")
+            continue
+        goal = entry.get("goal") or "\n\n".join(filter(None, (entry.get("title"), entry.get("body"))))
+        if not goal:
+            log_func(f"⚠️ 第 {line_number} 行没有 goal/title/body 字段，已跳过。")
+            continue
+        goal_id = entry.get("id") or entry.get("request_id") or f"line-{line_number}"
+        yield {"id": str(goal_id), "goal": goal, "verify": entry.get("verify")}
+
+def load_done_ids(output_path: str, retry_failed: bool = False) -> Set[str]:
+    """已经写入输出文件的编号；retry_failed 时只算成功的。"""
+    done = set()
+    try:
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short when the previous run was killed
+                if not retry_failed or record.get("success"):
+                    done.add(str(record.get("id")))
+    except FileNotFoundError:
+        pass
+    return done
+
+def run_goal(item: Dict, llm_provider: LLMProvider, verify: bool, quiet: bool,
+             script_limits: Optional[Dict] = None) -> Dict:
+    """在当前线程中执行一个目标，返回它的结果记录。"""
+    goal_id = item["id"]
+    log_lines = []
+
+    def log(message: str):
+        log_lines.append(message)
+        if not quiet:
+            for line in str(message).splitlines() or [""]:
+                print(f"[{goal_id}] {line}", flush=True)
+
+    counter = CountingProvider(llm_provider)
+    agent = None
+    start = time.monotonic()
+    try:
+        # The output file is the batch's resume point; per-goal checkpoint journals would only pile up.
+        agent = Agent(item["goal"], counter, log, item["verify"] if item["verify"] is not None else verify,
+                      script_limits=script_limits, checkpoint_enabled=False)
+        success = agent.run()
+    except Exception as e:
+        log(f"💥 未处理的异常: {e}")
+        success = False
+    record = {
+        "id": goal_id,
+        "success": bool(success),
+        "duration_seconds": round(time.monotonic() - start, 3),
+        "llm_calls": counter.calls,
+        "final_code": {str(step): code for step, code in sorted(agent.final_code_for_step.items())} if agent else {},
+    }
+    if not success:
+        record["failure_reason"] = (agent and agent.failure_reason) or (log_lines[-1] if log_lines else "")
+    return record
+
+def _ends_mid_line(path: str) -> bool:
+    with open(path, 'rb') as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+def run_batch(input_stream: TextIO, output_path: str, llm_provider: LLMProvider,
+              concurrency: int = BATCH_CONCURRENCY, verify: bool = False, quiet: bool = False,
+              retry_failed: bool = False, script_limits: Optional[Dict] = None) -> Dict[str, int]:
+    """执行批量任务，返回统计 {"succeeded", "failed", "skipped"}。"""
+    concurrency = max(1, concurrency)
+    done = load_done_ids(output_path, retry_failed)
+    stats = {"succeeded": 0, "failed": 0, "skipped": 0}
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(output_path, 'a', encoding='utf-8') as output, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        if _ends_mid_line(output_path):
+            output.write("\n")  # keep the first new record off the line a killed run left unfinished
+
+        def write(record: Dict):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()  # a result is durable as soon as it is reported, so an interrupted run can resume
+            stats["succeeded" if record["success"] else "failed"] += 1
+            mark = "✅" if record["success"] else "❌"
+            print(f"{mark} [{record['id']}] {record['duration_seconds']:.1f} 秒, LLM调用 {record['llm_calls']} 次", flush=True)
+
+        in_flight = set()
+        for item in iter_goals(input_stream):
+            if item["id"] in done:
+                stats["skipped"] += 1
+                continue
+            done.add(item["id"])  # duplicate IDs further down the input run only once
+            if len(in_flight) >= concurrency:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(future.result())
+            in_flight.add(pool.submit(run_goal, item, llm_provider, verify, quiet, script_limits))
+        for future in as_completed(in_flight):
+            write(future.result())
+
+    print(f"📦 批量任务完成: 成功 {stats['succeeded']}, 失败 {stats['failed']}, 跳过 {stats['skipped']}（已有结果）。")
+    return stats
+
+def open_input(path: str) -> ContextManager[TextIO]:
+    """打开输入文件；"-" 表示标准输入，用完后不关闭它。"""
+    return nullcontext(sys.stdin) if path == "-" else open(path, 'r', encoding='utf-8')
@@ -0,0 +1,150 @@
+# checkpoint.py
+"""
+Agent 运行的检查点日志。每次运行对应 CHECKPOINT_DIR 下的一个 JSON 文件，记录目标、计划、
+每个步骤生成的代码和执行结果，每一步结束后以原子方式重写。进程崩溃或被终止后，
+可以从第一个未完成的步骤继续，已完成的步骤和已生成的代码不会再次请求LLM。
+运行成功后检查点文件会被删除。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from settings import CHECKPOINT_DIR
+
+PENDING = "pending"
+GENERATED = "generated"   # code is known, the script has not finished successfully yet
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+def step_key(step: Dict[str, Any]) -> str:
+    """步骤内容的指纹，用于确认保存的代码确实是为这个步骤生成的。"""
+    return hashlib.sha256(json.dumps(step, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+class Checkpoint:
+    def __init__(self, data: Dict[str, Any], path: str):
+        self.data = data
+        self.path = path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, goal: str, provider_name: str, model: Optional[str], verify: bool,
+               previous_context: Optional[Dict] = None, directory: str = CHECKPOINT_DIR) -> 'Checkpoint':
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        now = time.time()
+        data = {
+            "run_id": run_id, "goal": goal, "provider": provider_name, "model": model, "verify": verify,
+            "previous_context": previous_context, "status": "running", "created_at": now, "updated_at": now,
+            "plan": None, "plan_generation": 0, "steps": {}, "failure_reason": "",
+        }
+        # Nothing is written until there is a plan: a run that dies before planning has nothing to resume.
+        return cls(data, os.path.join(directory, f"{run_id}.json"))
+
+    @classmethod
+    def load(cls, run_id_or_path: str, directory: str = CHECKPOINT_DIR) -> 'Checkpoint':
+        """按运行编号或文件路径加载；不存在时抛出 FileNotFoundError。"""
+        path = run_id_or_path if run_id_or_path.endswith(".json") else os.path.join(directory, f"{run_id_or_path}.json")
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), path)
+
+    @property
+    def run_id(self) -> str:
+        return self.data["run_id"]
+
+    @property
+    def generation(self) -> int:
+        """每记录一次新计划加一；为旧计划生成的代码不会写入新计划的步骤。"""
+        return self.data.get("plan_generation", 0)
+
+    def _save(self):
+        self.data["updated_at"] = time.time()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def record_plan(self, plan: List[Dict[str, Any]]):
+        """保存新计划；之前记录的步骤结果全部作废。"""
+        with self._lock:
+            self.data["plan"] = plan
+            self.data["plan_generation"] = self.generation + 1
+            self.data["steps"] = {str(step['step_number']): {"status": PENDING, "code": None} for step in plan}
+            self.data["status"] = "running"
+            self._save()
+
+    def record_code(self, step: Dict[str, Any], code: str, generation: int) -> bool:
+        """
+        保存为 step 生成的代码。generation 是开始生成代码时的计划代数；期间计划已被替换
+        （例如被放弃的后台预取在重新规划之后才完成）时不写入，返回 False。
+        """
+        with self._lock:
+            if generation != self.generation:
+                return False
+            entry = self.data["steps"].setdefault(str(step['step_number']), {})
+            entry.update({"status": GENERATED, "code": code, "step_key": step_key(step)})
+            self._save()
+            return True
+
+    def record_step(self, step_number: int, status: str, detail: str = ""):
+        with self._lock:
+            entry = self.data["steps"].setdefault(str(step_number), {})
+            entry.update({"status": status, "finished_at": time.time()})
+            if detail:
+                entry["detail"] = detail[-2000:]
+            self._save()
+
+    def finish(self, success: bool, failure_reason: str = ""):
+        """运行结束：成功时删除检查点，失败时保留以便继续。"""
+        with self._lock:
+            if success:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                return
+            if self.data["plan"] is None:
+                return  # failed before planning; nothing worth resuming
+            self.data["status"] = FAILED
+            self.data["failure_reason"] = (failure_reason or "")[-2000:]
+            self._save()
+
+    def step_status(self, step_number: int) -> str:
+        return self.data["steps"].get(str(step_number), {}).get("status", PENDING)
+
+    def code_for(self, step: Dict[str, Any]) -> Optional[str]:
+        """为这个步骤保存的代码；保存的代码属于内容不同的步骤时返回 None。"""
+        entry = self.data["steps"].get(str(step['step_number']), {})
+        if entry.get("step_key") not in (None, step_key(step)):
+            return None
+        return entry.get("code")
+
+    def code_by_step(self) -> Dict[int, str]:
+        return {int(number): entry["code"] for number, entry in self.data["steps"].items() if entry.get("code")}
+
+    def progress(self) -> str:
+        plan = self.data["plan"] or []
+        done = sum(1 for step in plan if self.step_status(step['step_number']) == SUCCEEDED)
+        return f"{done}/{len(plan)}"
+
+def list_checkpoints(directory: str = CHECKPOINT_DIR) -> List[Checkpoint]:
+    """所有可以继续的检查点，最近更新的在前。"""
+    checkpoints = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            checkpoints.append(Checkpoint.load(os.path.join(directory, name)))
+        except (OSError, json.JSONDecodeError, KeyError):
+            continue
+    checkpoints.sort(key=lambda c: c.data.get("updated_at", 0), reverse=True)
+    return checkpoints
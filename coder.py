@@ -1,6 +1,10 @@
 # coder.py
 from typing import Optional, Callable
-from llm_interface import LLMProvider
+from llm_interface import LLMProvider, ask_streaming
+from settings import STREAM_LLM_OUTPUT, PREFLIGHT_ENABLED, PREFLIGHT_MAX_FIXES
+import preflight
+import error_handler
+import tracing
 
 CODER_SYSTEM_PROMPT = """
 你是一位顶级的Python编程专家。你的任务是根据用户的需求，编写一段完整、可直接运行的Python脚本。
@@ -17,17 +21,24 @@ MODIFIER_SYSTEM_PROMPT = """
 - 确保最终的代码是完整的，包含了所有必要的导入。
 """
 
+@tracing.traced("coder.create_code", lambda task_description, *args, **kwargs: {"task_chars": len(task_description)})
 def create_code(task_description: str, llm_provider: LLMProvider, log_func: Optional[Callable[[str], None]] = print) -> Optional[str]:
     """根据任务描述生成Python代码。"""
     if log_func: log_func(f"🤖 正在为任务 '{task_description}' 请求 '{llm_provider.get_name()}' 生成代码...")
     
     try:
-        code = llm_provider.ask(CODER_SYSTEM_PROMPT, task_description)
-        return _clean_code(code, log_func)
+        code = _ask_for_code(llm_provider, CODER_SYSTEM_PROMPT, task_description, log_func)
+        return _preflight(_clean_code(code, log_func), llm_provider, log_func)
+    except preflight.PreflightError:
+        raise
     except Exception as e:
+        if error_handler.is_transient(e):
+            raise  # let Agent._execute_with_retry back off and retry
         if log_func: log_func(f"❌ 代码生成时发生错误: {e}")
         return None
 
+@tracing.traced("coder.modify_code", lambda original_code, modification_request, *args, **kwargs: {
+    "original_code_chars": len(original_code), "request_chars": len(modification_request)})
 def modify_code(original_code: str, modification_request: str, llm_provider: LLMProvider, log_func: Optional[Callable[[str], None]] = print) -> Optional[str]:
     """根据请求修改现有代码。"""
     if log_func: log_func(f"🤖 正在根据请求 '{modification_request}' 修改现有代码...")
@@ -35,12 +46,27 @@ def modify_code(original_code: str, modification_request: str, llm_provider: LLM
     user_prompt = f"【现有代码】:\n```python\n{original_code}\n```\n\n【修改要求】:\n{modification_request}"
     
     try:
-        code = llm_provider.ask(MODIFIER_SYSTEM_PROMPT, user_prompt)
-        return _clean_code(code, log_func)
+        code = _ask_for_code(llm_provider, MODIFIER_SYSTEM_PROMPT, user_prompt, log_func)
+        return _preflight(_clean_code(code, log_func), llm_provider, log_func)
+    except preflight.PreflightError:
+        raise
     except Exception as e:
+        if error_handler.is_transient(e):
+            raise  # let Agent._execute_with_retry back off and retry
         if log_func: log_func(f"❌ 代码修改时发生错误: {e}")
         return None
 
+def _ask_for_code(llm_provider: LLMProvider, system_prompt: str, user_prompt: str, log_func: Optional[Callable[[str], None]]) -> str:
+    """请求代码；开启流式输出时，生成过程会实时显示在日志中。"""
+    if not (STREAM_LLM_OUTPUT and log_func):
+        code = llm_provider.ask(system_prompt, user_prompt)
+    else:
+        # 返回内容中出现 Traceback 说明生成失败，_clean_code 无论如何都会拒绝，提前取消即可。
+        code = ask_streaming(llm_provider, system_prompt, user_prompt, log_func,
+                             abort_if=lambda text: "Traceback" in text)
+    tracing.current().set(code_chars=len(code or ""))
+    return code
+
 def _clean_code(code: Optional[str], log_func: Optional[Callable[[str], None]] = print) -> Optional[str]:
     """清理LLM返回的代码，移除markdown等。"""
     if not code:
@@ -55,4 +81,26 @@ def _clean_code(code: Optional[str], log_func: Optional[Callable[[str], None]] =
         if log_func: log_func(f"❌ 代码生成失败或返回了错误: {code}")
         return None
         
-    return code
\ No newline at end of file
+    return code
+
+def _preflight(code: Optional[str], llm_provider: LLMProvider, log_func: Optional[Callable[[str], None]] = print) -> Optional[str]:
+    """
+    在进程外执行之前做静态预检查。未通过时把问题列表反馈给LLM修正，
+    最多 PREFLIGHT_MAX_FIXES 轮；仍未通过则抛出 preflight.PreflightError。
+    """
+    if not code or not PREFLIGHT_ENABLED:
+        return code
+    for attempt in range(PREFLIGHT_MAX_FIXES + 1):
+        result = preflight.check_code(code)
+        if result.ok:
+            return code
+        if log_func: log_func(f"🛫 静态预检查未通过 ({result.elapsed_ms:.1f}ms)，未启动进程:\n{result.feedback()}")
+        if attempt == PREFLIGHT_MAX_FIXES:
+            raise preflight.PreflightError(result)
+        if log_func: log_func(f"🔧 正在根据预检查结果重新生成代码 ({attempt + 1}/{PREFLIGHT_MAX_FIXES})...")
+        user_prompt = (f"【现有代码】:\n```python\n{code}\n```\n\n"
+                       f"【修改要求】:\n静态检查发现以下问题，请修正后返回完整代码，保持原有功能不变:\n{result.feedback()}")
+        code = _clean_code(_ask_for_code(llm_provider, MODIFIER_SYSTEM_PROMPT, user_prompt, log_func), log_func)
+        if not code:
+            return None
+    return code
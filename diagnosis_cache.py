@@ -0,0 +1,112 @@
+# diagnosis_cache.py
+"""
+诊断结果缓存：把诊断工程师生成的系统修复计划按错误指纹（error_handler.fingerprint_error）保存到磁盘。
+同一个根本原因（缺少模块、SSL被拦截、代理配置等）再次出现时，直接复用之前修复成功的计划，
+不再请求LLM；复用后修复失败的计划会被淘汰。
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from error_handler import ErrorFingerprint
+from settings import DIAGNOSIS_CACHE_FILE, DIAGNOSIS_CACHE_MAX_ENTRIES
+
+class DiagnosisCache:
+    """
+    条目：指纹 hash -> 修复计划，以及该计划修复成功的次数。
+    只有至少成功过一次、且之后没有失败的计划才会被复用；失败的计划立即删除。
+    """
+    def __init__(self, path: str = DIAGNOSIS_CACHE_FILE, max_entries: int = DIAGNOSIS_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        data = self._load()
+        self._entries: Dict[str, Dict[str, Any]] = data.get("entries", {})
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, **data.get("stats", {})}
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self):
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"stats": self._stats, "entries": self._entries}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+    def lookup(self, fingerprint: ErrorFingerprint) -> Optional[Dict[str, Any]]:
+        """
+        返回之前修复成功的计划；没有时返回 None。命中与未命中都计入统计，
+        统计只在内存中更新，随下一次 store/record_outcome 写入磁盘。
+        """
+        with self._lock:
+            entry = self._entries.get(fingerprint.hash)
+            if entry and entry["successes"] > 0:
+                self._stats["hits"] += 1
+                entry["last_used"] = time.time()
+                plan = entry["plan"]
+            else:
+                self._stats["misses"] += 1
+                plan = None
+            return plan
+
+    def store(self, fingerprint: ErrorFingerprint, plan: Dict[str, Any]):
+        """保存新生成的计划；在 record_outcome 确认修复成功之前不会被复用。"""
+        with self._lock:
+            now = time.time()
+            self._entries[fingerprint.hash] = {
+                "fingerprint": fingerprint._asdict(), "plan": plan, "successes": 0,
+                "created_at": now, "last_used": now,
+            }
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["last_used"])
+                del self._entries[oldest]
+            self._save()
+
+    def record_outcome(self, fingerprint: ErrorFingerprint, success: bool) -> bool:
+        """记录计划执行后任务是否恢复；失败的计划被淘汰。返回是否发生了淘汰。"""
+        with self._lock:
+            entry = self._entries.get(fingerprint.hash)
+            if entry is None:
+                return False
+            if success:
+                entry["successes"] += 1
+                self._save()
+                return False
+            del self._entries[fingerprint.hash]
+            self._stats["evictions"] += 1
+            self._save()
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "proven": sum(1 for entry in self._entries.values() if entry["successes"] > 0),
+            }
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return json.loads(json.dumps(self._entries))
+
+_cache: Optional[DiagnosisCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> DiagnosisCache:
+    """Returns the process-wide diagnosis cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiagnosisCache()
+        return _cache
@@ -2,6 +2,10 @@
 import json
 from typing import Dict, Any, Optional, Callable
 from llm_interface import LLMProvider
+import diagnosis_cache
+from error_handler import ErrorFingerprint
+from settings import DIAGNOSIS_CACHE_ENABLED
+import tracing
 
 DIAGNOSTICIAN_SYSTEM_PROMPT = """
 你是一个AI Agent的首席系统诊断工程师。Agent在执行任务时遇到了一个无法通过代码重试解决的根本性错误。你的任务是分析整个失败上下文，并制定一个【系统级修复计划】。
@@ -51,12 +55,33 @@ DIAGNOSTICIAN_SYSTEM_PROMPT = """
 }
 """
 
+@tracing.traced("diagnostician.diagnose_and_plan")
 def diagnose_and_plan(
     context: Dict[str, Any], 
     llm_provider: LLMProvider, 
-    log_func: Optional[Callable[[str], None]] = print
+    log_func: Optional[Callable[[str], None]] = print,
+    fingerprint: Optional[ErrorFingerprint] = None
 ) -> Optional[Dict[str, Any]]:
-    """Analyzes a fatal error and creates a repair plan."""
+    """
+    Analyzes a fatal error and creates a repair plan.
+    With a fingerprint, a plan that repaired the same error before is reused without asking the LLM,
+    and a new self-repair plan is stored; the caller reports the outcome via diagnosis_cache.get_cache().record_outcome().
+    """
+    cache = diagnosis_cache.get_cache() if DIAGNOSIS_CACHE_ENABLED and fingerprint else None
+    span = tracing.current()
+    if fingerprint:
+        span.set(fingerprint=fingerprint.hash, exception=fingerprint.exception)
+    if cache:
+        cached_plan = cache.lookup(fingerprint)
+        span.set(cache_hit=cached_plan is not None)
+        if cached_plan:
+            if log_func:
+                stats = cache.stats()
+                log_func(f"📚 诊断缓存命中 ({fingerprint.exception} @ {fingerprint.location or '-'})，复用之前修复成功的计划，"
+                         f"无需请求LLM。命中率 {stats['hit_rate']:.0%}")
+                log_func(json.dumps(cached_plan, indent=2, ensure_ascii=False))
+            return cached_plan
+
     if log_func:
         log_func("🤔 遇到致命错误，启动首席诊断工程师...")
         log_func(f"上下文: {context}")
@@ -73,9 +98,12 @@ def diagnose_and_plan(
             response_str = response_str[7:-3].strip()
             
         repair_plan = json.loads(response_str)
+        span.set(strategy=repair_plan.get("strategy"), repair_steps=len(repair_plan.get("plan") or []))
         if log_func:
             log_func(f"ախ 诊断报告与修复计划已生成:")
             log_func(json.dumps(repair_plan, indent=2, ensure_ascii=False))
+        if cache and repair_plan.get("strategy") == "ATTEMPT_SELF_REPAIR":
+            cache.store(fingerprint, repair_plan)
         return repair_plan
     except Exception as e:
         if log_func:
@@ -1,6 +1,29 @@
 # error_handler.py
+import email.utils
+import hashlib
+import random
+import re
 import time
+import traceback
 from typing import NamedTuple, Optional, Callable
+from executor import ResourceLimitError
+from preflight import PreflightError
+
+class ErrorFingerprint(NamedTuple):
+    """
+    一次失败的结构化指纹：异常类型、出错的模块/函数/行号（traceback 最后一帧）和去掉路径、数字的消息。
+    hash 不包含行号，因此同一个错误在代码被重新生成、行号变化后仍然得到相同的 hash。
+    """
+    exception: str
+    module: str
+    function: str
+    line: Optional[int]
+    message: str
+    hash: str
+
+    @property
+    def location(self) -> str:
+        return f"{self.module}:{self.line}" if self.line else self.module
 
 # 定义一个数据结构来承载修复策略
 class FixStrategy(NamedTuple):
@@ -8,6 +31,162 @@ class FixStrategy(NamedTuple):
     retry_delay: int  # in seconds
     suggestion: str
     error_fingerprint: str # A unique key for this type of error
+    retry_after: Optional[float] = None  # seconds the server asked us to wait (Retry-After and friends)
+    transient: bool = False  # load/network related: retried until the operation deadline, not a fixed count
+    fingerprint: Optional[ErrorFingerprint] = None  # parsed traceback, for script and unclassified errors
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parses "1.5", "20ms", "6m0s", "1h2m3.5s" (x-ratelimit-reset-*) or an HTTP date into seconds."""
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def retry_after_seconds(e: BaseException) -> Optional[float]:
+    """
+    从SDK异常中提取服务端要求的等待时间（duck typing，不依赖具体SDK）：
+    OpenAI 的 response.headers（retry-after-ms / retry-after / x-ratelimit-reset-*），
+    Google 的 RetryInfo 详情或 "retry in 23.5s" 形式的消息，以及异常自带的 retry_after 属性。
+    """
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(getattr(e, 'retry_after', None), (int, float)):
+            return float(e.retry_after)  # our own errors, e.g. llm_interface.CircuitOpenError
+        headers = getattr(getattr(e, 'response', None), 'headers', None)
+        if headers is not None:
+            if headers.get('retry-after-ms'):
+                try:
+                    return float(headers['retry-after-ms']) / 1000
+                except ValueError:
+                    pass
+            if headers.get('retry-after'):
+                wait = _parse_duration(headers['retry-after'])
+                if wait is not None:
+                    return wait
+            # Otherwise wait for the reset of whichever budget (requests or tokens) is exhausted.
+            resets = {kind: _parse_duration(headers[f'x-ratelimit-reset-{kind}'])
+                      for kind in ('requests', 'tokens') if headers.get(f'x-ratelimit-reset-{kind}')}
+            resets = {kind: wait for kind, wait in resets.items() if wait is not None}
+            exhausted = [wait for kind, wait in resets.items() if str(headers.get(f'x-ratelimit-remaining-{kind}')) == '0']
+            if exhausted or resets:
+                return max(exhausted) if exhausted else min(resets.values())
+        for detail in getattr(e, 'details', None) or []:
+            delay = getattr(detail, 'retry_delay', None)
+            if delay is not None and hasattr(delay, 'seconds'):
+                return delay.seconds + getattr(delay, 'nanos', 0) / 1e9
+        match = re.search(r"retry (?:in|after) ([\d.]+)\s*s", str(e), re.IGNORECASE)
+        if match:
+            return float(match.group(1))
+        e = e.__cause__ or e.__context__
+    return None
+
+def _status_code(e: BaseException) -> Optional[int]:
+    status = getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(strategy: FixStrategy, attempt: int, cap: float) -> float:
+    """
+    第 attempt 次重试（从1开始）前的等待时间：以 retry_delay 为基数的指数退避，
+    上限为 cap，并使用 full jitter（在 [0, 上限] 内均匀随机）避免多个任务同时重试。
+    服务端给出 retry_after 时至少等待该时间，再加最多 25% 的随机量错开请求。
+    """
+    if strategy.retry_after is not None:
+        return strategy.retry_after * (1 + random.uniform(0, 0.25))
+    if strategy.retry_delay <= 0:
+        return 0.0
+    return random.uniform(0, min(cap, strategy.retry_delay * 2 ** (attempt - 1)))
+
+# Only the end of stderr is parsed: the last traceback is what failed, and a multi-megabyte log
+# then costs the same as a short one.
+_TRACEBACK_WINDOW = 64 * 1024
+_TRACEBACK_HEADER = "Traceback (most recent call last):"
+_FRAME_RE = re.compile(r'^[ \t]*File "([^"]+)", line (\d+)(?:, in (.+))?$', re.MULTILINE)
+_PATH_RE = re.compile(r"""(?:[A-Za-z]:)?(?:[\\/][^\s'"\\/:]+)+[\\/]?""")
+# The greedy prefix picks the last marker: .../lib/python3.11/site-packages/requests/x.py is "requests.x".
+_LIBRARY_RE = re.compile(r"^.*(?:site-packages|dist-packages|lib/python\d+(?:\.\d+)?)/(.+?)(?:/__init__)?\.py$")
+
+def normalize_message(message: str) -> str:
+    """去掉消息中随运行变化的部分：路径、内存地址、数字。"""
+    message = _PATH_RE.sub("<path>", message)
+    message = re.sub(r"0x[0-9a-fA-F]+", "<addr>", message)
+    message = re.sub(r"\d+", "<n>", message)
+    return " ".join(message.split())[:300]
+
+def _module_name(path: str) -> str:
+    """文件路径 -> 稳定的模块名：生成的脚本统一为 <script>，库文件为点分模块名。"""
+    path = path.replace("\\", "/")
+    if "/generated_scripts/" in f"/{path}" or path.startswith("<string>") or path.startswith("<stdin>"):
+        return "<script>"  # generated scripts are named after hashes and timestamps
+    if path.startswith("<"):
+        return path  # e.g. <frozen importlib._bootstrap>
+    match = _LIBRARY_RE.search(path)
+    if match:
+        return match.group(1).replace("/", ".")
+    name = path.rsplit("/", 1)[-1]
+    return name[:-3] if name.endswith(".py") else name
+
+def _make_fingerprint(exception: str, module: str, function: str, line: Optional[int], message: str) -> ErrorFingerprint:
+    message = normalize_message(message)
+    digest = hashlib.sha1(f"{exception}\n{module}\n{function}\n{message}".encode('utf-8')).hexdigest()[:12]
+    return ErrorFingerprint(exception, module, function, line, message, digest)
+
+def parse_traceback(output: str) -> Optional[ErrorFingerprint]:
+    """
+    解析脚本输出（stderr）中的最后一个 Python traceback（包括没有 Traceback 标题的语法错误）；
+    没有 traceback 时返回 None。
+    链式异常（During handling of ...）以最后抛出的那个为准。
+    """
+    if not output:
+        return None
+    tail = output[-_TRACEBACK_WINDOW:]
+    start = tail.rfind(_TRACEBACK_HEADER)
+    # A SyntaxError in the script itself is reported without the header, as a single frame.
+    block = tail[start + len(_TRACEBACK_HEADER):] if start != -1 else tail
+    module, function, line = "", "", None
+    last_frame = None
+    for last_frame in _FRAME_RE.finditer(block):
+        pass
+    if start == -1 and last_frame is None:
+        return None
+    if last_frame:
+        module, line, function = _module_name(last_frame.group(1)), int(last_frame.group(2)), last_frame.group(3) or ""
+        block = block[last_frame.end():]
+    # The exception line is the first unindented line after the frames ("KeyError: 'x'", "socket.timeout: ...").
+    for text in block.splitlines():
+        if text and not text[0].isspace():
+            exception, _, message = text.partition(":")
+            return _make_fingerprint(exception.strip(), module, function.strip(), line, message.strip())
+    return None
+
+def fingerprint_error(e: BaseException, output: Optional[str] = None) -> ErrorFingerprint:
+    """
+    为异常生成指纹：优先解析脚本输出（output，默认取 executor.ScriptError 的 output）中的 traceback，
+    其次使用异常自身的 traceback，最后退回到输出的最后一行或异常消息。
+    """
+    output = output if output is not None else getattr(e, 'output', None)
+    parsed = parse_traceback(output)
+    if parsed:
+        return parsed
+    error_type = type(e).__name__
+    frames = traceback.extract_tb(e.__traceback__) if e.__traceback__ else []
+    if frames:
+        frame = frames[-1]
+        return _make_fingerprint(error_type, _module_name(frame.filename), frame.name, frame.lineno, str(e))
+    last_line = next((text for text in reversed((output or "")[-_TRACEBACK_WINDOW:].splitlines()) if text.strip()), "")
+    return _make_fingerprint(error_type, "<script>" if output else "", "", None, last_line or str(e))
 
 def analyze_error(e: Exception, log_func: Optional[Callable[[str], None]] = print) -> FixStrategy:
     """
@@ -20,17 +199,31 @@ def analyze_error(e: Exception, log_func: Optional[Callable[[str], None]] = prin
         log_func(f"🕵️‍♂️ Analyzing error: {error_type} - {error_message}")
 
     # --- Network and API Errors ---
-    if isinstance(e, ConnectionError) or "TSI_DATA_CORRUPTED" in error_message:
+    status = _status_code(e)
+    if status == 429 or error_type in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        retry_after = retry_after_seconds(e)
         return FixStrategy(
             should_retry=True, retry_delay=5,
-            suggestion="网络连接错误或SSL问题。将等待5秒后重试...",
-            error_fingerprint="network.connection"
+            suggestion=f"API请求频率或配额受限，将按服务端要求等待{f' {retry_after:.1f} 秒' if retry_after is not None else ''}后退避重试...",
+            error_fingerprint="api.rate_limit", retry_after=retry_after, transient=True
         )
-    if isinstance(e, TimeoutError):
+    if isinstance(e, ConnectionError) or "TSI_DATA_CORRUPTED" in error_message or error_type in ("APIConnectionError", "ServiceUnavailable"):
+        return FixStrategy(
+            should_retry=True, retry_delay=5,
+            suggestion="网络连接错误或SSL问题。将退避后重试...",
+            error_fingerprint="network.connection", retry_after=retry_after_seconds(e), transient=True
+        )
+    if isinstance(e, TimeoutError) or error_type in ("APITimeoutError", "DeadlineExceeded"):
         return FixStrategy(
             should_retry=True, retry_delay=10,
-            suggestion="API请求超时。将等待10秒后重试...",
-            error_fingerprint="network.timeout"
+            suggestion="API请求超时。将退避后重试...",
+            error_fingerprint="network.timeout", transient=True
+        )
+    if status is not None and 500 <= status < 600:
+        return FixStrategy(
+            should_retry=True, retry_delay=5,
+            suggestion=f"API服务端错误 ({status})。将退避后重试...",
+            error_fingerprint="api.server_error", retry_after=retry_after_seconds(e), transient=True
         )
     if isinstance(e, ValueError) and ("API Key" in error_message or "model" in error_message):
         return FixStrategy(
@@ -46,16 +239,32 @@ def analyze_error(e: Exception, log_func: Optional[Callable[[str], None]] = prin
         )
 
     # --- Code Execution Errors ---
+    if isinstance(e, ResourceLimitError):
+        return FixStrategy(
+            should_retry=False, # Rerunning the same code would hit the same limit
+            retry_delay=0,
+            suggestion=f"{error_message} 需要修改代码以降低资源占用（如死循环、过大的数据），或在 script_limits 中放宽限制。",
+            error_fingerprint=f"execution.limit.{e.limit}",
+            fingerprint=fingerprint_error(e)
+        )
     if isinstance(e, ChildProcessError):
-        # We can make this more granular if needed, e.g., by parsing stderr
+        # Agent._execute_step has already fed stderr back to the coder before raising this
+        fingerprint = fingerprint_error(e)
         return FixStrategy(
             should_retry=False, # Script errors usually require code changes
             retry_delay=0,
-            suggestion="脚本执行失败。未来的版本将尝试调试此错误。",
-            error_fingerprint=f"execution.script_error"
+            suggestion=f"脚本执行失败（{fingerprint.exception} @ {fingerprint.location}），内部修复循环已用尽，需要进一步诊断。",
+            error_fingerprint=f"execution.script_error.{fingerprint.hash}",
+            fingerprint=fingerprint
         )
     
     # --- Planning and Coding Errors ---
+    if isinstance(e, PreflightError):
+        return FixStrategy(
+            should_retry=True, retry_delay=0, # Nothing to wait for, regenerate from scratch
+            suggestion=f"生成的代码未通过静态预检查（{e.kind}），已多次修正无效。将重新生成...",
+            error_fingerprint=f"codegen.preflight.{e.kind}"
+        )
     if "JSONDecodeError" in error_type:
         return FixStrategy(
             should_retry=True, retry_delay=2,
@@ -70,8 +279,14 @@ def analyze_error(e: Exception, log_func: Optional[Callable[[str], None]] = prin
         )
     
     # --- Default Catch-all ---
+    fingerprint = fingerprint_error(e)
     return FixStrategy(
         should_retry=True, retry_delay=3,
-        suggestion=f"遇到未知错误: '{error_message[:100]}...'。将重试。",
-        error_fingerprint=f"unknown.{error_type}"
-    )
\ No newline at end of file
+        suggestion=f"遇到未知错误: '{error_message[:100]}...'（{fingerprint.location}）。将重试。",
+        error_fingerprint=f"unknown.{error_type}.{fingerprint.hash}",
+        fingerprint=fingerprint
+    )
+
+def is_transient(e: BaseException) -> bool:
+    """网络、限流或服务端临时错误：调用方应当把异常抛给 Agent 的重试循环，而不是吞掉。"""
+    return analyze_error(e, None).transient
@@ -3,56 +3,511 @@ import subprocess
 import os
 import sys
 import shlex # Use shlex for safer command splitting
-from typing import Tuple, Optional, Callable
-from settings import SCRIPTS_DIR
+import atexit
+import functools
+import hashlib
+import py_compile
+import signal
+import threading
+import time
+from collections import Counter, deque
+from typing import Tuple, Optional, Callable, BinaryIO, Dict, Any, NamedTuple, List, Set
+from settings import (SCRIPTS_DIR, SCRIPT_CACHE_DIR, SCRIPT_RETENTION, SCRIPT_GC_INTERVAL_SECONDS, WORKER_POOL_ENABLED, WORKER_POOL_SIZE, WORKER_MAX_RUNS, WORKER_PRELOAD_MODULES,
+                      STREAM_SCRIPT_OUTPUT, OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES, OUTPUT_LOG_MAX_LINES, SCRIPT_LIMITS)
+import worker_pool
+import memory_manager
+import tracing
 
-def run_command(command: str, log_func: Optional[Callable[[str], None]] = print) -> Tuple[bool, str]:
-    """Runs a shell command safely."""
+class ResourceLimits(NamedTuple):
+    """单次运行的资源限制，None 表示不限制。"""
+    timeout_seconds: Optional[float] = None
+    cpu_seconds: Optional[int] = None
+    memory_mb: Optional[int] = None
+    file_size_mb: Optional[int] = None
+    max_processes: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, *layers: Optional[Dict[str, Any]]) -> 'ResourceLimits':
+        """
+        按顺序合并多层配置（settings.SCRIPT_LIMITS → 提供者的 "script_limits" → 任务），
+        后面的覆盖前面的，显式的 null 表示取消该限制；未知的键被忽略。
+        """
+        values: Dict[str, Any] = {}
+        for layer in layers:
+            for key, value in (layer or {}).items():
+                if key in cls._fields:
+                    values[key] = value
+        return cls(**values)
+
+    def rlimits(self) -> Dict[str, Tuple[int, int]]:
+        """Limits for worker_pool.apply_rlimits(), keyed by resource constant name."""
+        limits = {}
+        if self.cpu_seconds:
+            # SIGXCPU at the soft limit; the hard limit (SIGKILL) one second later catches scripts that ignore it.
+            limits['RLIMIT_CPU'] = (int(self.cpu_seconds), int(self.cpu_seconds) + 1)
+        if self.memory_mb:
+            limits['RLIMIT_AS'] = (int(self.memory_mb) << 20,) * 2
+        if self.file_size_mb:
+            limits['RLIMIT_FSIZE'] = (int(self.file_size_mb) << 20,) * 2
+        if self.max_processes:
+            limits['RLIMIT_NPROC'] = (int(self.max_processes),) * 2
+        return limits
+
+    def describe(self, limit: str) -> str:
+        return {
+            "timeout": f"运行时间超过 {self.timeout_seconds} 秒",
+            "cpu": f"CPU 时间超过 {self.cpu_seconds} 秒",
+            "memory": f"内存超过 {self.memory_mb} MB",
+            "file_size": f"写入的文件超过 {self.file_size_mb} MB",
+            "processes": f"进程数超过 {self.max_processes}",
+        }.get(limit, limit)
+
+DEFAULT_LIMITS = ResourceLimits.from_config(SCRIPT_LIMITS)
+
+class ExecutionResult(NamedTuple):
+    success: bool
+    output: str
+    limit_hit: Optional[str] = None  # "timeout", "cpu", "memory", "file_size" or "processes"
+
+class ScriptError(ChildProcessError):
+    """脚本执行失败；output 为脚本的（有界）输出，包含 stderr 中的 traceback。"""
+    def __init__(self, message: str, output: str = ""):
+        super().__init__(message)
+        self.output = output
+
+class ResourceLimitError(ScriptError):
+    """脚本因触发资源限制而失败，limit 为 ExecutionResult.limit_hit 中的名称。"""
+    def __init__(self, limit: str, limits: ResourceLimits = DEFAULT_LIMITS, output: str = ""):
+        super().__init__(f"脚本触发资源限制: {limits.describe(limit)}。", output)
+        self.limit = limit
+
+_READ_LINE_LIMIT = 64 * 1024  # a "line" without newline is split into chunks of this size
+
+class OutputCapture:
+    """
+    有界的输出捕获：只保留前 head_bytes 和后 tail_bytes 字节，中间部分只计数。
+    无论脚本输出多少，内存占用都不超过 head_bytes + tail_bytes (+ 一行)。
+    """
+    def __init__(self, head_bytes: int = OUTPUT_HEAD_BYTES, tail_bytes: int = OUTPUT_TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail: deque = deque()
+        self.tail_size = 0
+        self.total_bytes = 0
+
+    def feed(self, chunk: bytes):
+        self.total_bytes += len(chunk)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk or self.tail_bytes <= 0:
+            return
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+            self.tail_size -= len(self.tail.popleft())
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - len(self.head) - min(self.tail_size, self.tail_bytes)
+
+    def getvalue(self) -> bytes:
+        tail = b"".join(self.tail)[-self.tail_bytes:] if self.tail_bytes > 0 else b""
+        if self.dropped_bytes:
+            marker = f"\n... [省略了 {self.dropped_bytes} 字节] ...\n".encode('utf-8')
+            return bytes(self.head) + marker + tail
+        return bytes(self.head) + tail
+
+def _decode(data: bytes, fallback_encoding: str) -> str:
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode(fallback_encoding, errors='replace')
+
+def _pump(stream: BinaryIO, capture: OutputCapture, log_func: Optional[Callable[[str], None]], prefix: str):
+    """Reads a pipe until EOF, feeding the capture and forwarding complete lines to log_func."""
+    forwarded = 0
+    try:
+        for chunk in iter(lambda: stream.readline(_READ_LINE_LIMIT), b""):
+            capture.feed(chunk)
+            if not log_func:
+                continue
+            if forwarded < OUTPUT_LOG_MAX_LINES:
+                log_func(f"{prefix}{_decode(chunk, sys.getdefaultencoding()).rstrip()}")
+            elif forwarded == OUTPUT_LOG_MAX_LINES:
+                log_func(f"{prefix}... (输出过多，后续内容不再实时显示)")
+            forwarded += 1
+    finally:
+        stream.close()
+
+def bind_log(log_func: Optional[Callable[[str], None]]) -> Optional[Callable[[str], None]]:
+    """
+    Resolves a thread-routed logger (one with a resolve() method, like Agent.log) on the calling thread.
+    The output pumps run on their own threads, where such a logger would fall back to its default target.
+    """
+    resolve = getattr(log_func, 'resolve', None)
+    return resolve() if resolve else log_func
+
+def _collect_output(process, log_func: Optional[Callable[[str], None]], stream: bool,
+                    timeout: Optional[float] = None) -> Tuple[OutputCapture, OutputCapture, bool]:
+    """
+    并行读取进程的 stdout/stderr 直到结束并等待进程退出。
+    stream=True 时每一行到达后立即转发给 log_func（stdout 前缀 "│"，stderr 前缀 "┆"）。
+    超过 timeout 秒时杀掉整个进程组。返回两个捕获结果以及是否超时。
+    """
+    timed_out = threading.Event()
+    def on_timeout():
+        timed_out.set()
+        _kill_process_group(process)
+    timer = threading.Timer(timeout, on_timeout) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    captures = (OutputCapture(), OutputCapture())
+    forward = log_func if stream else None
+    readers = [
+        threading.Thread(target=_pump, args=(process.stdout, captures[0], forward, "  │ "), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, captures[1], forward, "  ┆ "), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    process.wait()
+    if timer:
+        timer.cancel()
+    if log_func and (captures[0].dropped_bytes or captures[1].dropped_bytes):
+        log_func(f"✂️ 输出过长，仅保留首尾部分：stdout 省略 {captures[0].dropped_bytes} 字节，"
+                 f"stderr 省略 {captures[1].dropped_bytes} 字节。")
+    return captures[0], captures[1], timed_out.is_set()
+
+def _finish(process, stderr: str, limits: ResourceLimits, timed_out: bool,
+            log_func: Optional[Callable[[str], None]]) -> Optional[str]:
+    limit_hit = _detect_limit(process.returncode, stderr, limits, timed_out)
+    if limit_hit:
+        # Children the process left behind share its process group.
+        _kill_process_group(process)
+        if log_func: log_func(f"⛔ 触发资源限制: {limits.describe(limit_hit)}，进程组已被终止。")
+    return limit_hit
+
+_pool: Optional[worker_pool.WorkerPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> Optional[worker_pool.WorkerPool]:
+    """Returns the shared warm worker pool, or None when it is disabled or unsupported on this platform."""
+    global _pool
+    if not WORKER_POOL_ENABLED or not worker_pool.is_supported():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = worker_pool.WorkerPool(WORKER_POOL_SIZE, WORKER_MAX_RUNS, list(WORKER_PRELOAD_MODULES))
+            atexit.register(_pool.close)
+        return _pool
+
+def warm_up():
+    """在后台预先启动 worker，让第一个脚本也不必承担解释器启动的开销。"""
+    pool = get_pool()
+    if pool:
+        pool.warm_up()
+
+def _set_rlimits(resolved: List[Tuple[int, Tuple[int, int]]]):
+    # Runs between fork and exec in a multi-threaded parent: bare setrlimit calls only, no imports.
+    for key, value in resolved:
+        worker_pool.resource.setrlimit(key, value)
+
+def _popen(args, limits: ResourceLimits, env: Optional[dict] = None) -> subprocess.Popen:
+    """
+    Starts a process in its own session (so the group can be killed) with the rlimits applied.
+    Where prlimit(2) exists the limits are set on the new pid right after spawning, so nothing runs in the child
+    between fork and exec; elsewhere a minimal preexec_fn sets them.
+    """
+    resolved = worker_pool.resolve_rlimits(limits.rlimits()) if os.name == 'posix' else []
+    use_prlimit = hasattr(worker_pool.resource, 'prlimit')
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, start_new_session=True,
+        preexec_fn=functools.partial(_set_rlimits, resolved) if resolved and not use_prlimit else None,
+    )
+    if resolved and use_prlimit:
+        try:
+            for key, value in resolved:
+                worker_pool.resource.prlimit(process.pid, key, value)
+        except ProcessLookupError:
+            pass  # already exited
+        except OSError:
+            _kill_process_group(process)
+            process.wait()
+            raise
+    return process
+
+def script_cache_key(script_code: str) -> str:
+    """脚本缓存的键：源码字节的 sha256（不做规范化，保证 traceback 中的行号与源码一致）。"""
+    return hashlib.sha256(script_code.encode(sys.getdefaultencoding(), errors='ignore')).hexdigest()
+
+def _cached_script(script_code: str) -> Tuple[str, str, bool]:
+    """
+    按内容哈希把脚本写入 SCRIPT_CACHE_DIR 并预编译为 .pyc，已存在时直接复用。
+    返回 (要执行的文件, 源文件, 是否命中缓存)。编译失败（语法错误）时执行源文件，让错误照常出现在 stderr。
+    """
+    os.makedirs(SCRIPT_CACHE_DIR, exist_ok=True)
+    key = script_cache_key(script_code)
+    source_path = os.path.join(SCRIPT_CACHE_DIR, f"{key}.py")
+    # The cache tag keeps bytecode from another interpreter version from ever being run.
+    compiled_path = os.path.join(SCRIPT_CACHE_DIR, f"{key}.{sys.implementation.cache_tag}.pyc")
+    if os.path.exists(compiled_path) and os.path.exists(source_path):
+        try:
+            # The mtime doubles as "last used" for the retention policy.
+            os.utime(source_path)
+        except OSError:
+            pass
+        return compiled_path, source_path, True
+    if not os.path.exists(source_path):
+        # Write-then-rename so concurrent steps never run a half-written file.
+        temp_path = f"{source_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding=sys.getdefaultencoding(), errors='ignore') as f:
+            f.write(script_code)
+        os.replace(temp_path, source_path)
+    try:
+        py_compile.compile(source_path, cfile=compiled_path, dfile=os.path.abspath(source_path), doraise=True)
+    except py_compile.PyCompileError:
+        return source_path, source_path, False
+    return compiled_path, source_path, False
+
+# Cache keys of scripts that are currently being written or executed; never garbage-collected.
+_active_scripts: Counter = Counter()
+_active_lock = threading.Lock()
+
+def _script_key(path: str) -> Optional[str]:
+    """Cache key of a file in SCRIPT_CACHE_DIR ("<key>.py", "<key>.<tag>.pyc"), None for other files."""
+    name = os.path.basename(path)
+    key = name.split('.', 1)[0]
+    return key if len(key) == 64 and name.endswith(('.py', '.pyc')) else None
+
+def _file_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r', encoding=sys.getdefaultencoding(), errors='ignore') as f:
+            return script_cache_key(f.read())
+    except OSError:
+        return None
+
+def _is_generated_file(directory: str, name: str) -> bool:
+    """
+    Only files the executor writes are subject to the retention policy: per-run scripts ("*.py") at the top level,
+    "<key>.py"/"<key>.<tag>.pyc" in the cache and their write-then-rename temp files. Dotfiles such as the
+    tracked .gitkeep and anything else a user put there are left alone.
+    """
+    if name.startswith('.'):
+        return False
+    if name.endswith('.tmp'):
+        return True
+    if directory == SCRIPT_CACHE_DIR:
+        return _script_key(name) is not None
+    return name.endswith('.py')
+
+def collect_script_garbage(retention: Optional[Dict[str, Any]] = None,
+                           log_func: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """
+    按保留策略清理 SCRIPTS_DIR（包括脚本缓存）中生成的文件（见 _is_generated_file）。先删除超过 max_age_days 的脚本，
+    再按最近使用时间从旧到新删除，直到文件数和总大小都在限制内。
+    代码仍在工具库中的脚本和正在运行的脚本永远不会被删除。返回清理统计。
+    """
+    retention = {**SCRIPT_RETENTION, **(retention or {})}
+    # A cached script and its .pyc are one entry; legacy per-run files at the top level are entries of their own.
+    entries: Dict[str, Dict[str, Any]] = {}
+    now = time.time()
+    for directory in (SCRIPTS_DIR, SCRIPT_CACHE_DIR):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or not _is_generated_file(directory, name):
+                continue
+            if name.endswith('.tmp'):
+                if now - st.st_mtime > 3600:  # left behind by a crashed writer
+                    entries[path] = {"paths": [path], "size": st.st_size, "mtime": 0, "key": None}
+                continue
+            key = _script_key(path) if directory == SCRIPT_CACHE_DIR else None
+            entry = entries.setdefault(key or path, {"paths": [], "size": 0, "mtime": 0, "key": key})
+            entry["paths"].append(path)
+            entry["size"] += st.st_size
+            entry["mtime"] = max(entry["mtime"], st.st_mtime)
+
+    protected: Set[str] = {script_cache_key(tool.get('code', '')) for tool in memory_manager.load_tools()}
+    with _active_lock:
+        protected.update(_active_scripts)
+
+    def is_protected(entry: Dict[str, Any]) -> bool:
+        key = entry["key"]
+        if key is None and entry["paths"][0].endswith('.py'):
+            key = _file_hash(entry["paths"][0])
+        return key in protected
+
+    total_files = sum(len(e["paths"]) for e in entries.values())
+    total_bytes = sum(e["size"] for e in entries.values())
+    stats = {"deleted_files": 0, "reclaimed_bytes": 0, "protected_files": 0}
+    max_files, max_bytes, max_age_days = retention.get("max_files"), retention.get("max_bytes"), retention.get("max_age_days")
+    oldest_allowed = now - max_age_days * 86400 if max_age_days is not None else None
+    for entry in sorted(entries.values(), key=lambda e: e["mtime"]):
+        expired = oldest_allowed is not None and entry["mtime"] < oldest_allowed
+        over_files = max_files is not None and total_files > max_files
+        over_bytes = max_bytes is not None and total_bytes > max_bytes
+        if not (expired or over_files or over_bytes):
+            break  # entries are oldest first, so everything after this is kept as well
+        if is_protected(entry):
+            stats["protected_files"] += len(entry["paths"])
+            continue
+        for path in entry["paths"]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            stats["deleted_files"] += 1
+        total_files -= len(entry["paths"])
+        total_bytes -= entry["size"]
+        stats["reclaimed_bytes"] += entry["size"]
+    stats.update({"remaining_files": total_files, "remaining_bytes": total_bytes})
+    if log_func:
+        log_func(f"🧹 脚本目录清理完成: 删除 {stats['deleted_files']} 个文件, 释放 {stats['reclaimed_bytes'] / 1024 / 1024:.2f} MB; "
+                 f"剩余 {total_files} 个文件 ({total_bytes / 1024 / 1024:.2f} MB), 受保护跳过 {stats['protected_files']} 个。")
+    return stats
+
+_gc_thread: Optional[threading.Thread] = None
+
+def start_background_gc(interval: float = SCRIPT_GC_INTERVAL_SECONDS):
+    """启动后台线程，每隔 interval 秒按 SCRIPT_RETENTION 清理一次脚本目录（重复调用无副作用）。"""
+    global _gc_thread
+    def loop():
+        while True:
+            try:
+                collect_script_garbage()
+            except Exception:
+                pass  # housekeeping must never take the agent down
+            time.sleep(interval)
+    with _active_lock:
+        if _gc_thread is None and interval:
+            _gc_thread = threading.Thread(target=loop, name="script-gc", daemon=True)
+            _gc_thread.start()
+
+def _start_script(script_path: str, limits: ResourceLimits, unbuffered: bool = False, source_path: Optional[str] = None):
+    """优先在预热的 worker 中启动脚本，没有可用 worker 时回退到全新的解释器进程。"""
+    env = dict(os.environ, PYTHONUNBUFFERED='1') if unbuffered else None
+    pool = get_pool()
+    if pool:
+        process = pool.run(script_path, env, limits.rlimits(), source_path)
+        if process is not None:
+            return process
+    return _popen([sys.executable, script_path], limits, env)
+
+def _kill_process_group(process):
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    else:
+        process.kill()
+
+def _detect_limit(returncode: int, stderr: str, limits: ResourceLimits, timed_out: bool) -> Optional[str]:
+    """根据退出状态和 stderr 尾部判断脚本触发了哪项资源限制。"""
+    if timed_out:
+        return "timeout"
+    if returncode == 0:
+        return None
+    tail = stderr[-2000:]
+    if limits.cpu_seconds and returncode == -getattr(signal, 'SIGXCPU', -1):
+        return "cpu"
+    if limits.memory_mb and "MemoryError" in tail:
+        return "memory"
+    # Python ignores SIGXFSZ, so exceeding RLIMIT_FSIZE surfaces as OSError EFBIG.
+    if limits.file_size_mb and ("File too large" in tail or returncode == -getattr(signal, 'SIGXFSZ', -1)):
+        return "file_size"
+    if limits.max_processes and "Resource temporarily unavailable" in tail:
+        return "processes"
+    return None
+
+
+@tracing.traced("executor.run_command", lambda command, *args, **kwargs: {"command": command[:200]})
+def run_command(command: str, log_func: Optional[Callable[[str], None]] = print,
+                stream: bool = STREAM_SCRIPT_OUTPUT, limits: ResourceLimits = DEFAULT_LIMITS) -> ExecutionResult:
+    """Runs a shell command safely. Output is streamed to log_func and only a bounded head/tail is returned."""
+    log_func = bind_log(log_func)
     if log_func:
         log_func(f"⚙️ 正在执行命令: `{command}`")
     try:
         # shlex.split helps prevent command injection issues
         args = shlex.split(command)
-        result = subprocess.run(args, capture_output=True, text=True, encoding='utf-8', errors='replace', check=False)
-        
-        output = result.stdout + result.stderr
-        if result.returncode == 0:
+        process = _popen(args, limits)
+        stdout, stderr, timed_out = _collect_output(process, log_func, stream, limits.timeout_seconds)
+        stderr_text = stderr.getvalue().decode('utf-8', errors='replace')
+        output = stdout.getvalue().decode('utf-8', errors='replace') + stderr_text
+        limit_hit = _finish(process, stderr_text, limits, timed_out, log_func)
+        if limit_hit:
+            return ExecutionResult(False, output + f"\n[{limits.describe(limit_hit)}]", limit_hit)
+        if process.returncode == 0:
             if log_func: log_func(f"✅ 命令执行成功。")
-            return True, output
+            return ExecutionResult(True, output)
         else:
             if log_func: log_func(f"❌ 命令执行失败。")
-            return False, output
+            return ExecutionResult(False, output)
     except Exception as e:
         if log_func:
             log_func(f"💥 执行命令时发生意外错误: {e}")
-        return False, str(e)
+        return ExecutionResult(False, str(e))
 
-# --- run_script function is UNCHANGED, but included for completeness ---
-def run_script(script_code: str, script_name: str, log_func: Optional[Callable[[str], None]] = print) -> Tuple[bool, str]:
-    if not os.path.exists(SCRIPTS_DIR):
-        os.makedirs(SCRIPTS_DIR)
-    script_path = os.path.join(SCRIPTS_DIR, script_name)
+@tracing.traced("executor.run_script", lambda script_code, script_name, *args, **kwargs: {
+    "script_name": script_name, "code_chars": len(script_code)})
+def run_script(script_code: str, script_name: str, log_func: Optional[Callable[[str], None]] = print,
+               stream: bool = STREAM_SCRIPT_OUTPUT, limits: ResourceLimits = DEFAULT_LIMITS) -> ExecutionResult:
+    """
+    执行脚本。脚本按内容哈希缓存在 SCRIPT_CACHE_DIR 中并预编译，相同代码再次运行时
+    不再写盘和编译，script_name 只用于日志。成功时 output 为 stdout，失败时为 stderr；
+    触发资源限制时 limit_hit 说明是哪一项（进程组已被杀掉）。
+    """
+    log_func = bind_log(log_func)
+    key = script_cache_key(script_code)
+    span = tracing.current()
+    with _active_lock:
+        _active_scripts[key] += 1
     try:
         default_encoding = sys.getdefaultencoding()
-        with open(script_path, 'w', encoding=default_encoding, errors='ignore') as f:
-            f.write(script_code)
-        if log_func: log_func(f"📜 脚本已保存至: {script_path}")
+        run_path, source_path, cached = _cached_script(script_code)
+        if log_func:
+            if cached:
+                log_func(f"♻️ 复用已编译的脚本缓存: {source_path}")
+            else:
+                log_func(f"📜 脚本已保存至: {source_path}")
         if log_func: log_func(f"🚀 正在执行脚本: {script_name}...")
-        result = subprocess.run([sys.executable, script_path], capture_output=True, check=False)
-        try:
-            stdout = result.stdout.decode('utf-8')
-        except UnicodeDecodeError:
-            stdout = result.stdout.decode(default_encoding, errors='replace')
-        try:
-            stderr = result.stderr.decode('utf-8')
-        except UnicodeDecodeError:
-            stderr = result.stderr.decode(default_encoding, errors='replace')
-        if result.returncode == 0:
+        # Unbuffered so that prints show up in the log while the script is still running.
+        process = _start_script(run_path, limits, unbuffered=stream, source_path=source_path)
+        span.set(script_cache_hit=cached, pooled=isinstance(process, worker_pool.PooledProcess))
+        stdout_capture, stderr_capture, timed_out = _collect_output(process, log_func, stream, limits.timeout_seconds)
+        stdout = _decode(stdout_capture.getvalue(), default_encoding)
+        stderr = _decode(stderr_capture.getvalue(), default_encoding)
+        limit_hit = _finish(process, stderr, limits, timed_out, log_func)
+        span.set(returncode=process.returncode, limit_hit=limit_hit,
+                 stdout_bytes=stdout_capture.total_bytes, stderr_bytes=stderr_capture.total_bytes)
+        if limit_hit:
+            return ExecutionResult(False, stderr + f"\n[{limits.describe(limit_hit)}]", limit_hit)
+        if process.returncode == 0:
             if log_func: log_func("✅ 脚本执行成功。")
-            return True, stdout
+            return ExecutionResult(True, stdout)
         else:
             if log_func: log_func("❌ 脚本执行失败。")
-            return False, stderr
+            return ExecutionResult(False, stderr)
     except Exception as e:
         if log_func: log_func(f"💥 执行脚本时发生意外错误: {e}")
-        return False, str(e)
\ No newline at end of file
+        return ExecutionResult(False, str(e))
+    finally:
+        with _active_lock:
+            _active_scripts[key] -= 1
+            if not _active_scripts[key]:
+                del _active_scripts[key]
\ No newline at end of file
@@ -6,8 +6,11 @@ import queue
 import uuid
 
 from agent_core import Agent
-from llm_interface import get_provider, load_provider_configs, save_provider_configs
+from llm_interface import get_provider, load_provider_configs, save_provider_configs, submit_async
 from gui_provider_editor import ProviderEditor
+import executor
+import provider_health
+import checkpoint
 
 class App(tk.Tk):
     def __init__(self):
@@ -25,7 +28,10 @@ class App(tk.Tk):
         }
         self._init_ui()
         self.refresh_provider_list()
+        self.refresh_provider_health()
         self.process_gui_events()
+        executor.warm_up()
+        executor.start_background_gc()
 
     def _init_ui(self):
         main_pane = ttk.PanedWindow(self, orient=tk.HORIZONTAL)
@@ -63,6 +69,7 @@ class App(tk.Tk):
         frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         ttk.Button(frame, text="新建任务", command=self.new_task).pack(fill=tk.X, padx=5, pady=5)
+        ttk.Button(frame, text="恢复中断的任务...", command=self.resume_interrupted_task).pack(fill=tk.X, padx=5, pady=(0, 5))
 
         self.search_var = tk.StringVar()
         self.search_var.trace_add("write", self.filter_tasks)
@@ -145,6 +152,9 @@ class App(tk.Tk):
         if status not in ["Running", "Initializing"]:
             self.task_menu.add_command(label="重新运行任务", command=lambda: self.rerun_task(row_id))
             self.task_menu.add_command(label="迭代/修改...", command=lambda: self.iterate_task(row_id))
+            agent_instance = task.get("agent_instance")
+            if status == "Failed" and agent_instance and agent_instance.checkpoint and agent_instance.plan:
+                self.task_menu.add_command(label="从失败的步骤继续", command=lambda: self.resume_task(row_id))
             self.task_menu.add_separator()
         self.task_menu.add_command(label="删除任务", command=lambda: self.delete_task(row_id))
         self.task_menu.post(event.x_root, event.y_root)
@@ -154,6 +164,49 @@ class App(tk.Tk):
         if not task_data: return
         self.start_task(task_id, task_data, None)
 
+    def resume_task(self, task_id):
+        task_data = self.tasks.get(task_id)
+        if not task_data or not task_data.get("agent_instance"): return
+        self.start_task(task_id, task_data, None, task_data["agent_instance"].checkpoint)
+
+    def resume_interrupted_task(self):
+        """列出磁盘上的检查点（例如上次程序崩溃时未完成的任务），选择后从第一个未完成的步骤继续。"""
+        running = {t["agent_instance"].checkpoint.run_id for t in self.tasks.values()
+                   if t.get("agent_instance") and t["agent_instance"].checkpoint}
+        journals = [j for j in checkpoint.list_checkpoints() if j.run_id not in running]
+        if not journals:
+            messagebox.showinfo("恢复任务", "没有可以继续的检查点。", parent=self)
+            return
+        dialog = tk.Toplevel(self)
+        dialog.title("恢复中断的任务")
+        dialog.transient(self)
+        listbox = tk.Listbox(dialog, width=100, height=min(15, len(journals)))
+        listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for journal in journals:
+            goal = journal.data['goal'].splitlines()[0][:60] if journal.data['goal'] else ''
+            listbox.insert(tk.END, f"{journal.run_id}  步骤 {journal.progress()}  {journal.data['provider']}  {goal}")
+
+        def on_resume():
+            selections = listbox.curselection()
+            if not selections: return
+            journal = journals[selections[0]]
+            dialog.destroy()
+            llm_provider = get_provider(journal.data['provider'])
+            if not llm_provider:
+                messagebox.showerror("错误", f"无法初始化提供者 '{journal.data['provider']}'。")
+                return
+            goal = journal.data['goal']
+            task_id = str(uuid.uuid4())
+            title = goal[:40] + '...' if len(goal) > 40 else goal
+            task_data = { "id": task_id, "title": title, "goal": goal, "provider": llm_provider,
+                          "verify": journal.data.get('verify', False), "status": "Initializing", "log": [],
+                          "thread": None, "agent_instance": None }
+            self.tasks[task_id] = task_data
+            self.task_tree.insert("", tk.END, text=title, values=(self.status_display_map["Initializing"],), iid=task_id)
+            self.start_task(task_id, task_data, None, journal)
+        ttk.Button(dialog, text="继续执行", command=on_resume).pack(pady=(0, 5))
+        listbox.bind("<Double-Button-1>", lambda event: on_resume())
+
     def iterate_task(self, task_id):
         task_data = self.tasks.get(task_id)
         if not task_data: return
@@ -177,7 +230,7 @@ class App(tk.Tk):
         if not selections:
             messagebox.showerror("错误", "请先选择一个API提供者。")
             return
-        provider_name = self.provider_listbox.get(selections[0])
+        provider_name = self.provider_names[selections[0]]
         goal = simpledialog.askstring("新建任务", "请输入任务目标:", parent=self)
         if not goal: return
         verify = messagebox.askyesno("自我验证", "是否启用自我验证模式?", parent=self)
@@ -192,29 +245,37 @@ class App(tk.Tk):
         self.tasks[task_id] = task_data
         display_status = self.status_display_map.get("Initializing", "Initializing")
         self.task_tree.insert("", tk.END, text=placeholder_title, values=(display_status,), iid=task_id)
-        threading.Thread(target=self._get_title_and_start_agent, args=(task_id,), daemon=True).start()
+        self._get_title_and_start_agent(task_id)
 
     def _get_title_and_start_agent(self, task_id):
         task_data = self.tasks.get(task_id)
         if not task_data: return
-        try:
-            title_prompt = f"请将以下用户目标概括成3-5个词的简短标题:\n\n用户目标: '{task_data['goal']}'"
-            title = task_data['provider'].ask("You are a helpful assistant that creates short, descriptive titles.", title_prompt)
-            self.after(0, lambda: self.task_tree.item(task_id, text=title))
-            task_data['title'] = title
-        except Exception as e:
-            log_msg = f"⚠️ 无法生成标题: {e}."
-            self.log_queue.put({"task_id": task_id, "message": log_msg})
-        self.start_task(task_id, task_data, None)
+        title_prompt = f"请将以下用户目标概括成3-5个词的简短标题:\n\n用户目标: '{task_data['goal']}'"
+        # The title request runs on the shared event loop instead of a dedicated thread.
+        future = submit_async(task_data['provider'].ask_async("You are a helpful assistant that creates short, descriptive titles.", title_prompt))
+
+        def on_title(done):
+            try:
+                title = done.result()
+                self.after(0, lambda: self.task_tree.item(task_id, text=title))
+                task_data['title'] = title
+            except Exception as e:
+                log_msg = f"⚠️ 无法生成标题: {e}."
+                self.log_queue.put({"task_id": task_id, "message": log_msg})
+            self.after(0, lambda: self.start_task(task_id, task_data, None))
+        future.add_done_callback(on_title)
 
-    def start_task(self, task_id, task_data, previous_context):
+    def start_task(self, task_id, task_data, previous_context, journal=None):
         task_data['log'].clear()
         self.update_task_status(task_id, "Running")
         if self.task_tree.selection() and self.task_tree.selection()[0] == task_id:
              self.on_task_select()
         def thread_logger(message: str):
             self.log_queue.put({"task_id": task_id, "message": message})
-        agent = Agent(task_data['goal'], task_data['provider'], thread_logger, task_data['verify'], previous_context)
+        if journal:
+            agent = Agent.from_checkpoint(journal, task_data['provider'], thread_logger)
+        else:
+            agent = Agent(task_data['goal'], task_data['provider'], thread_logger, task_data['verify'], previous_context)
         task_data['agent_instance'] = agent
         def agent_runner():
             final_status = "Completed"
@@ -244,14 +305,28 @@ class App(tk.Tk):
     def refresh_provider_list(self):
         selected_index = self.provider_listbox.curselection()
         self.provider_listbox.delete(0, tk.END)
-        for p in load_provider_configs():
-            self.provider_listbox.insert(tk.END, p['name'])
+        self.provider_names = [p['name'] for p in load_provider_configs()]
+        self._provider_labels = self._provider_health_labels()
+        for label in self._provider_labels:
+            self.provider_listbox.insert(tk.END, label)
         if selected_index:
             try:
                 self.provider_listbox.selection_set(selected_index[0])
             except tk.TclError:
                 pass
 
+    def _provider_health_labels(self):
+        # 🟢 healthy, 🟡 some models tripped, 🔴 all models tripped, ⚪ no traffic yet (see provider_health.summarize)
+        snapshot = provider_health.get_health().snapshot()
+        return [f"{provider_health.summarize(snapshot, name)} {name}" for name in self.provider_names]
+
+    def refresh_provider_health(self):
+        """Periodically updates the health markers without disturbing the selection."""
+        labels = self._provider_health_labels()
+        if labels != self._provider_labels:
+            self.refresh_provider_list()
+        self.after(5000, self.refresh_provider_health)
+
     def add_provider(self):
         editor = ProviderEditor(self)
         if editor.result:
@@ -264,7 +339,7 @@ class App(tk.Tk):
         selections = self.provider_listbox.curselection()
         if not selections: return
         configs = load_provider_configs()
-        provider_name = self.provider_listbox.get(selections[0])
+        provider_name = self.provider_names[selections[0]]
         provider_data = next((p for p in configs if p['name'] == provider_name), None)
         if provider_data:
             editor = ProviderEditor(self, provider_data)
@@ -279,7 +354,7 @@ class App(tk.Tk):
     def delete_provider(self):
         selections = self.provider_listbox.curselection()
         if not selections: return
-        provider_name = self.provider_listbox.get(selections[0])
+        provider_name = self.provider_names[selections[0]]
         if messagebox.askyesno("确认删除", f"删除提供者 '{provider_name}'?"):
             configs = load_provider_configs()
             save_provider_configs([p for p in configs if p['name'] != provider_name])
@@ -53,7 +53,9 @@ class ProviderEditor(tk.Toplevel):
             messagebox.showerror("错误", "必须填写提供者名称。", parent=self)
             return
 
+        # Keep keys the form does not edit (e.g. "rate_limits", "cache").
         self.result = {
+            **self.provider_data,
             "name": name,
             "type": self.type_var.get(),
             "api_key": self.api_key_var.get().strip(),
@@ -1,11 +1,207 @@
 # llm_interface.py
 import json
+import os
+import copy
+import asyncio
+import concurrent.futures
+import contextvars
+import time
+import hashlib
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Iterable, Awaitable, Coroutine, Iterator, AsyncIterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager, nullcontext, closing
 import openai
 import google.generativeai as genai
 
-from settings import API_CONFIG_FILE
+from settings import (
+    API_CONFIG_FILE, LLM_CACHE_ENABLED, LLM_CACHE_DIR,
+    LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL_SECONDS,
+    DEFAULT_RATE_LIMITS, CIRCUIT_BREAKER_ENABLED,
+)
+from provider_health import get_health, CircuitBreaker
+import tracing
+import error_handler
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数（约4个字符一个token），用于限流预留。"""
+    return len(text) // 4 + 1
+
+class RateLimiter:
+    """
+    按提供者/模型共享的令牌桶限流器：限制每分钟请求数、每分钟token数和同时进行的请求数。
+    等待者按到达顺序(FIFO)排队，不会因为重试而插队。
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_in_flight: Optional[int] = None):
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._in_flight = 0
+        self._last_refill = time.monotonic()
+        self.total_waits = 0
+        self.total_wait_seconds = 0.0
+        self.configure(requests_per_minute, tokens_per_minute, max_in_flight)
+
+    def configure(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float], max_in_flight: Optional[int]):
+        with self._cond:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.max_in_flight = max_in_flight
+            self._request_tokens = float(requests_per_minute or 0)
+            self._token_tokens = float(tokens_per_minute or 0)
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_tokens = min(self.requests_per_minute, self._request_tokens + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_tokens = min(self.tokens_per_minute, self._token_tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens: int) -> Optional[float]:
+        """Seconds until the request can proceed; None means wait for a release."""
+        if self.max_in_flight and self._in_flight >= self.max_in_flight:
+            return None
+        self._refill()
+        wait = 0.0
+        if self.requests_per_minute and self._request_tokens < 1:
+            wait = max(wait, (1 - self._request_tokens) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            needed = min(tokens, self.tokens_per_minute)
+            if self._token_tokens < needed:
+                wait = max(wait, (needed - self._token_tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int = 0, abandoned: Optional[threading.Event] = None) -> bool:
+        """
+        Blocks until the request may proceed and takes a slot. Returns False without taking one if `abandoned`
+        is set while waiting (the async caller was cancelled, see slot_async).
+        """
+        with self._cond:
+            ticket = object()
+            self._queue.append(ticket)
+            started = time.monotonic()
+            waited = False
+            try:
+                while True:
+                    if abandoned is not None and abandoned.is_set():
+                        self._queue.remove(ticket)
+                        self._cond.notify_all()
+                        return False
+                    if self._queue[0] is ticket:
+                        wait = self._wait_time(tokens)
+                        if wait is not None and wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    waited = True
+                    self._cond.wait(wait)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._queue.popleft()
+            if self.requests_per_minute:
+                self._request_tokens -= 1
+            if self.tokens_per_minute:
+                self._token_tokens -= min(tokens, self.tokens_per_minute)
+            self._in_flight += 1
+            if waited:
+                self.total_waits += 1
+                self.total_wait_seconds += time.monotonic() - started
+            self._cond.notify_all()
+            return True
+
+    def release(self, extra_tokens: int = 0):
+        """Frees an in-flight slot and charges tokens only known after the response (the completion)."""
+        with self._cond:
+            self._in_flight -= 1
+            if self.tokens_per_minute and extra_tokens:
+                self._refill()
+                self._token_tokens -= extra_tokens
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tokens: int = 0) -> Iterator['RateLimitSlot']:
+        self.acquire(tokens)
+        slot = RateLimitSlot()
+        try:
+            yield slot
+        finally:
+            self.release(slot.extra_tokens)
+
+    @asynccontextmanager
+    async def slot_async(self, tokens: int = 0) -> AsyncIterator['RateLimitSlot']:
+        abandoned = threading.Event()
+        waiter = asyncio.ensure_future(asyncio.to_thread(self.acquire, tokens, abandoned))
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The waiting thread cannot be interrupted: tell it to give up its place in the queue,
+            # and if it took the slot anyway before noticing, hand the slot straight back.
+            with self._cond:
+                abandoned.set()
+                self._cond.notify_all()
+            waiter.add_done_callback(self._release_abandoned)
+            raise
+        slot = RateLimitSlot()
+        try:
+            yield slot
+        finally:
+            self.release(slot.extra_tokens)
+
+    def _release_abandoned(self, waiter: asyncio.Future):
+        if not waiter.cancelled() and waiter.exception() is None and waiter.result():
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._queue),
+                "total_waits": self.total_waits,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+            }
+
+class RateLimitSlot:
+    """Handed to the caller inside a limiter slot so it can report completion tokens."""
+    def __init__(self):
+        self.extra_tokens = 0
+
+    def charge(self, text: Optional[str]):
+        if text:
+            self.extra_tokens += estimate_tokens(text)
+
+_rate_limiters: Dict[tuple, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider_name: str, model: Optional[str], limits_config: Optional[Dict[str, Any]]) -> Optional[RateLimiter]:
+    """
+    返回 (提供者, 模型) 共享的限流器。limits_config 来自 api_config.json 的 "rate_limits"，
+    可通过 "models" 子项按模型覆盖；未配置任何限制时返回 None。
+    """
+    limits = dict(DEFAULT_RATE_LIMITS)
+    if limits_config:
+        limits.update({k: v for k, v in limits_config.items() if k != 'models'})
+        limits.update((limits_config.get('models') or {}).get(model, {}))
+    rpm, tpm, max_in_flight = limits.get('requests_per_minute'), limits.get('tokens_per_minute'), limits.get('max_in_flight')
+    if not (rpm or tpm or max_in_flight):
+        return None
+    key = (provider_name, model)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter(rpm, tpm, max_in_flight)
+        elif (limiter.requests_per_minute, limiter.tokens_per_minute, limiter.max_in_flight) != (rpm, tpm, max_in_flight):
+            limiter.configure(rpm, tpm, max_in_flight)
+        return limiter
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    with _rate_limiters_lock:
+        return {f"{name}/{model}": limiter.stats() for (name, model), limiter in _rate_limiters.items()}
 
 class LLMProvider(ABC):
     def __init__(self, config: Dict[str, Any]):
@@ -13,91 +209,906 @@ class LLMProvider(ABC):
         self.api_key = config.get('api_key', '')
         self.models = config.get('models', [])
         self.selected_model = self.models[0] if self.models else None
+        self.temperature = config.get('temperature', 0.3)
 
+    # **options carries per-request options for the wrappers (e.g. use_cache for CachedProvider);
+    # providers that talk to an API ignore them.
     @abstractmethod
-    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None) -> str:
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
         pass
 
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        """异步版本的 ask。默认在线程池中运行同步实现，子类可提供原生异步实现。"""
+        return await asyncio.to_thread(self.ask, system_prompt, user_prompt, model, **options)
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        """流式版本的 ask，逐块产出文本。默认实现一次性产出完整回答。"""
+        yield self.ask(system_prompt, user_prompt, model, **options)
+
     def get_name(self) -> str:
         return self.config.get('name', 'Unknown')
 
+    def _rate_limit(self, model: str, system_prompt: str, user_prompt: str):
+        """Returns a context manager that holds a rate-limiter slot for one request."""
+        limiter = get_rate_limiter(self.get_name(), model, self.config.get('rate_limits'))
+        if limiter is None:
+            return nullcontext(RateLimitSlot())
+        return limiter.slot(estimate_tokens(system_prompt) + estimate_tokens(user_prompt))
+
+    def _rate_limit_async(self, model: str, system_prompt: str, user_prompt: str):
+        limiter = get_rate_limiter(self.get_name(), model, self.config.get('rate_limits'))
+        if limiter is None:
+            return nullcontext(RateLimitSlot())
+        return limiter.slot_async(estimate_tokens(system_prompt) + estimate_tokens(user_prompt))
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Returns HTTP connection reuse counters, if the provider tracks them."""
+        return {}
+
+class ConnectionStats:
+    """
+    Counts requests and newly opened TCP connections on a pooled HTTP client.
+    Installed as an httpx request event hook; new connections are detected
+    through the transport's trace extension.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def on_request(self, request):
+        request.extensions['trace'] = self._trace
+        with self._lock:
+            self.requests += 1
+
+    async def on_request_async(self, request):
+        request.extensions['trace'] = self._trace_async
+        with self._lock:
+            self.requests += 1
+
+    def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connections_opened += 1
+
+    async def _trace_async(self, event_name: str, info: Dict[str, Any]):
+        self._trace(event_name, info)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(0, self.requests - self.connections_opened),
+            }
+
 class OpenAIProvider(LLMProvider):
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
+        self._stats = ConnectionStats()
+        # One pooled HTTP client per provider keeps TCP/TLS sessions alive between calls.
         self.client = openai.OpenAI(
             api_key=self.api_key,
             base_url=config.get('base_url') or None,
+            http_client=openai.DefaultHttpxClient(event_hooks={'request': [self._stats.on_request]}),
         )
+        self._async_client: Optional[openai.AsyncOpenAI] = None
+        self._async_client_lock = threading.Lock()
 
-    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None) -> str:
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        with self._async_client_lock:
+            if self._async_client is None:
+                self._async_client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.config.get('base_url') or None,
+                    http_client=openai.DefaultAsyncHttpxClient(event_hooks={'request': [self._stats.on_request_async]}),
+                )
+            return self._async_client
+
+    def connection_stats(self) -> Dict[str, Any]:
+        return self._stats.snapshot()
+
+    def _target_model(self, model: Optional[str]) -> str:
         if not self.api_key or self.api_key.startswith('sk-YOUR'):
             raise ValueError(f"提供者 '{self.get_name()}' 的 API 密钥未配置。")
         
         target_model = model or self.selected_model
         if not target_model:
             raise ValueError(f"提供者 '{self.get_name()}' 没有可用模型或未选择模型。")
-            
-        response = self.client.chat.completions.create(
-            model=target_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-        )
-        return response.choices[0].message.content.strip()
+        return target_model
+
+    def _messages(self, system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        target_model = self._target_model(model)
+        with self._rate_limit(target_model, system_prompt, user_prompt) as slot:
+            response = self.client.chat.completions.create(
+                model=target_model,
+                messages=self._messages(system_prompt, user_prompt),
+                temperature=self.temperature,
+            )
+            content = response.choices[0].message.content.strip()
+            slot.charge(content)
+        return content
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        target_model = self._target_model(model)
+        async with self._rate_limit_async(target_model, system_prompt, user_prompt) as slot:
+            response = await self.async_client.chat.completions.create(
+                model=target_model,
+                messages=self._messages(system_prompt, user_prompt),
+                temperature=self.temperature,
+            )
+            content = response.choices[0].message.content.strip()
+            slot.charge(content)
+        return content
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        target_model = self._target_model(model)
+        with self._rate_limit(target_model, system_prompt, user_prompt) as slot:
+            stream = self.client.chat.completions.create(
+                model=target_model,
+                messages=self._messages(system_prompt, user_prompt),
+                temperature=self.temperature,
+                stream=True,
+            )
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        slot.charge(text)
+                        yield text
+            finally:
+                # Closing the response lets the caller cancel a stream early.
+                stream.close()
+
+_google_configured_key: Optional[str] = None
+_google_configure_lock = threading.Lock()
 
 class GoogleProvider(LLMProvider):
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
+        self._requests = 0
         if self.api_key and not self.api_key.startswith('YOUR_GOOGLE'):
-            genai.configure(api_key=self.api_key)
+            self._configure()
+
+    def _configure(self):
+        # genai keeps a global client; reconfiguring it would drop its pooled channel.
+        global _google_configured_key
+        with _google_configure_lock:
+            if _google_configured_key != self.api_key:
+                genai.configure(api_key=self.api_key)
+                _google_configured_key = self.api_key
 
-    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None) -> str:
+    def _target_model(self, model: Optional[str]) -> str:
         if not self.api_key or self.api_key.startswith('YOUR_GOOGLE'):
             raise ValueError(f"提供者 '{self.get_name()}' 的 API 密钥未配置。")
 
         target_model = model or self.selected_model
         if not target_model:
             raise ValueError(f"提供者 '{self.get_name()}' 没有可用模型或未选择模型。")
-            
-        model_instance = genai.GenerativeModel(
+        return target_model
+
+    def _model_instance(self, system_prompt: str, target_model: str) -> genai.GenerativeModel:
+        return genai.GenerativeModel(
             model_name=target_model,
             system_instruction=system_prompt
         )
-        response = model_instance.generate_content(user_prompt)
-        return response.text.strip()
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        target_model = self._target_model(model)
+        with self._rate_limit(target_model, system_prompt, user_prompt) as slot:
+            self._requests += 1
+            response = self._model_instance(system_prompt, target_model).generate_content(user_prompt)
+            content = response.text.strip()
+            slot.charge(content)
+        return content
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        target_model = self._target_model(model)
+        async with self._rate_limit_async(target_model, system_prompt, user_prompt) as slot:
+            self._requests += 1
+            response = await self._model_instance(system_prompt, target_model).generate_content_async(user_prompt)
+            content = response.text.strip()
+            slot.charge(content)
+        return content
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        target_model = self._target_model(model)
+        with self._rate_limit(target_model, system_prompt, user_prompt) as slot:
+            self._requests += 1
+            response = self._model_instance(system_prompt, target_model).generate_content(user_prompt, stream=True)
+            for chunk in response:
+                if not chunk.parts:
+                    continue  # e.g. the closing chunk that only carries finish_reason; .text would raise
+                text = chunk.text
+                if text:
+                    slot.charge(text)
+                    yield text
+
+    def connection_stats(self) -> Dict[str, Any]:
+        # The gRPC channel pools connections internally and exposes no reuse counters.
+        return {"requests": self._requests}
+
+class ProviderWrapper(LLMProvider):
+    """Base class for providers that decorate another provider (cache, etc.)."""
+    def __init__(self, inner: LLMProvider):
+        self.inner = inner
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self.inner.config
+
+    @property
+    def api_key(self) -> str:
+        return self.inner.api_key
+
+    @property
+    def models(self) -> List[str]:
+        return self.inner.models
+
+    @property
+    def temperature(self) -> float:
+        return self.inner.temperature
+
+    @property
+    def selected_model(self) -> Optional[str]:
+        return self.inner.selected_model
+
+    @selected_model.setter
+    def selected_model(self, value: Optional[str]):
+        self.inner.selected_model = value
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        return self.inner.ask(system_prompt, user_prompt, model, **options)
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        return await self.inner.ask_async(system_prompt, user_prompt, model, **options)
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        return self.inner.ask_stream(system_prompt, user_prompt, model, **options)
+
+    def get_name(self) -> str:
+        return self.inner.get_name()
+
+    def connection_stats(self) -> Dict[str, Any]:
+        return self.inner.connection_stats()
+
+class ResponseCache:
+    """
+    磁盘上的LLM响应缓存。每个条目是一个以内容哈希命名的JSON文件，
+    按最近访问时间(LRU)淘汰，并受条目数、总字节数和TTL限制。
+    条目的大小和访问顺序记在内存索引中，写入时无需扫描目录；索引每 RESCAN_SECONDS 秒
+    重新扫描一次，以纳入其他进程写入的条目。
+    """
+    RESCAN_SECONDS = 300
+
+    def __init__(self, cache_dir: str = LLM_CACHE_DIR, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._index: 'OrderedDict[str, tuple]' = OrderedDict()  # path -> (last access, size), least recent first
+        self._index_bytes = 0
+        self._scanned_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(provider_type: str, model: Optional[str], temperature: Any, system_prompt: str, user_prompt: str) -> str:
+        payload = json.dumps([provider_type, model, temperature, system_prompt, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        # The file I/O happens outside the lock; entries are replaced atomically, so a reader sees a whole file or none.
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            expired = self.ttl_seconds and time.time() - entry.get('created_at', 0) > self.ttl_seconds
+            if expired:
+                self._remove(path)
+            else:
+                os.utime(path)  # mark as recently used for LRU eviction (and for other processes' scans)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry, expired = None, False  # includes an entry evicted between the read and utime()
+        with self._lock:
+            if entry is None or expired:
+                if expired:
+                    self._forget(path)
+                self.misses += 1
+                return None
+            if path in self._index:
+                self._track(path, time.time(), self._index[path][1])
+            self.hits += 1
+            self.saved_seconds += entry.get('elapsed', 0.0)
+            return entry.get('response')
+
+    def put(self, key: str, response: str, elapsed: float = 0.0):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"response": response, "created_at": time.time(), "elapsed": elapsed}, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._refresh_index()
+            self._track(path, time.time(), size)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                self._remove(path)
+            self._index.clear()
+            self._index_bytes = 0
+            self._scanned_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh_index()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._index_bytes,
+            }
+
+    def _entries(self) -> List[tuple]:
+        """Returns (path, mtime, size) for every cache file, oldest first."""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_mtime, st.st_size))
+        entries.sort(key=lambda e: e[1])
+        return entries
+
+    def _refresh_index(self):
+        """Rebuilds the index from the directory on first use and every RESCAN_SECONDS. Called with the lock held."""
+        if self._scanned_at is not None and time.monotonic() - self._scanned_at < self.RESCAN_SECONDS:
+            return
+        self._index = OrderedDict((path, (mtime, size)) for path, mtime, size in self._entries())
+        self._index_bytes = sum(size for _, size in self._index.values())
+        self._scanned_at = time.monotonic()
+
+    def _track(self, path: str, accessed: float, size: int):
+        self._forget(path)
+        self._index[path] = (accessed, size)
+        self._index_bytes += size
+
+    def _forget(self, path: str):
+        previous = self._index.pop(path, None)
+        if previous:
+            self._index_bytes -= previous[1]
+
+    def _evict(self):
+        now = time.time()
+        while self._index:
+            path, (accessed, size) = next(iter(self._index.items()))
+            expired = self.ttl_seconds and now - accessed > self.ttl_seconds
+            if not expired and len(self._index) <= self.max_entries and self._index_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            self._forget(path)
+            self.evictions += 1
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide response cache shared by all cached providers."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+_cache_bypass: contextvars.ContextVar = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+@contextmanager
+def bypass_cache():
+    """
+    在此范围内（包括其中提交的 asyncio 任务）所有未显式传入 use_cache 的请求都绕过响应缓存。
+    重试时使用：否则同样的提示会再次得到缓存中那个出错的回答。
+    """
+    token = _cache_bypass.set(True)
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
+def _use_cache(use_cache: Optional[bool]) -> bool:
+    return not _cache_bypass.get() if use_cache is None else use_cache
+
+class CachedProvider(ProviderWrapper):
+    """
+    Wraps any provider and serves repeated identical prompts from the response cache.
+    use_cache=False (passed through every wrapper) or an enclosing bypass_cache() skips the lookup and refreshes the entry.
+    """
+    def __init__(self, inner: LLMProvider, cache: Optional[ResponseCache] = None):
+        super().__init__(inner)
+        self.cache = cache or get_response_cache()
+
+    def _key(self, system_prompt: str, user_prompt: str, model: Optional[str]) -> str:
+        target_model = model or self.selected_model
+        return ResponseCache.make_key(self.config.get('type', 'openai'), target_model, self.temperature, system_prompt, user_prompt)
+
+    # A bypassed request skips the lookup but still stores its fresh response, replacing the entry that was bypassed.
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None,
+            use_cache: Optional[bool] = None, **options) -> str:
+        key = self._key(system_prompt, user_prompt, model)
+        cached = self.cache.get(key) if _use_cache(use_cache) else None
+        if cached is not None:
+            return cached
+        start = time.monotonic()
+        response = self.inner.ask(system_prompt, user_prompt, model, **options)
+        self.cache.put(key, response, time.monotonic() - start)
+        return response
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None,
+                        use_cache: Optional[bool] = None, **options) -> str:
+        key = self._key(system_prompt, user_prompt, model)
+        cached = self.cache.get(key) if _use_cache(use_cache) else None
+        if cached is not None:
+            return cached
+        start = time.monotonic()
+        response = await self.inner.ask_async(system_prompt, user_prompt, model, **options)
+        self.cache.put(key, response, time.monotonic() - start)
+        return response
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None,
+                   use_cache: Optional[bool] = None, **options) -> Iterator[str]:
+        key = self._key(system_prompt, user_prompt, model)
+        cached = self.cache.get(key) if _use_cache(use_cache) else None
+        if cached is not None:
+            yield cached
+            return
+        start = time.monotonic()
+        parts = []
+        for chunk in self.inner.ask_stream(system_prompt, user_prompt, model, **options):
+            parts.append(chunk)
+            yield chunk
+        # Only completed streams reach this point; cancelled ones are never cached.
+        self.cache.put(key, "".join(parts).strip(), time.monotonic() - start)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+class StreamAborted(RuntimeError):
+    """Raised when a streamed completion is cancelled because it is obviously unusable or no longer wanted."""
+
+_abort_event: contextvars.ContextVar = contextvars.ContextVar("llm_abort_event", default=None)
+
+@contextmanager
+def abort_on(event: threading.Event):
+    """
+    在此范围内，event 被设置后流式请求在下一个分块到达时取消（抛出 StreamAborted），新的请求不再发出。
+    用于放弃已经没有用处的后台请求，例如某一步失败后为下一步预取代码。
+    """
+    token = _abort_event.set(event)
+    try:
+        yield
+    finally:
+        _abort_event.reset(token)
+
+def abort_requested() -> bool:
+    """当前范围内的请求是否已被放弃（见 abort_on）。"""
+    event = _abort_event.get()
+    return event is not None and event.is_set()
+
+def ask_streaming(llm_provider: LLMProvider, system_prompt: str, user_prompt: str,
+                  log_func: Optional[Callable[[str], None]] = print,
+                  abort_if: Optional[Callable[[str], bool]] = None,
+                  model: Optional[str] = None) -> str:
+    """
+    以流式方式请求LLM，并把每一行完整输出实时转发给 log_func。
+    abort_if 在每个分块到达后以当前累计文本调用，返回 True 时立即取消请求并抛出 StreamAborted；
+    请求在 abort_on 范围内被放弃时同样如此。返回完整（已 strip）的回答文本。
+    """
+    if abort_requested():
+        raise StreamAborted("请求已被放弃，未发送。")
+    text = ""
+    pending = ""
+    stream = llm_provider.ask_stream(system_prompt, user_prompt, model)
+    try:
+        for chunk in stream:
+            text += chunk
+            pending += chunk
+            if "\n" in pending:
+                *lines, pending = pending.split("\n")
+                if log_func:
+                    for line in lines:
+                        log_func(f"  │ {line}")
+            if abort_requested():
+                raise StreamAborted("请求已被放弃，已提前取消。")
+            if abort_if and abort_if(text):
+                raise StreamAborted(f"LLM流式输出异常，已提前取消: {text[:100]!r}")
+    finally:
+        stream.close()
+    if pending and log_func:
+        log_func(f"  │ {pending}")
+    return text.strip()
+
+async def gather_bounded(aws: Iterable[Awaitable[Any]], limit: int = 8, return_exceptions: bool = False) -> List[Any]:
+    """像 asyncio.gather 一样并发等待，但同一时刻最多只有 limit 个请求在进行。结果顺序与输入一致。"""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _run(aw: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(_run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def submit_async(coro: Coroutine[Any, Any, Any]) -> concurrent.futures.Future:
+    """在进程共享的后台事件循环中调度协程，返回线程安全的 Future。"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop)
+
+def find_wrapper(provider: LLMProvider, wrapper_class: type) -> Optional[LLMProvider]:
+    """在包装链（ProviderWrapper.inner）中查找指定类型的包装器。"""
+    while provider is not None:
+        if isinstance(provider, wrapper_class):
+            return provider
+        provider = getattr(provider, 'inner', None)
+    return None
+
+class CountingProvider(ProviderWrapper):
+    """统计经由它发出的LLM请求数（包括缓存命中），用于按任务报告LLM调用次数。"""
+    def __init__(self, inner: LLMProvider):
+        super().__init__(inner)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        self._count()
+        return self.inner.ask(system_prompt, user_prompt, model, **options)
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        self._count()
+        return await self.inner.ask_async(system_prompt, user_prompt, model, **options)
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        self._count()
+        return self.inner.ask_stream(system_prompt, user_prompt, model, **options)
+
+class ModelPinnedProvider(ProviderWrapper):
+    """
+    让一个任务固定使用指定模型，而不修改共享提供者实例的 selected_model（那会影响所有使用它的任务）。
+    未显式指定 model 的请求都发给 pinned 模型。
+    """
+    def __init__(self, inner: LLMProvider, model: str):
+        super().__init__(inner)
+        self.pinned_model = model
+
+    @property
+    def selected_model(self) -> Optional[str]:
+        return self.pinned_model
+
+    @selected_model.setter
+    def selected_model(self, value: Optional[str]):
+        self.pinned_model = value
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        return self.inner.ask(system_prompt, user_prompt, model or self.pinned_model, **options)
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        return await self.inner.ask_async(system_prompt, user_prompt, model or self.pinned_model, **options)
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        return self.inner.ask_stream(system_prompt, user_prompt, model or self.pinned_model, **options)
+
+class TracedProvider(ProviderWrapper):
+    """每次真实的LLM请求记录一个 "llm.ask" span（见 tracing）；未启用追踪时直接转发。"""
+    def _attributes(self, kind: str, system_prompt: str, user_prompt: str, model: Optional[str]) -> Dict[str, Any]:
+        return {"provider": self.get_name(), "model": model or self.selected_model, "call": kind,
+                "prompt_chars": len(system_prompt) + len(user_prompt)}
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        if not tracing.enabled():
+            return self.inner.ask(system_prompt, user_prompt, model, **options)
+        with tracing.span("llm.ask", "client", **self._attributes("sync", system_prompt, user_prompt, model)) as span:
+            response = self.inner.ask(system_prompt, user_prompt, model, **options)
+            span.set(response_chars=len(response or ""))
+            return response
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        if not tracing.enabled():
+            return await self.inner.ask_async(system_prompt, user_prompt, model, **options)
+        with tracing.span("llm.ask", "client", **self._attributes("async", system_prompt, user_prompt, model)) as span:
+            response = await self.inner.ask_async(system_prompt, user_prompt, model, **options)
+            span.set(response_chars=len(response or ""))
+            return response
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        if not tracing.enabled():
+            yield from self.inner.ask_stream(system_prompt, user_prompt, model, **options)
+            return
+        with tracing.detached_span("llm.ask", "client", **self._attributes("stream", system_prompt, user_prompt, model)) as span:
+            start, chars, first = time.monotonic(), 0, None
+            try:
+                for chunk in self.inner.ask_stream(system_prompt, user_prompt, model, **options):
+                    if first is None:
+                        first = time.monotonic() - start
+                        span.set(first_chunk_ms=round(first * 1000, 1))
+                    chars += len(chunk)
+                    yield chunk
+            finally:
+                span.set(response_chars=chars)
+
+class CircuitOpenError(ConnectionError):
+    """所有候选提供者/模型的熔断器都处于打开状态。retry_after 为最早可以再次探测的秒数。"""
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class FailoverProvider(ProviderWrapper):
+    """
+    为每个 提供者/模型 维护熔断器（见 provider_health），熔断器打开时自动切换到下一个候选：
+    先是本提供者的其他模型，然后是配置中 "failover" 列出的其他提供者。
+    熔断器关闭时的单次失败照常抛出，交给 Agent 的退避重试处理。
+    """
+    def __init__(self, inner: LLMProvider, registry: 'ProviderRegistry'):
+        super().__init__(inner)
+        self.registry = registry
+        self.health = get_health()
+        self.last_route: Optional[str] = None  # "provider/model" that served the last request
+
+    def _candidates(self, model: Optional[str]) -> List[tuple]:
+        primary_model = model or self.selected_model
+        candidates = [(self.inner, primary_model)]
+        candidates += [(self.inner, m) for m in self.models if m != primary_model]
+        for name in self.config.get('failover', []):
+            provider = self.registry.get_base(name)
+            if provider is None or provider is self.inner:
+                continue
+            ordered = [provider.selected_model] + [m for m in provider.models if m != provider.selected_model]
+            candidates += [(provider, m) for m in ordered if m]
+        return candidates
+
+    def _routes(self, model: Optional[str]) -> Iterator[tuple]:
+        """
+        Yields (provider, model, breaker) for every candidate whose breaker lets a request through.
+        A half-open probe is released when the caller moves on, returns or abandons the request,
+        so an aborted probe never leaves the breaker waiting for an outcome that will not come.
+        """
+        for provider, candidate_model in self._candidates(model):
+            breaker = self.health.breaker(provider.get_name(), candidate_model)
+            probe = breaker.acquire()
+            if probe is None:
+                continue
+            try:
+                yield provider, candidate_model, breaker
+            finally:
+                breaker.release(probe)
+
+    def _exhausted(self, model: Optional[str], last_error: Optional[Exception]) -> Exception:
+        """所有候选都不可用时要抛出的异常：最后一次真实错误，或者 CircuitOpenError。"""
+        if last_error is not None:
+            return last_error
+        breakers = [self.health.breaker(p.get_name(), m) for p, m in self._candidates(model)]
+        return CircuitOpenError(
+            f"提供者 '{self.get_name()}' 的所有候选模型都已熔断: {', '.join(b.key for b in breakers)}",
+            min(b.retry_in() for b in breakers))
+
+    def _failed(self, breaker: CircuitBreaker, error: Exception) -> bool:
+        """
+        记录失败；返回 True 表示应当切换到下一个候选（熔断器刚刚打开或探测失败）。
+        只有临时性错误（连接、超时、429、5xx）说明提供者不健康；其他错误（如认证失败、请求被拒绝）
+        换一个候选也无济于事，不计入熔断器，直接抛出。
+        """
+        if isinstance(error, StreamAborted) or not error_handler.is_transient(error):
+            return False
+        self.health.record(breaker, error)
+        return breaker.snapshot()["state"] != "closed"
+
+    def ask(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        last_error = None
+        # closing(): release the probe on every exit path, not whenever the generator happens to be collected.
+        with closing(self._routes(model)) as routes:
+            for provider, candidate_model, breaker in routes:
+                try:
+                    response = provider.ask(system_prompt, user_prompt, candidate_model, **options)
+                except Exception as e:
+                    if self._failed(breaker, e):
+                        last_error = e
+                        continue
+                    raise
+                self.health.record(breaker)
+                self.last_route = breaker.key
+                return response
+        raise self._exhausted(model, last_error)
+
+    async def ask_async(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> str:
+        last_error = None
+        with closing(self._routes(model)) as routes:
+            for provider, candidate_model, breaker in routes:
+                try:
+                    response = await provider.ask_async(system_prompt, user_prompt, candidate_model, **options)
+                except Exception as e:
+                    if self._failed(breaker, e):
+                        last_error = e
+                        continue
+                    raise
+                self.health.record(breaker)
+                self.last_route = breaker.key
+                return response
+        raise self._exhausted(model, last_error)
+
+    def ask_stream(self, system_prompt: str, user_prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        last_error = None
+        with closing(self._routes(model)) as routes:
+            for provider, candidate_model, breaker in routes:
+                started = False
+                try:
+                    for chunk in provider.ask_stream(system_prompt, user_prompt, candidate_model, **options):
+                        started = True
+                        yield chunk
+                except Exception as e:
+                    # Once text has been streamed to the caller we can no longer switch providers.
+                    if self._failed(breaker, e) and not started:
+                        last_error = e
+                        continue
+                    raise
+                self.health.record(breaker)
+                self.last_route = breaker.key
+                return
+        raise self._exhausted(model, last_error)
 
 PROVIDER_CLASSES = {
     "openai": OpenAIProvider,
     "google": GoogleProvider,
 }
 
-def get_provider(provider_name: str) -> Optional[LLMProvider]:
-    try:
-        with open(API_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            configs = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return None
+class ProviderRegistry:
+    """
+    解析一次 api_config.json 并按提供者名称共享提供者实例。
+    配置文件的 mtime/大小变化时重新解析，只有配置发生变化的提供者会被重建。
+    """
+    def __init__(self, config_file: str = API_CONFIG_FILE):
+        self.config_file = config_file
+        self._lock = threading.RLock()
+        self._signature: Optional[tuple] = None
+        self._configs: List[Dict[str, Any]] = []
+        self._providers: Dict[str, LLMProvider] = {}
+        self._provider_configs: Dict[str, Dict[str, Any]] = {}
+        self._wrapped: Dict[str, LLMProvider] = {}
 
-    for config in configs:
-        if config['name'] == provider_name:
-            provider_type = config.get('type', 'openai')
-            if provider_type in PROVIDER_CLASSES:
-                try:
-                    return PROVIDER_CLASSES[provider_type](config)
-                except Exception as e:
-                    print(f"初始化提供者 {provider_name} 失败: {e}")
+    def _file_signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature == self._signature and self._signature is not None:
+            return
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                configs = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            configs = []
+        self._signature = signature
+        self._configs = configs
+        by_name = {c.get('name'): c for c in configs}
+        for name in list(self._providers):
+            if by_name.get(name) != self._provider_configs.get(name):
+                del self._providers[name]
+                del self._provider_configs[name]
+        # Failover wrappers resolve their fallback providers by name, so rebuild them all.
+        self._wrapped.clear()
+
+    def configs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._configs)
+
+    def get(self, provider_name: str) -> Optional[LLMProvider]:
+        """返回共享的提供者实例；启用熔断时外层包装 FailoverProvider。"""
+        with self._lock:
+            if not CIRCUIT_BREAKER_ENABLED:
+                return self.get_base(provider_name)
+            self._refresh()
+            if provider_name not in self._wrapped:
+                base = self.get_base(provider_name)
+                if base is None:
                     return None
-    return None
+                self._wrapped[provider_name] = FailoverProvider(base, self)
+            return self._wrapped[provider_name]
+
+    def get_base(self, provider_name: str) -> Optional[LLMProvider]:
+        """返回不带故障转移包装的提供者实例（可能带响应缓存）。"""
+        with self._lock:
+            self._refresh()
+            if provider_name in self._providers:
+                return self._providers[provider_name]
+            config = next((c for c in self._configs if c.get('name') == provider_name), None)
+            if config is None:
+                return None
+            provider_type = config.get('type', 'openai')
+            if provider_type not in PROVIDER_CLASSES:
+                return None
+            try:
+                provider = TracedProvider(PROVIDER_CLASSES[provider_type](copy.deepcopy(config)))
+                if config.get('cache', LLM_CACHE_ENABLED):
+                    provider = CachedProvider(provider)
+            except Exception as e:
+                print(f"初始化提供者 {provider_name} 失败: {e}")
+                return None
+            self._providers[provider_name] = provider
+            self._provider_configs[provider_name] = copy.deepcopy(config)
+            return provider
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Connection reuse counters for every live provider instance."""
+        with self._lock:
+            return {name: provider.connection_stats() for name, provider in self._providers.items()}
+
+_registry = ProviderRegistry()
+
+def get_registry() -> ProviderRegistry:
+    return _registry
+
+def get_provider(provider_name: str) -> Optional[LLMProvider]:
+    """返回指定名称的共享提供者实例。"""
+    return _registry.get(provider_name)
 
 def load_provider_configs() -> List[Dict[str, Any]]:
-    try:
-        with open(API_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    return _registry.configs()
 
 def save_provider_configs(configs: List[Dict[str, Any]]):
     with open(API_CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(configs, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+        json.dump(configs, f, indent=4, ensure_ascii=False)
+    _registry.invalidate()
@@ -1,17 +1,184 @@
 # main.py
 import argparse
+import json
+import time
 from agent_core import Agent
-from llm_interface import get_provider
+from llm_interface import get_provider, load_provider_configs, ModelPinnedProvider
+import memory_manager
+import executor
+import provider_health
+import batch_runner
+import checkpoint
+import diagnosis_cache
+import tracing
+from settings import BATCH_CONCURRENCY, TRACE_FILE, TRACE_FORMAT
+
+def print_health():
+    """Prints the circuit breaker state recorded in provider_health.json by the GUI/CLI processes."""
+    snapshot = provider_health.HealthRegistry.load_file()
+    for config in load_provider_configs():
+        name = config['name']
+        print(f"{provider_health.summarize(snapshot, name)} {name}")
+        for model in config.get('models', []):
+            entry = snapshot.get(provider_health.HealthRegistry.key(name, model))
+            if not entry:
+                print(f"    {model:<30} 无记录")
+                continue
+            state = entry['state']
+            if state == provider_health.OPEN and time.time() - entry['opened_at'] >= provider_health.CIRCUIT_COOLDOWN_SECONDS:
+                state = provider_health.HALF_OPEN  # the next request will probe it
+            line = (f"    {model:<30} {state:<10} 错误率 {entry['error_rate']:.0%} "
+                    f"({entry['failures']}/{entry['requests']})")
+            if state != provider_health.CLOSED and entry.get('opened_at'):
+                line += f"  熔断于 {time.strftime('%H:%M:%S', time.localtime(entry['opened_at']))}"
+            if entry.get('last_error'):
+                line += f"  最近错误: {entry['last_error'][:80]}"
+            print(line)
+        if config.get('failover'):
+            print(f"    故障转移到: {', '.join(config['failover'])}")
+
+def print_checkpoints():
+    """Lists runs that can be continued with --resume."""
+    journals = checkpoint.list_checkpoints()
+    if not journals:
+        print("没有可以继续的检查点。")
+        return
+    for journal in journals:
+        data = journal.data
+        updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['updated_at']))
+        goal = data['goal'].splitlines()[0][:60] if data['goal'] else ''
+        print(f"{journal.run_id}  {data['status']:<8} 步骤 {journal.progress():<6} {updated}  {data['provider']}  {goal}")
+
+def print_diagnoses():
+    """Shows the diagnosis cache: hit-rate stats and the cached repair plans per error fingerprint."""
+    cache = diagnosis_cache.get_cache()
+    stats = cache.stats()
+    print(f"诊断缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate']:.0%}, "
+          f"条目 {stats['entries']} 个（已验证 {stats['proven']} 个）, 淘汰 {stats['evictions']} 个")
+    for key, entry in sorted(cache.entries().items(), key=lambda item: -item[1]['last_used']):
+        fingerprint = entry['fingerprint']
+        status = f"成功 {entry['successes']} 次" if entry['successes'] else "待验证"
+        location = f"{fingerprint['module']}:{fingerprint['function']}" if fingerprint['module'] else "-"
+        print(f"  {key}  {status:<8} {fingerprint['exception']} @ {location}: {fingerprint['message'][:80]}")
+        print(f"      {entry['plan'].get('root_cause_analysis', '')[:100]}")
+
+def print_trace_summary(path: str):
+    """Aggregates a trace file (jsonl or otlp) by span name: count, errors, total and mean/max duration."""
+    totals = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "resourceSpans" in record:
+                    spans = [(span["name"], (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6,
+                              span.get("status", {}).get("code") == 2)
+                             for resource in record["resourceSpans"] for scope in resource["scopeSpans"]
+                             for span in scope["spans"]]
+                else:
+                    spans = [(record["name"], record["duration_ms"], record["status"] == "error")]
+                for name, duration_ms, failed in spans:
+                    entry = totals.setdefault(name, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+                    entry["count"] += 1
+                    entry["errors"] += failed
+                    entry["total_ms"] += duration_ms
+                    entry["max_ms"] = max(entry["max_ms"], duration_ms)
+    except FileNotFoundError:
+        print(f"错误：找不到追踪文件 '{path}'。运行时加上 --trace 即可生成。")
+        return
+    print(f"{'span':<28} {'次数':>6} {'失败':>6} {'总计(秒)':>10} {'平均(ms)':>10} {'最大(ms)':>10}")
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"{name:<28} {entry['count']:>6} {entry['errors']:>6} {entry['total_ms'] / 1000:>10.2f} "
+              f"{entry['total_ms'] / entry['count']:>10.1f} {entry['max_ms']:>10.1f}")
 
 def main():
     parser = argparse.ArgumentParser(description="MCAA-Phase2: The Journeyman Agent")
-    parser.add_argument("--provider", help="Name of the API provider from api_config.json", required=True)
+    parser.add_argument("--provider", help="Name of the API provider from api_config.json", default=None)
     parser.add_argument("--model", help="Specific model to use (optional)", default=None)
     parser.add_argument("--goal", help="The task for the agent to perform", default=None)
     parser.add_argument("--verify", action='store_true', help="Enable self-verification mode")
+    parser.add_argument("--timeout", type=float, default=None, help="Wall-clock limit in seconds for each generated script")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="RUN_ID",
+                        help="Continue an interrupted run from its first incomplete step (default: the most recent one)")
+    parser.add_argument("--trace", nargs="?", const=TRACE_FILE, default=None, metavar="FILE",
+                        help=f"Write tracing spans of planning, codegen, execution and LLM calls to FILE (default: {TRACE_FILE})")
+    parser.add_argument("--trace-format", choices=["jsonl", "otlp"], default=TRACE_FORMAT,
+                        help="jsonl records or OpenTelemetry OTLP/JSON (for the collector's otlpjsonfile receiver)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("compact-tools", help="Collapse tools with identical logic in the tool library")
+    subparsers.add_parser("health", help="Show circuit breaker state of every configured provider/model")
+    subparsers.add_parser("diagnoses", help="Show cached diagnostician repair plans and their hit rate")
+    subparsers.add_parser("checkpoints", help="List interrupted runs that can be continued with --resume")
+    trace_parser = subparsers.add_parser("trace-summary", help="Aggregate a trace file by span name")
+    trace_parser.add_argument("file", nargs="?", default=TRACE_FILE)
+    gc_parser = subparsers.add_parser("gc-scripts", help="Apply the retention policy to generated_scripts and report space reclaimed")
+    gc_parser.add_argument("--max-files", type=int, default=None)
+    gc_parser.add_argument("--max-bytes", type=int, default=None)
+    gc_parser.add_argument("--max-age-days", type=float, default=None)
+    batch_parser = subparsers.add_parser("batch", help="Run goals from a JSONL file (or - for stdin) and write per-goal results as JSONL")
+    batch_parser.add_argument("input", nargs="?", default="-", help="JSONL input with one goal per line (default: stdin)")
+    batch_parser.add_argument("--output", "-o", default="batch_results.jsonl", help="JSONL results; IDs already in it are skipped")
+    batch_parser.add_argument("--concurrency", "-j", type=int, default=BATCH_CONCURRENCY, help="Number of agents running at once")
+    batch_parser.add_argument("--retry-failed", action='store_true', help="Run goals again whose previous result failed")
+    batch_parser.add_argument("--quiet", action='store_true', help="Only print one line per finished goal")
+    # Also accepted after the subcommand: `main.py batch goals.jsonl --provider X`.
+    batch_parser.add_argument("--provider", default=argparse.SUPPRESS)
+    batch_parser.add_argument("--model", default=argparse.SUPPRESS)
+    batch_parser.add_argument("--verify", action='store_true', default=argparse.SUPPRESS)
+    batch_parser.add_argument("--timeout", type=float, default=argparse.SUPPRESS)
     
     args = parser.parse_args()
 
+    if args.trace:
+        tracing.configure(args.trace, args.trace_format)
+
+    if args.command == "compact-tools":
+        memory_manager.compact_tools()
+        return
+
+    if args.command == "health":
+        print_health()
+        return
+
+    if args.command == "diagnoses":
+        print_diagnoses()
+        return
+
+    if args.command == "checkpoints":
+        print_checkpoints()
+        return
+
+    if args.command == "trace-summary":
+        print_trace_summary(args.file)
+        return
+
+    journal = None
+    if args.resume:
+        if args.resume == "latest":
+            journals = checkpoint.list_checkpoints()
+            journal = journals[0] if journals else None
+        else:
+            try:
+                journal = checkpoint.Checkpoint.load(args.resume)
+            except (FileNotFoundError, ValueError):
+                journal = None
+        if journal is None:
+            print(f"错误：找不到检查点 '{args.resume}'。可用 `python main.py checkpoints` 查看。")
+            return
+        # The run continues on the provider and model it started with unless overridden.
+        args.provider = args.provider or journal.data['provider']
+        args.model = args.model or journal.data.get('model')
+
+    if args.command == "gc-scripts":
+        overrides = {"max_files": args.max_files, "max_bytes": args.max_bytes, "max_age_days": args.max_age_days}
+        executor.collect_script_garbage({k: v for k, v in overrides.items() if v is not None}, log_func=print)
+        return
+
+    if not args.provider:
+        parser.error("the following arguments are required: --provider")
+
     llm_provider = get_provider(args.provider)
     if not llm_provider:
         print(f"错误：在 api_config.json 中未找到提供者 '{args.provider}'。")
@@ -20,13 +187,29 @@ def main():
     if args.model:
         if args.model not in llm_provider.models:
             print(f"警告：模型 '{args.model}' 未在配置中列出，将尝试继续使用。")
-        llm_provider.selected_model = args.model
+        # Pin the model on a wrapper: the provider instance is shared through the registry.
+        llm_provider = ModelPinnedProvider(llm_provider, args.model)
+
+    # Workers start in the background while the first plan is being generated.
+    executor.warm_up()
+    executor.start_background_gc()
+
+    script_limits = {"timeout_seconds": args.timeout} if args.timeout else None
 
     def cli_log(message: str):
         print(message)
 
-    if args.goal:
-        agent = Agent(args.goal, llm_provider, cli_log, args.verify)
+    if args.command == "batch":
+        with batch_runner.open_input(args.input) as input_stream:
+            batch_runner.run_batch(input_stream, args.output, llm_provider, args.concurrency, args.verify,
+                                   args.quiet, args.retry_failed, script_limits)
+        return
+
+    if journal:
+        agent = Agent.from_checkpoint(journal, llm_provider, cli_log, script_limits=script_limits, model=args.model)
+        agent.run()
+    elif args.goal:
+        agent = Agent(args.goal, llm_provider, cli_log, args.verify, script_limits=script_limits)
         agent.run()
     else:
         print("="*50)
@@ -39,7 +222,7 @@ def main():
                 if not goal: continue
                 
                 verify_choice = input("是否开启自我验证模式? (y/n): ").lower()
-                agent = Agent(goal, llm_provider, cli_log, verify_choice == 'y')
+                agent = Agent(goal, llm_provider, cli_log, verify_choice == 'y', script_limits=script_limits)
                 agent.run()
 
             except KeyboardInterrupt:
@@ -1,58 +1,93 @@
 # memory_manager.py
-import json
-from typing import List, Dict, Any, Callable, Optional
-import time
-from settings import TOOL_LIBRARY_FILE
+import os
+import threading
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from tool_store import get_store
+
+# 进程内工具缓存：name -> tool 字典索引。只有当工具库文件的 mtime/大小发生变化
+# （例如其他进程写入）时才重新加载；本进程的 save_tool 会直接原地更新缓存。
+_cache_lock = threading.Lock()
+_cache_signature: Optional[Tuple] = None
+_tool_index: Dict[str, Dict[str, Any]] = {}
+_cache_version = 0
+
+def _library_signature() -> Tuple:
+    db_path = get_store().db_path
+    signature = []
+    # In WAL mode new writes land in the -wal file until a checkpoint folds them into the main file.
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def _get_index() -> Dict[str, Dict[str, Any]]:
+    global _cache_signature, _tool_index, _cache_version
+    with _cache_lock:
+        signature = _library_signature()
+        if signature != _cache_signature:
+            _tool_index = {tool['name']: tool for tool in get_store().list_tools()}
+            _cache_signature = signature
+            _cache_version += 1
+        return _tool_index
+
+def library_version() -> int:
+    """单调递增的工具库版本号，工具库内容变化时递增，供派生索引判断是否需要重建。"""
+    _get_index()
+    return _cache_version
 
 def load_tools() -> List[Dict[str, Any]]:
-    """从JSON文件中加载所有工具。"""
-    try:
-        with open(TOOL_LIBRARY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    """从工具库中加载所有工具。"""
+    return list(_get_index().values())
 
 def get_tool_code(tool_name: str) -> Optional[str]:
     """获取单个工具的代码。"""
-    tools = load_tools()
-    for tool in tools:
-        if tool['name'] == tool_name:
-            return tool.get('code')
-    return None
+    tool = _get_index().get(tool_name)
+    return tool.get('code') if tool else None
 
 def save_tool(name: str, description: str, code: str, log_func: Optional[Callable[[str], None]] = print):
-    """将一个新工具保存到JSON文件中，自动处理命名冲突。"""
-    tools = load_tools()
-    
+    """将一个新工具保存到工具库中，自动处理命名冲突。"""
     # Sanitize the name to be a valid file/tool name
     base_name = "".join(c for c in name if c.isalnum() or c in ('_', '-')).rstrip()
     if not base_name:
         base_name = f"unnamed_tool"
 
-    final_name = base_name
-    # 检查工具是否已存在，如果存在则更新或重命名
-    existing_tool = next((t for t in tools if t['name'] == final_name), None)
-
-    if existing_tool:
-        # 如果代码完全相同，则不保存
-        if existing_tool['code'] == code:
-            if log_func:
-                log_func(f"ℹ️ 工具 '{final_name}' 已存在且代码相同，无需保存。")
-            return
-        # 如果代码不同，则添加后缀
-        final_name = f"{base_name}_{int(time.time())}"
+    global _cache_signature, _cache_version
+    with _cache_lock:
+        stale = _library_signature() != _cache_signature
+        result = get_store().insert_unique(base_name, description, code)
+        if result.inserted:
+            if stale:
+                # Someone else wrote since our last load; let the next read reload everything.
+                _cache_signature = None
+            else:
+                _tool_index[result.name] = {"name": result.name, "description": description, "code": code, "code_hash": result.code_hash}
+                _cache_signature = _library_signature()
+                _cache_version += 1
+
+    final_name = result.name
+    if not result.inserted:
+        # 如果代码逻辑完全相同，则不保存
         if log_func:
-            log_func(f"⚠️ 工具名 '{base_name}' 已存在，新工具将保存为 '{final_name}'。")
-    
-    # Append the new or renamed tool
-    tools.append({
-        "name": final_name,
-        "description": description,
-        "code": code
-    })
-
-    with open(TOOL_LIBRARY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(tools, f, indent=4, ensure_ascii=False)
-    
+            log_func(f"ℹ️ 工具 '{final_name}' 已存在且代码相同，无需保存。")
+        return
+    if final_name != base_name and log_func:
+        log_func(f"⚠️ 工具名 '{base_name}' 已存在，新工具将保存为 '{final_name}'。")
+    if result.alias_of and log_func:
+        log_func(f"♻️ 工具 '{final_name}' 与已有工具 '{result.alias_of}' 逻辑相同，仅作为别名保存，代码不重复存储。")
+
+    if log_func:
+        log_func(f"✅ 工具 '{final_name}' 已成功保存到工具库。")
+
+def compact_tools(log_func: Optional[Callable[[str], None]] = print) -> Dict[str, int]:
+    """合并工具库中逻辑相同的重复工具并清理无用代码。"""
+    global _cache_signature
+    with _cache_lock:
+        stats = get_store().compact()
+        _cache_signature = None
     if log_func:
-        log_func(f"✅ 工具 '{final_name}' 已成功保存到工具库。")
\ No newline at end of file
+        log_func(f"🧹 工具库压缩完成: 合并代码 {stats['merged_code']} 份, 删除重复名称 {stats['removed_duplicate_names']} 个, "
+                 f"清理无引用代码 {stats['removed_orphan_code']} 份。当前 {stats['names']} 个名称共享 {stats['unique_code']} 份代码。")
+    return stats
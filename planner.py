@@ -1,8 +1,12 @@
 # planner.py
 import json
 from typing import Optional, Callable, List, Dict, Any
-from llm_interface import LLMProvider
-from memory_manager import load_tools
+from llm_interface import LLMProvider, ask_streaming
+from memory_manager import load_tools, library_version
+import tracing
+from settings import STREAM_LLM_OUTPUT, PLANNER_TOP_K_TOOLS
+import tool_retriever
+import error_handler
 
 PLANNER_SYSTEM_PROMPT = """
 你是一个AI Agent的高级规划模块(Senior Planner)。你的核心任务是分析用户目标，并基于现有工具，制定一个最优的、可执行的JSON计划。
@@ -40,28 +44,66 @@ PLANNER_SYSTEM_PROMPT = """
     *   `task`: "CREATE_VERIFICATION_TOOL"
     *   `details`: 描述需要编写的验收脚本的功能，它应该如何检查任务是否成功。
 
+*   **所有步骤都可以包含可选的 `depends_on`:**
+    *   一个整数数组，列出该步骤必须等待完成的步骤编号（步骤按数组顺序从1开始编号，只能依赖排在它前面的步骤）。
+    *   互不依赖的步骤（例如多个彼此独立的 `CREATE_NEW_TOOL`）请写 `"depends_on": []`，它们会被并行执行。
+    *   省略 `depends_on` 表示依赖紧邻的上一个步骤。
+
 **重要规则：**
 - 你的输出必须是且只能是一个符合RFC 8259标准的JSON数组。不要包含任何解释性文字。
 - 如果用户目标包含 "验证"、"检查"、"确保" 等词语，你应该在主任务步骤后增加一个 `CREATE_VERIFICATION_TOOL` 步骤。
 """
 
+def _is_broken_plan_prefix(text: str) -> bool:
+    """计划必须是JSON数组：一旦开头既不是 '[' 也不是 ```json 代码块，就可以提前取消流式请求。"""
+    text = text.lstrip()
+    if text.startswith("```"):
+        if "\n" not in text:
+            return False
+        text = text.split("\n", 1)[1].lstrip()
+    return bool(text) and not text.startswith("[")
+
+def _format_tools(tools: List[Dict[str, Any]]) -> str:
+    """每份代码只列一行：逻辑相同的工具合并为一个条目，其余名称作为别名列出。"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for tool in tools:
+        groups.setdefault(tool.get('code_hash') or tool['name'], []).append(tool)
+    lines = []
+    for group in groups.values():
+        primary = group[0]
+        aliases = f" (别名: {', '.join(t['name'] for t in group[1:])})" if len(group) > 1 else ""
+        lines.append(f"- {primary['name']}{aliases}: {primary['description']}")
+    return "\n".join(lines)
+
+@tracing.traced("planner.create_plan", lambda goal, *args, **kwargs: {"goal_chars": len(goal)})
 def create_plan(goal: str, llm_provider: LLMProvider, log_func: Optional[Callable[[str], None]] = print) -> Optional[List[Dict[str, Any]]]:
     """根据用户目标创建计划。"""
     if log_func: log_func("Loading existing tools for planning context...")
     
     existing_tools = load_tools()
+    if PLANNER_TOP_K_TOOLS and len(existing_tools) > PLANNER_TOP_K_TOOLS:
+        total = len(existing_tools)
+        existing_tools, timings = tool_retriever.retrieve(goal, existing_tools, library_version(), PLANNER_TOP_K_TOOLS)
+        if log_func:
+            log_func(f"🔎 从 {total} 个工具中检索出 {len(existing_tools)} 个相关工具 "
+                     f"(索引构建 {timings['build_ms']:.1f} ms, 查询 {timings['query_ms']:.1f} ms)")
     if not existing_tools:
         tools_context = "【现有工具列表】:\n无"
     else:
-        formatted_tools = "\n".join([f"- {tool['name']}: {tool['description']}" for tool in existing_tools])
+        formatted_tools = _format_tools(existing_tools)
         tools_context = f"【现有工具列表】:\n{formatted_tools}"
 
     user_prompt = f"{tools_context}\n\n【用户目标】:\n{goal}"
+    tracing.current().set(tools_in_prompt=len(existing_tools), prompt_chars=len(user_prompt))
 
     if log_func: log_func(f"🤖 向 '{llm_provider.get_name()}' 请求规划...")
         
     try:
-        plan_str = llm_provider.ask(PLANNER_SYSTEM_PROMPT, user_prompt)
+        if STREAM_LLM_OUTPUT and log_func:
+            plan_str = ask_streaming(llm_provider, PLANNER_SYSTEM_PROMPT, user_prompt, log_func,
+                                     abort_if=_is_broken_plan_prefix)
+        else:
+            plan_str = llm_provider.ask(PLANNER_SYSTEM_PROMPT, user_prompt)
         if not plan_str:
             return None
 
@@ -72,6 +114,7 @@ def create_plan(goal: str, llm_provider: LLMProvider, log_func: Optional[Callabl
         # Add step numbers for clarity
         for i, step in enumerate(plan):
             step['step_number'] = i + 1
+        tracing.current().set(steps=len(plan))
         return plan
     except json.JSONDecodeError:
         if log_func:
@@ -79,6 +122,8 @@ def create_plan(goal: str, llm_provider: LLMProvider, log_func: Optional[Callabl
             log_func(f"LLM原始返回内容:\n---\n{plan_str}\n---")
         return None
     except Exception as e:
+        if error_handler.is_transient(e):
+            raise  # let Agent._execute_with_retry back off and retry
         if log_func:
             log_func(f"❌ 规划时发生错误: {e}")
         return None
\ No newline at end of file
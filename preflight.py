@@ -0,0 +1,147 @@
+# preflight.py
+"""
+生成代码的静态预检查：在启动解释器进程之前，于当前进程内发现语法错误、
+本机无法解析的导入以及禁止调用的函数，并给出可以直接反馈给LLM的结构化问题列表。
+"""
+import ast
+import importlib.util
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from settings import PREFLIGHT_DENYLIST
+
+class PreflightIssue(NamedTuple):
+    kind: str  # "syntax", "import" or "denied"
+    line: Optional[int]
+    message: str
+
+class PreflightResult(NamedTuple):
+    issues: List[PreflightIssue]
+    elapsed_ms: float
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    def feedback(self) -> str:
+        """可直接放进提示词的问题描述。"""
+        return "\n".join(
+            f"- {'第 %d 行' % issue.line if issue.line else '代码'} [{issue.kind}] {issue.message}"
+            for issue in self.issues
+        )
+
+class PreflightError(Exception):
+    """生成的代码多次修正后仍未通过预检查。"""
+    def __init__(self, result: PreflightResult):
+        super().__init__("生成的代码未通过静态预检查:\n" + result.feedback())
+        self.result = result
+        self.kind = result.issues[0].kind
+
+_IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+# Modules that resolved once stay resolvable. Misses expire, because a repair command or a step script
+# may install the module at any time (see invalidate()).
+_MISS_TTL_SECONDS = 30
+_found_modules: set = set()
+_missing_modules: Dict[str, float] = {}
+_module_lock = threading.Lock()
+
+def _module_exists(name: str) -> bool:
+    if name in _found_modules or name in sys.modules or name in sys.builtin_module_names:
+        return True
+    now = time.monotonic()
+    with _module_lock:
+        checked_at = _missing_modules.get(name)
+        if checked_at is not None and now - checked_at < _MISS_TTL_SECONDS:
+            return False
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    with _module_lock:
+        if found:
+            _found_modules.add(name)
+            _missing_modules.pop(name, None)
+        else:
+            _missing_modules[name] = now
+    return found
+
+def invalidate():
+    """
+    忘记所有“模块不存在”的结论并刷新导入系统的路径缓存。
+    在修复命令（例如 pip install）运行之后调用，使新安装的模块立即可以通过预检查。
+    """
+    with _module_lock:
+        _missing_modules.clear()
+    importlib.invalidate_caches()
+
+def _guarded_imports(tree: ast.AST) -> set:
+    """Import nodes inside `try: ... except ImportError:` — optional dependencies the script handles itself."""
+    guarded = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        handles_import_error = False
+        for handler in node.handlers:
+            names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+            if handler.type is None or any(isinstance(n, ast.Name) and n.id in _IMPORT_ERRORS for n in names):
+                handles_import_error = True
+        if handles_import_error:
+            for statement in node.body:
+                guarded.update(n for n in ast.walk(statement) if isinstance(n, (ast.Import, ast.ImportFrom)))
+    return guarded
+
+def _dotted_name(node: ast.AST, aliases: Dict[str, str]) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(aliases.get(node.id, node.id))
+    return ".".join(reversed(parts))
+
+# CPython 3.11 keeps the AST converter's recursion counter in shared module state: two threads parsing
+# at once (parallel steps, the code prefetcher) can fail with "AST constructor recursion depth mismatch".
+_parse_lock = threading.Lock()
+
+def parse(code: str) -> ast.Module:
+    """线程安全的 ast.parse。"""
+    with _parse_lock:
+        return ast.parse(code)
+
+def check_code(code: str) -> PreflightResult:
+    """对代码做语法、导入和禁用调用检查。"""
+    start = time.perf_counter()
+    issues: List[PreflightIssue] = []
+    try:
+        tree = parse(code)
+    except SyntaxError as e:
+        issues.append(PreflightIssue("syntax", e.lineno, f"语法错误: {e.msg}"))
+        return PreflightResult(issues, (time.perf_counter() - start) * 1000)
+
+    guarded = _guarded_imports(tree)
+    aliases: Dict[str, str] = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                aliases[alias.asname or alias.name.split('.')[0]] = alias.name if alias.asname else alias.name.split('.')[0]
+                top = alias.name.split('.')[0]
+                if node not in guarded and not _module_exists(top):
+                    issues.append(PreflightIssue("import", node.lineno, f"找不到模块 '{top}'（本机未安装），请改用标准库或已安装的库"))
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+            top = node.module.split('.')[0]
+            if node not in guarded and not _module_exists(top):
+                issues.append(PreflightIssue("import", node.lineno, f"找不到模块 '{top}'（本机未安装），请改用标准库或已安装的库"))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            name = _dotted_name(node.func, aliases)
+            if name in PREFLIGHT_DENYLIST:
+                issues.append(PreflightIssue("denied", node.lineno, f"禁止调用 {name}(): {PREFLIGHT_DENYLIST[name]}"))
+
+    issues.sort(key=lambda issue: issue.line or 0)
+    return PreflightResult(issues, (time.perf_counter() - start) * 1000)
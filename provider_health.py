@@ -0,0 +1,239 @@
+# provider_health.py
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+from settings import (
+    PROVIDER_HEALTH_FILE, CIRCUIT_ERROR_RATE, CIRCUIT_MIN_REQUESTS,
+    CIRCUIT_WINDOW_SECONDS, CIRCUIT_COOLDOWN_SECONDS,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    单个提供者/模型的熔断器。
+    closed: 正常放行，统计最近 window_seconds 内的成功/失败；请求数达到 min_requests 且错误率
+            达到 error_rate 时打开。
+    open: 拒绝请求，cooldown_seconds 后进入 half_open。
+    half_open: 只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+    def __init__(self, key: str, error_rate: float = CIRCUIT_ERROR_RATE, min_requests: int = CIRCUIT_MIN_REQUESTS,
+                 window_seconds: float = CIRCUIT_WINDOW_SECONDS, cooldown_seconds: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.key = key
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque()  # (wall time, ok)
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._probing = False
+        self._probe_id = 0
+        self._probe_started = 0.0
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _current_state(self, now: float) -> str:
+        if self.state == OPEN and now - self.opened_at >= self.cooldown_seconds:
+            self.state = HALF_OPEN
+            self._probing = False
+        return self.state
+
+    def allow(self) -> bool:
+        """是否可以向该提供者/模型发送请求。half_open 状态下只有第一个调用者获得探测机会。"""
+        return self.acquire() is not None
+
+    def acquire(self) -> Optional[int]:
+        """
+        与 allow() 相同，但返回通行凭证：None 表示拒绝，0 表示正常放行，大于 0 表示调用者持有 half_open 探测，
+        请求结束后（无论成功、失败还是被中途放弃）必须用它调用 release()。
+        """
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return 0
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._probe_id += 1
+                self._probe_started = now
+                return self._probe_id
+            return None
+
+    def release(self, probe: Optional[int]):
+        """
+        探测请求结束。已经通过 record_success/record_failure 得出结果时什么也不做；
+        探测被放弃（流被中止、生成器被关闭等）时既不算成功也不算失败，让下一个调用者重新探测。
+        """
+        if not probe:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN and self._probing and self._probe_id == probe:
+                self._probing = False
+
+    def retry_in(self) -> float:
+        """距离下一次允许探测还有多少秒。half_open 且探测尚未结束时，等到探测预计结束（至少 1 秒）。"""
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            if state == OPEN:
+                return max(0.0, self.cooldown_seconds - (now - self.opened_at))
+            if state == HALF_OPEN and self._probing:
+                return max(1.0, self.cooldown_seconds - (now - self._probe_started))
+            return 0.0
+
+    def record_success(self) -> bool:
+        """记录一次成功；返回状态是否发生变化。"""
+        with self._lock:
+            now = time.time()
+            if self.state == HALF_OPEN:
+                self.state, self.opened_at, self._probing = CLOSED, None, False
+                self._outcomes.clear()
+                self._outcomes.append((now, True))
+                return True
+            self._outcomes.append((now, True))
+            self._trim(now)
+            return False
+
+    def record_failure(self, error: BaseException) -> bool:
+        """记录一次失败；返回状态是否发生变化（即熔断器被打开）。"""
+        with self._lock:
+            now = time.time()
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            if self.state == HALF_OPEN:
+                self.state, self.opened_at, self._probing = OPEN, now, False
+                return True
+            self._outcomes.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_requests \
+                    and failures / len(self._outcomes) >= self.error_rate:
+                self.state, self.opened_at = OPEN, now
+                return True
+            return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            state = self._current_state(now)
+            self._trim(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                "state": state,
+                "requests": total,
+                "failures": failures,
+                "error_rate": failures / total if total else 0.0,
+                "opened_at": self.opened_at,
+                "last_error": self.last_error,
+                "outcomes": [[t, ok] for t, ok in self._outcomes],
+                "updated_at": now,
+            }
+
+    def restore(self, data: Dict[str, Any]):
+        with self._lock:
+            self.state = data.get("state", CLOSED)
+            if self.state == HALF_OPEN:
+                self.state = OPEN  # the probe in flight belonged to another process; probe again after cooldown
+            self.opened_at = data.get("opened_at") or (time.time() if self.state == OPEN else None)
+            self.last_error = data.get("last_error")
+            self._outcomes = deque((t, ok) for t, ok in data.get("outcomes", []))
+
+class HealthRegistry:
+    """
+    进程内所有熔断器的集合，键为 "提供者名/模型"。
+    状态变化时写入 PROVIDER_HEALTH_FILE，使GUI、CLI和其他进程都能看到提供者的健康状况。
+    """
+    SAVE_INTERVAL = 5.0
+
+    def __init__(self, health_file: str = PROVIDER_HEALTH_FILE):
+        self.health_file = health_file
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer at a time: saves share the temp file and must not interleave
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._persisted = self.load_file(health_file)
+        self._last_save = 0.0
+
+    @staticmethod
+    def key(provider_name: str, model: Optional[str]) -> str:
+        return f"{provider_name}/{model or ''}"
+
+    @staticmethod
+    def load_file(health_file: str = PROVIDER_HEALTH_FILE) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(health_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def breaker(self, provider_name: str, model: Optional[str]) -> CircuitBreaker:
+        key = self.key(provider_name, model)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key)
+                if key in self._persisted:
+                    breaker.restore(self._persisted[key])
+                self._breakers[key] = breaker
+            return breaker
+
+    def record(self, breaker: CircuitBreaker, error: Optional[BaseException] = None) -> bool:
+        """记录一次调用结果；返回熔断器状态是否发生变化。"""
+        changed = breaker.record_failure(error) if error is not None else breaker.record_success()
+        if changed or time.time() - self._last_save > self.SAVE_INTERVAL:
+            self.save()
+        return changed
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """本进程的熔断器状态，合并文件中其他进程最近写入的、本进程尚未用到的条目。"""
+        persisted = self.load_file(self.health_file)
+        with self._lock:
+            self._persisted = persisted
+            breakers = list(self._breakers.values())
+        data = dict(persisted)
+        data.update({b.key: b.snapshot() for b in breakers})
+        return data
+
+    def save(self):
+        with self._save_lock:
+            data = self.snapshot()
+            temp_path = f"{self.health_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.health_file)
+                self._last_save = time.time()
+            except OSError:
+                pass
+
+def summarize(snapshot: Dict[str, Dict[str, Any]], provider_name: str) -> str:
+    """把一个提供者所有模型的状态汇总为一个标记：🟢 全部正常，🟡 部分熔断，🔴 全部熔断，⚪ 尚无数据。"""
+    states = [entry.get("state", CLOSED) for key, entry in snapshot.items() if key.rsplit('/', 1)[0] == provider_name]
+    if not states:
+        return "⚪"
+    if all(state == CLOSED for state in states):
+        return "🟢"
+    if all(state != CLOSED for state in states):
+        return "🔴"
+    return "🟡"
+
+_health: Optional[HealthRegistry] = None
+_health_lock = threading.Lock()
+
+def get_health() -> HealthRegistry:
+    """Returns the process-wide health registry."""
+    global _health
+    with _health_lock:
+        if _health is None:
+            _health = HealthRegistry()
+        return _health
@@ -1,4 +1,130 @@
 # settings.py
 API_CONFIG_FILE = 'api_config.json'
-TOOL_LIBRARY_FILE = 'tool_library.json'
-SCRIPTS_DIR = 'generated_scripts'
\ No newline at end of file
+TOOL_LIBRARY_FILE = 'tool_library.json'  # legacy format, imported once into TOOL_DB_FILE
+TOOL_DB_FILE = 'tool_library.db'
+SCRIPTS_DIR = 'generated_scripts'
+SCRIPT_CACHE_DIR = 'generated_scripts/cache'  # content-addressed scripts and their precompiled .pyc
+
+# LLM response cache (see llm_interface.ResponseCache)
+LLM_CACHE_ENABLED = False  # can be overridden per provider with "cache": true/false in api_config.json
+LLM_CACHE_DIR = 'llm_cache'
+LLM_CACHE_MAX_ENTRIES = 500
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Default per-provider/per-model rate limits; "rate_limits" in api_config.json overrides these.
+# None disables the corresponding limit.
+DEFAULT_RATE_LIMITS = {
+    "requests_per_minute": None,
+    "tokens_per_minute": None,
+    "max_in_flight": None,
+}
+
+# Stream planner/coder completions into the task log as they arrive.
+STREAM_LLM_OUTPUT = True
+
+# Planner tool retrieval: only the top-k most relevant tools (BM25 over name, description
+# and code) are put into the planning prompt. 0 puts the whole library in the prompt.
+PLANNER_TOP_K_TOOLS = 20
+RETRIEVER_DESCRIPTION_WEIGHT = 3
+RETRIEVER_CODE_WEIGHT = 1
+
+# Maximum number of independent plan steps (see "depends_on") executed concurrently. 1 runs steps strictly in order.
+MAX_PARALLEL_STEPS = 4
+
+# Generate code for the next step in the background while the current step's script runs.
+PIPELINE_CODEGEN = True
+
+# Warm interpreter pool for generated scripts (POSIX only; falls back to a fresh subprocess).
+WORKER_POOL_ENABLED = True
+WORKER_POOL_SIZE = 2
+WORKER_MAX_RUNS = 50  # recycle a worker after this many scripts
+WORKER_PRELOAD_MODULES = (
+    "os", "sys", "json", "re", "time", "datetime", "pathlib", "shutil", "subprocess",
+    "platform", "collections", "math", "random", "csv", "hashlib", "glob", "socket",
+    "urllib.request", "logging", "argparse", "traceback",
+)
+# Script/command output: stream lines to the log as they arrive and keep only a bounded head/tail window in memory.
+STREAM_SCRIPT_OUTPUT = True
+OUTPUT_HEAD_BYTES = 16 * 1024
+OUTPUT_TAIL_BYTES = 48 * 1024
+OUTPUT_LOG_MAX_LINES = 2000  # per stream; later lines are still captured but not forwarded to the log
+
+# Default resource limits for generated scripts (None = unlimited).
+# Overridable per provider ("script_limits" in api_config.json) and per task (Agent(script_limits=...)).
+SCRIPT_LIMITS = {
+    "timeout_seconds": 300,   # wall clock; the whole process group is killed
+    "cpu_seconds": 300,       # RLIMIT_CPU
+    "memory_mb": 4096,        # RLIMIT_AS (virtual address space)
+    "file_size_mb": 1024,     # RLIMIT_FSIZE
+    "max_processes": None,    # RLIMIT_NPROC (counts all processes of the user; ignored for root)
+}
+# Limits for the diagnostician's RUN_COMMAND repair steps (e.g. pip install), which may build packages:
+# compilers and package managers routinely reserve more address space than they use, so only wall clock is capped.
+REPAIR_COMMAND_LIMITS = {
+    "timeout_seconds": 1800,
+    "cpu_seconds": None,
+    "memory_mb": None,
+    "file_size_mb": None,
+    "max_processes": None,
+}
+
+# Retention policy for SCRIPTS_DIR (None = no limit). Scripts whose code is in the tool library or that are
+# currently running are never removed. Enforced by a background thread and by `python main.py gc-scripts`.
+SCRIPT_RETENTION = {
+    "max_files": 500,
+    "max_bytes": 200 * 1024 * 1024,
+    "max_age_days": 30,
+}
+SCRIPT_GC_INTERVAL_SECONDS = 3600
+
+# Static pre-flight check of generated code (see preflight.py) before a process is spawned.
+PREFLIGHT_ENABLED = True
+PREFLIGHT_MAX_FIXES = 2  # regeneration rounds fed with the pre-flight findings before giving up
+PREFLIGHT_DENYLIST = {
+    "input": "脚本在无人值守的环境中运行，读取标准输入会一直阻塞",
+    "eval": "不要执行动态拼接的代码",
+    "exec": "不要执行动态拼接的代码",
+    "os.fork": "不要在脚本中fork进程",
+    "os.kill": "可能终止Agent自身或其他无关进程",
+    "os.killpg": "可能终止Agent自身或其他无关进程",
+    "os.setuid": "不要修改进程权限",
+    "os.setgid": "不要修改进程权限",
+}
+
+# Inner repair loop: when a step's script fails, send the stderr and code back to the coder this many times
+# before escalating to the diagnostician (which re-plans and regenerates the whole task).
+SCRIPT_REPAIR_ATTEMPTS = 2
+
+# Retries in Agent._execute_with_retry: exponential backoff with full jitter, capped per attempt,
+# and an overall deadline per operation for transient (network / rate-limit / 5xx) errors.
+RETRY_BACKOFF_CAP_SECONDS = 60
+RETRY_DEADLINE_SECONDS = 300
+
+# Circuit breaker per provider/model with automatic failover (see provider_health.py, llm_interface.FailoverProvider).
+# Failover goes to the provider's other models, then to the providers listed under "failover" in api_config.json.
+CIRCUIT_BREAKER_ENABLED = True
+CIRCUIT_ERROR_RATE = 0.5        # open when at least this share of recent requests failed...
+CIRCUIT_MIN_REQUESTS = 4        # ...and at least this many requests were made within the window
+CIRCUIT_WINDOW_SECONDS = 120
+CIRCUIT_COOLDOWN_SECONDS = 60   # open -> half-open (one probe request) after this long
+PROVIDER_HEALTH_FILE = 'provider_health.json'
+
+# Headless batch mode (`python main.py batch`): number of Agents running concurrently.
+BATCH_CONCURRENCY = 2
+
+# Per-run checkpoint journal (plan, code and outcome of every step) used to resume interrupted runs.
+CHECKPOINT_ENABLED = True
+CHECKPOINT_DIR = 'checkpoints'
+
+# Diagnostician repair plans cached by error fingerprint (see diagnosis_cache.py, error_handler.fingerprint_error); only plans that
+# repaired the task before are reused without asking the LLM, and plans that fail afterwards are evicted.
+DIAGNOSIS_CACHE_ENABLED = True
+DIAGNOSIS_CACHE_FILE = 'diagnosis_cache.json'
+DIAGNOSIS_CACHE_MAX_ENTRIES = 200
+
+# Tracing spans around planning, code generation, execution, verification, diagnosis and every LLM request
+# (see tracing.py). Also enabled per run with `python main.py --trace [FILE]`.
+TRACING_ENABLED = False
+TRACE_FILE = 'traces.jsonl'
+TRACE_FORMAT = 'jsonl'  # or 'otlp' (OpenTelemetry OTLP/JSON, one ExportTraceServiceRequest per line)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diagnosis_cache
+import llm_interface
+import memory_manager
+import provider_health
+import tool_retriever
+import tool_store
+
+@pytest.fixture(autouse=True)
+def isolated_workdir(tmp_path, monkeypatch):
+    """Runs every test in its own directory with fresh process-wide stores, so nothing leaks between tests."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tool_store, "_store", None)
+    monkeypatch.setattr(memory_manager, "_cache_signature", None)
+    monkeypatch.setattr(tool_retriever, "_index", None)
+    monkeypatch.setattr(diagnosis_cache, "_cache", None)
+    monkeypatch.setattr(provider_health, "_health", None)
+    monkeypatch.setattr(llm_interface, "_response_cache", None)
+    return tmp_path
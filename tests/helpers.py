@@ -0,0 +1,28 @@
+import json
+
+import planner
+from llm_interface import LLMProvider
+
+class ScriptedProvider(LLMProvider):
+    """
+    Answers the planner with a fixed plan and every other prompt with the response of the first
+    registered marker found in the user prompt. Records the user prompts it was asked.
+    """
+    def __init__(self, plan=None, responses=None, name='scripted'):
+        super().__init__({'name': name, 'models': ['m']})
+        self.plan = plan or []
+        self.responses = responses or {}
+        self.prompts = []
+
+    def ask(self, system_prompt, user_prompt, model=None, **options):
+        self.prompts.append(user_prompt)
+        if system_prompt == planner.PLANNER_SYSTEM_PROMPT:
+            return json.dumps(self.plan)
+        for marker, response in self.responses.items():
+            if marker in user_prompt:
+                return response
+        raise AssertionError(f"unexpected prompt: {user_prompt[:200]}")
+
+def step(number, details, task="CREATE_NEW_TOOL", **extra):
+    return {"step_number": number, "task": task, "details": details, "suggested_name": f"tool_{number}",
+            "description": f"step {number}", **extra}
@@ -0,0 +1,235 @@
+import time
+import types
+
+import pytest
+
+import agent_core
+import executor
+from helpers import ScriptedProvider, step
+
+REPAIR_MARKER = "【修改要求】"
+
+def _agent(provider, plan):
+    agent = agent_core.Agent("goal", provider, lambda message: None, checkpoint_enabled=False)
+    agent.plan = plan
+    return agent
+
+def test_failing_script_is_repaired_inline_without_escalating():
+    plan = [step(1, "count the files")]
+    provider = ScriptedProvider(plan, {REPAIR_MARKER: "print('fixed')", "count the files": "raise KeyError('x')"})
+    agent = _agent(provider, plan)
+
+    agent._execute_step(plan[0])
+
+    assert agent.inline_repairs == 1
+    assert agent.final_code_for_step[1] == "print('fixed')"
+    repair_prompts = [p for p in provider.prompts if REPAIR_MARKER in p]
+    assert len(repair_prompts) == 1
+    assert "count the files" in repair_prompts[0] and "KeyError" in repair_prompts[0]
+
+def test_repair_escalates_once_attempts_are_exhausted():
+    plan = [step(1, "count the files")]
+    provider = ScriptedProvider(plan, {REPAIR_MARKER: "raise KeyError('still')", "count the files": "raise KeyError('x')"})
+    agent = _agent(provider, plan)
+
+    with pytest.raises(executor.ScriptError) as raised:
+        agent._execute_step(plan[0])
+
+    assert "KeyError" in raised.value.output
+    assert agent.inline_repairs == 0
+    assert sum(REPAIR_MARKER in p for p in provider.prompts) == agent.repair_attempts
+
+def test_failed_verification_is_not_weakened_by_inline_repair():
+    plan = [step(1, "check the report exists", task="CREATE_VERIFICATION_TOOL")]
+    provider = ScriptedProvider(plan, {REPAIR_MARKER: "print('ok')", "check the report exists": "assert False, 'no report'"})
+    agent = _agent(provider, plan)
+
+    with pytest.raises(executor.ScriptError):
+        agent._execute_step(plan[0])
+
+    assert not any(REPAIR_MARKER in p for p in provider.prompts)
+
+def test_broken_verification_script_is_still_repaired():
+    plan = [step(1, "check the report exists", task="CREATE_VERIFICATION_TOOL")]
+    provider = ScriptedProvider(plan, {REPAIR_MARKER: "print('ok')", "check the report exists": "print(undefined_name)"})
+    agent = _agent(provider, plan)
+
+    agent._execute_step(plan[0])
+
+    assert agent.inline_repairs == 1
+
+def test_repair_script_failing_preflight_fails_the_repair_plan():
+    repair = [{"task": "WRITE_AND_EXECUTE_SCRIPT", "details": "reset the cache", "description": "reset"}]
+    broken = "import module_that_does_not_exist_xyz\nprint('ok')"
+    provider = ScriptedProvider([], {"静态检查发现": broken, "reset the cache": broken})
+    agent = _agent(provider, [])
+
+    assert agent._execute_repair_plan(repair) is False
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429 too many requests")
+        self.retry_after = retry_after
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    fake_time = types.SimpleNamespace(**{**vars(time), "monotonic": fake.monotonic, "sleep": fake.sleep})
+    monkeypatch.setattr(agent_core, "time", fake_time)
+    monkeypatch.setattr(agent_core.error_handler.random, "uniform", lambda low, high: high)
+    return fake
+
+def _failing(errors, result="done"):
+    calls = []
+    def operation():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return operation, calls
+
+def test_retry_waits_for_retry_after(clock):
+    agent = _agent(ScriptedProvider(), [])
+    operation, calls = _failing([RateLimitError(7.5)])
+
+    assert agent._execute_with_retry(operation) == "done"
+    # Retry-After plus the (maximal) 25% spread.
+    assert clock.sleeps == [7.5 * 1.25]
+
+def test_transient_errors_retry_until_the_deadline_not_max_retries(clock):
+    agent = _agent(ScriptedProvider(), [])
+    agent.retry_deadline = 20
+    operation, calls = _failing([RateLimitError(5)] * 100)
+
+    with pytest.raises(RateLimitError):
+        agent._execute_with_retry(operation)
+
+    # Attempts at t=0, 6.25, 12.5 and 18.75; the next wait would overrun the deadline.
+    assert len(calls) == 4 > agent.max_retries
+    assert clock.sleeps == [6.25] * 3
+
+def test_other_errors_stop_after_max_retries(clock):
+    agent = _agent(ScriptedProvider(), [])
+    operation, calls = _failing([KeyError("x")] * 100)
+
+    with pytest.raises(KeyError):
+        agent._execute_with_retry(operation)
+
+    assert len(calls) == agent.max_retries
+
+class FlakyProvider(ScriptedProvider):
+    """Fails the first `failures` repair requests with a connection error."""
+    def __init__(self, plan, responses, failures):
+        super().__init__(plan, responses)
+        self.failures = failures
+
+    def ask(self, system_prompt, user_prompt, model=None, **options):
+        if REPAIR_MARKER in user_prompt and self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset by peer")
+        return super().ask(system_prompt, user_prompt, model, **options)
+
+def test_inline_repair_backs_off_on_transient_errors(clock):
+    plan = [step(1, "count the files")]
+    provider = FlakyProvider(plan, {REPAIR_MARKER: "print('fixed')", "count the files": "raise KeyError('x')"}, failures=2)
+    agent = _agent(provider, plan)
+
+    agent._execute_step(plan[0])
+
+    assert agent.inline_repairs == 1
+    assert len(clock.sleeps) == 2
+
+def test_transient_errors_in_the_repair_plan_fail_the_repair(clock):
+    repair = [{"task": "WRITE_AND_EXECUTE_SCRIPT", "details": "reset the cache", "description": "reset"}]
+    provider = FlakyProvider([], {}, failures=0)
+    provider.ask = lambda *args, **kwargs: (_ for _ in ()).throw(ConnectionError("connection refused"))
+    agent = _agent(provider, [])
+    agent.retry_deadline = 30
+
+    assert agent._execute_repair_plan(repair) is False
+    assert clock.sleeps
+
+def test_depends_on_accepts_numeric_strings_and_falls_back_on_invalid_entries():
+    plan = [step(1, "a"), step(2, "b", depends_on=[]), step(3, "c", depends_on=["1", " 2 "]),
+            step(4, "d", depends_on=["first"]), step(5, "e", depends_on=[1, 9]), step(6, "f", depends_on="2")]
+    agent = _agent(ScriptedProvider(), plan)
+
+    assert agent._plan_dependencies(plan) == {1: set(), 2: set(), 3: {1, 2}, 4: {3}, 5: {1, 4}, 6: {2}}
+
+def _recording_script(label, order_file, seconds):
+    return (f"import time\n"
+            f"open({order_file!r}, 'a').write('{label} start\\n')\n"
+            f"time.sleep({seconds})\n"
+            f"open({order_file!r}, 'a').write('{label} end\\n')\n")
+
+def test_parallel_steps_start_once_their_dependencies_finish(tmp_path):
+    order_file = str(tmp_path / "order.txt")
+    plan = [step(1, "run slow", depends_on=[]), step(2, "run fast", depends_on=[]),
+            step(3, "run last", depends_on=["1", "2"])]
+    provider = ScriptedProvider(plan, {label: _recording_script(label, order_file, seconds)
+                                       for label, seconds in (("run slow", 0.4), ("run fast", 0.1), ("run last", 0))})
+    log = []
+    agent = agent_core.Agent("goal", provider, log.append, checkpoint_enabled=False)
+    agent.repair_attempts = 0
+
+    assert agent.run(), "\n".join(map(str, log))
+
+    with open(order_file) as f:
+        events = f.read().split("\n")[:-1]
+    # Steps 1 and 2 overlap; step 3 waits for both.
+    assert events.index("run fast start") < events.index("run slow end")
+    assert events[-2:] == ["run last start", "run last end"]
+    assert events.index("run slow end") < events.index("run last start")
+
+def test_repair_commands_run_under_the_command_limits(monkeypatch):
+    seen = []
+    monkeypatch.setattr(agent_core.executor, "run_command",
+                        lambda command, log, limits: seen.append(limits) or executor.ExecutionResult(True, "", None))
+    agent = _agent(ScriptedProvider(), [])
+
+    assert agent._execute_repair_plan([{"task": "RUN_COMMAND", "command": "pip install x", "description": "install"}])
+    assert seen == [agent.command_limits]
+    assert seen[0].memory_mb is None and seen[0].cpu_seconds is None
+
+class SlowStreamProvider(ScriptedProvider):
+    """Streams the code for `slow_marker` one line every 50ms."""
+    def __init__(self, plan, responses, slow_marker, lines=60):
+        super().__init__(plan, responses)
+        self.slow_marker = slow_marker
+        self.lines = lines
+        self.streamed = 0
+
+    def ask_stream(self, system_prompt, user_prompt, model=None, **options):
+        if self.slow_marker not in user_prompt:
+            yield from super().ask_stream(system_prompt, user_prompt, model, **options)
+            return
+        for i in range(self.lines):
+            time.sleep(0.05)
+            self.streamed += 1
+            yield f"x{i} = {i}\n"
+
+def test_failed_step_stops_the_running_prefetch():
+    plan = [step(1, "fail now"), step(2, "slow code")]
+    provider = SlowStreamProvider(plan, {"fail now": "raise KeyError('x')"}, "slow code")
+    agent = _agent(provider, plan)
+    agent.repair_attempts = 0
+
+    with pytest.raises(executor.ScriptError):
+        agent._run_plan_sequential()
+    time.sleep(0.3)
+    streamed = provider.streamed
+    time.sleep(0.3)
+
+    assert streamed == provider.streamed < provider.lines
@@ -0,0 +1,51 @@
+import io
+import json
+import os
+
+import batch_runner
+from helpers import ScriptedProvider, step
+from settings import CHECKPOINT_DIR
+
+def test_iter_goals_skips_lines_that_are_not_goals():
+    lines = ['{"id": "a", "goal": "first"}', '', '"second"', '[1, 2]', '42', 'null', '{not json', '{"title": "t", "body": "b"}']
+    log = []
+
+    goals = list(batch_runner.iter_goals(io.StringIO("\n".join(lines)), log.append))
+
+    assert [(g["id"], g["goal"]) for g in goals] == [("a", "first"), ("line-3", "second"), ("line-8", "t\n\nb")]
+    assert len(log) == 4
+
+def _write_results(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.write('{"id": "cut sh')  # the last line of a killed run
+
+def _run(output_path, retry_failed=False):
+    provider = ScriptedProvider([step(1, "say hi")], {"say hi": "print('hi')"})
+    goals = "\n".join(json.dumps({"id": goal_id, "goal": f"goal {goal_id}"}) for goal_id in "abc")
+    return batch_runner.run_batch(io.StringIO(goals), output_path, provider, concurrency=2, quiet=True,
+                                  retry_failed=retry_failed)
+
+def _ids(output_path):
+    with open(output_path, encoding='utf-8') as f:
+        return [json.loads(line)["id"] for line in f if line.startswith('{"id": "') and line.endswith("}\n")]
+
+def test_batch_resumes_after_the_goals_already_in_the_output(tmp_path):
+    output_path = str(tmp_path / "results.jsonl")
+    _write_results(output_path, [{"id": "a", "success": True}, {"id": "b", "success": False}])
+
+    stats = _run(output_path)
+
+    assert stats == {"succeeded": 1, "failed": 0, "skipped": 2}
+    assert _ids(output_path)[2:] == ["c"]
+    assert not os.path.exists(CHECKPOINT_DIR)
+
+def test_batch_retry_failed_reruns_only_failed_goals(tmp_path):
+    output_path = str(tmp_path / "results.jsonl")
+    _write_results(output_path, [{"id": "a", "success": True}, {"id": "b", "success": False}])
+
+    stats = _run(output_path, retry_failed=True)
+
+    assert stats == {"succeeded": 2, "failed": 0, "skipped": 1}
+    assert sorted(_ids(output_path)[2:]) == ["b", "c"]
@@ -0,0 +1,54 @@
+import os
+
+import agent_core
+import checkpoint
+from helpers import ScriptedProvider, step
+
+def _plan(*details):
+    return [{"step_number": n, "task": "CREATE_NEW_TOOL", "details": d} for n, d in enumerate(details, 1)]
+
+def test_code_generated_for_a_replaced_plan_is_not_recorded(tmp_path):
+    journal = checkpoint.Checkpoint.create("goal", "p", "m", False, directory=str(tmp_path))
+    old_plan = _plan("download", "parse")
+    journal.record_plan(old_plan)
+    stale_generation = journal.generation
+
+    new_plan = _plan("install deps", "download again")
+    journal.record_plan(new_plan)
+    # A prefetch for the old plan's step 2 finishing after the re-plan.
+    assert not journal.record_code(old_plan[1], "print('parse')", stale_generation)
+
+    assert journal.code_for(new_plan[1]) is None
+    assert journal.step_status(2) == checkpoint.PENDING
+
+def test_code_is_only_returned_for_the_step_it_was_written_for(tmp_path):
+    journal = checkpoint.Checkpoint.create("goal", "p", "m", False, directory=str(tmp_path))
+    plan = _plan("download")
+    journal.record_plan(plan)
+    assert journal.record_code(plan[0], "print('download')", journal.generation)
+
+    reloaded = checkpoint.Checkpoint.load(journal.path)
+    assert reloaded.code_for(plan[0]) == "print('download')"
+    assert reloaded.code_for(_plan("something else")[0]) is None
+
+def test_resume_skips_steps_that_already_succeeded(tmp_path):
+    runs_file, ready_file = str(tmp_path / "runs.txt"), str(tmp_path / "ready")
+    plan = [step(1, "count runs"), step(2, "needs ready file")]
+    provider = ScriptedProvider(plan, {"count runs": f"open({runs_file!r}, 'a').write('run\\n')",
+                                       "needs ready file": f"import os\nassert os.path.exists({ready_file!r})"})
+    agent = agent_core.Agent("goal", provider, lambda message: None)
+    agent.repair_attempts = 0
+    assert not agent.run()
+    journal = checkpoint.Checkpoint.load(agent.checkpoint.run_id)
+    assert [journal.step_status(1), journal.step_status(2)] == [checkpoint.SUCCEEDED, checkpoint.FAILED]
+
+    open(ready_file, "w").close()
+    provider.prompts.clear()
+    resumed = agent_core.Agent.from_checkpoint(journal, provider, lambda message: None)
+    assert resumed.run()
+
+    with open(runs_file) as f:
+        assert f.read() == "run\n"
+    # Neither the plan nor the code of either step had to be generated again.
+    assert provider.prompts == []
+    assert not os.path.exists(journal.path)  # a finished run leaves nothing to resume
@@ -0,0 +1,38 @@
+import os
+
+import diagnosis_cache
+import error_handler
+
+PLAN = {"strategy": "ATTEMPT_SELF_REPAIR", "plan": [{"task": "RUN_COMMAND", "command": "pip install requests"}]}
+
+def _fingerprint():
+    return error_handler.fingerprint_error(ModuleNotFoundError("No module named 'requests'"))
+
+def test_plan_is_reused_once_proven_and_evicted_when_it_fails(tmp_path):
+    path = str(tmp_path / "diagnoses.json")
+    cache = diagnosis_cache.DiagnosisCache(path)
+    fingerprint = _fingerprint()
+
+    cache.store(fingerprint, PLAN)
+    assert cache.lookup(fingerprint) is None  # not proven yet
+    cache.record_outcome(fingerprint, True)
+    assert cache.lookup(fingerprint) == PLAN
+
+    assert cache.record_outcome(fingerprint, False)
+    assert cache.lookup(fingerprint) is None
+    reloaded = diagnosis_cache.DiagnosisCache(path)
+    assert reloaded.lookup(fingerprint) is None
+    assert reloaded.stats()["evictions"] == 1
+
+def test_lookups_do_not_write_the_cache_file(tmp_path):
+    path = str(tmp_path / "diagnoses.json")
+    cache = diagnosis_cache.DiagnosisCache(path)
+
+    for _ in range(3):
+        assert cache.lookup(_fingerprint()) is None
+
+    assert not os.path.exists(path)
+    assert cache.stats()["misses"] == 3
+    # The counters reach the disk with the next write.
+    cache.store(_fingerprint(), PLAN)
+    assert diagnosis_cache.DiagnosisCache(path).stats()["misses"] == 3
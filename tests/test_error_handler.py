@@ -0,0 +1,41 @@
+import error_handler
+
+def _traceback(script, line, message, library="/usr/lib/python3.11/site-packages/requests/adapters.py"):
+    return (f"Traceback (most recent call last):\n"
+            f'  File "{script}", line {line}, in <module>\n'
+            f"    fetch()\n"
+            f'  File "{library}", line 519, in send\n'
+            f"    raise ConnectionError(e, request=request)\n"
+            f"{message}\n")
+
+def test_fingerprint_ignores_script_names_line_numbers_paths_and_addresses():
+    first = error_handler.parse_traceback(_traceback(
+        "/home/a/generated_scripts/tool_1700000000000_1.py", 12,
+        "requests.exceptions.ConnectionError: HTTPSConnectionPool(host='x', port=443): <urllib3.connection 0x7f3a2c> /tmp/a/b"))
+    second = error_handler.parse_traceback(_traceback(
+        "/srv/b/generated_scripts/cache/3f9a.py", 40,
+        "requests.exceptions.ConnectionError: HTTPSConnectionPool(host='x', port=8443): <urllib3.connection 0x55e1d0> /var/c",
+        library="/opt/venv/lib/python3.12/site-packages/requests/adapters.py"))
+
+    assert first.hash == second.hash
+    assert (first.exception, first.module, first.function) == ("requests.exceptions.ConnectionError", "requests.adapters", "send")
+
+def test_fingerprint_distinguishes_different_failures():
+    base = error_handler.parse_traceback(_traceback("tool.py", 3, "KeyError: 'name'"))
+    other_exception = error_handler.parse_traceback(_traceback("tool.py", 3, "ValueError: 'name'"))
+    other_message = error_handler.parse_traceback(_traceback("tool.py", 3, "KeyError: 'email'"))
+
+    assert len({base.hash, other_exception.hash, other_message.hash}) == 3
+
+def test_last_exception_of_a_chained_traceback_wins():
+    output = (_traceback("tool.py", 3, "KeyError: 'name'") + "\nDuring handling of the above exception, another exception occurred:\n\n"
+              + _traceback("tool.py", 5, "RuntimeError: lookup failed"))
+
+    assert error_handler.parse_traceback(output).exception == "RuntimeError"
+
+def test_syntax_error_without_traceback_header_is_parsed():
+    output = '  File "/x/generated_scripts/tool_1.py", line 2\n    print(\n         ^\nSyntaxError: \'(\' was never closed\n'
+
+    fingerprint = error_handler.parse_traceback(output)
+
+    assert (fingerprint.exception, fingerprint.module, fingerprint.line) == ("SyntaxError", "<script>", 2)
@@ -0,0 +1,129 @@
+import os
+import signal
+import time
+
+import agent_core
+import executor
+import worker_pool
+from helpers import ScriptedProvider
+
+def _printing_script(label):
+    return (f"import time\n"
+            f"for i in range(5):\n"
+            f"    print('{label}-' + str(i), flush=True)\n"
+            f"    time.sleep(0.05)\n")
+
+def test_parallel_step_output_stays_grouped():
+    plan = [
+        {"step_number": n, "task": "CREATE_NEW_TOOL", "details": f"print {label}", "suggested_name": f"print_{label}",
+         "description": f"prints {label}", "depends_on": []}
+        for n, label in ((1, "alpha"), (2, "beta"))
+    ]
+    provider = ScriptedProvider(plan, {"print alpha": _printing_script("alpha"), "print beta": _printing_script("beta")})
+    log = []
+    agent = agent_core.Agent("print two things", provider, log.append, checkpoint_enabled=False)
+    agent.repair_attempts = 0
+
+    assert agent.run(), "\n".join(map(str, log))
+
+    headers = [i for i, line in enumerate(log) if line.startswith("\n--- 正在执行步骤")]
+    assert len(headers) == 2
+    alpha = [i for i, line in enumerate(log) if "│ alpha-" in line]
+    beta = [i for i, line in enumerate(log) if "│ beta-" in line]
+    assert len(alpha) == len(beta) == 5
+    # Each step's live output follows its own header, and step 2's is held back until step 1 is done.
+    assert headers[0] < min(alpha) and max(alpha) < headers[1] < min(beta)
+
+def test_bind_log_resolves_on_calling_thread():
+    routed = []
+    class Routed:
+        def resolve(self):
+            return routed.append
+        def __call__(self, message):
+            raise AssertionError("should have been resolved")
+    result = executor.run_command("echo hello", Routed())
+    assert result.success
+    assert any("hello" in line for line in routed)
+
+def test_script_gc_leaves_dotfiles_and_foreign_files_alone():
+    os.makedirs(executor.SCRIPT_CACHE_DIR)
+    old = time.time() - 90 * 86400
+    kept = [os.path.join(executor.SCRIPTS_DIR, ".gitkeep"), os.path.join(executor.SCRIPTS_DIR, "notes.txt"),
+            os.path.join(executor.SCRIPT_CACHE_DIR, ".gitkeep")]
+    expired = [os.path.join(executor.SCRIPTS_DIR, "tool_1700000000000_1.py"),
+               os.path.join(executor.SCRIPT_CACHE_DIR, "a" * 64 + ".py")]
+    for path in kept + expired:
+        with open(path, "w") as f:
+            f.write("print('old')\n" if path.endswith(".py") else "")
+        os.utime(path, (old, old))
+
+    stats = executor.collect_script_garbage({"max_files": None, "max_bytes": None, "max_age_days": 30})
+
+    assert stats["deleted_files"] == len(expired)
+    assert all(os.path.exists(path) for path in kept)
+    assert not any(os.path.exists(path) for path in expired)
+
+def _wait_for_idle_workers(pool, count):
+    deadline = time.monotonic() + 10
+    while pool.stats()["idle"] < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+def test_pooled_script_pid_is_its_process_group():
+    pool = worker_pool.WorkerPool(size=1, max_runs=10, preload=[])
+    pool.warm_up()
+    try:
+        _wait_for_idle_workers(pool, 1)
+        with open("sleepy.py", "w") as f:
+            f.write("import time\ntime.sleep(5)\n")
+
+        process = pool.run("sleepy.py")
+
+        assert process is not None
+        # Reported only after setsid(), so killing the group can never miss a freshly started script.
+        assert os.getpgid(process.pid) == process.pid
+        os.killpg(process.pid, signal.SIGKILL)
+        assert process.communicate() == (b"", b"")
+        assert process.returncode == -signal.SIGKILL
+        assert pool.stats()["runs"] == 1
+    finally:
+        pool.close()
+
+def test_worker_pool_counts_runs_recycles_and_fallbacks():
+    pool = worker_pool.WorkerPool(size=2, max_runs=2, preload=[])
+    pool.warm_up()
+    try:
+        with open("hello.py", "w") as f:
+            f.write("print('hello')\n")
+        for _ in range(4):
+            _wait_for_idle_workers(pool, 2)
+            process = pool.run("hello.py")
+            assert process.communicate()[0] == b"hello\n"
+        pool.close()
+        assert pool.run("hello.py") is None
+
+        stats = pool.stats()
+        assert (stats["runs"], stats["recycled"], stats["fallbacks"], stats["crashed"]) == (4, 2, 1, 0)
+    finally:
+        pool.close()
+
+def test_identical_scripts_reuse_the_compiled_cache():
+    code = "print('cached')\n"
+    first, second = [], []
+
+    assert executor.run_script(code, "a.py", first.append, stream=False) == (True, "cached\n", None)
+    assert executor.run_script(code, "b.py", second.append, stream=False).success
+
+    assert not any("复用已编译的脚本缓存" in line for line in first)
+    assert any("复用已编译的脚本缓存" in line for line in second)
+    assert len([name for name in os.listdir(executor.SCRIPT_CACHE_DIR) if name.endswith(".pyc")]) == 1
+
+def test_cached_bytecode_reports_source_lines_in_tracebacks():
+    code = "x = 1\n\nraise KeyError('missing')\n"
+    executor.run_script(code, "a.py", None, stream=False)
+
+    result = executor.run_script(code, "a.py", None, stream=False)
+
+    assert not result.success
+    source_path = os.path.abspath(os.path.join(executor.SCRIPT_CACHE_DIR, executor.script_cache_key(code) + ".py"))
+    assert f'File "{source_path}", line 3' in result.output
+    assert "raise KeyError('missing')" in result.output
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import threading
+import types
+
+import pytest
+
+import llm_interface
+import provider_health
+from llm_interface import FailoverProvider, GoogleProvider, LLMProvider, RateLimiter, ResponseCache
+from settings import CIRCUIT_MIN_REQUESTS
+
+def test_cancelled_async_waiters_do_not_leak_slots():
+    async def scenario():
+        limiter = RateLimiter(max_in_flight=1)
+
+        async def hold(seconds):
+            async with limiter.slot_async():
+                await asyncio.sleep(seconds)
+
+        holder = asyncio.create_task(hold(0.2))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.create_task(hold(0)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await holder
+        await asyncio.sleep(0.1)  # let abandoned acquire threads finish
+
+        assert limiter.stats()["in_flight"] == 0
+        assert limiter.stats()["queued"] == 0
+        await asyncio.wait_for(hold(0), timeout=2)
+
+    asyncio.run(scenario())
+
+class FlakyModels(LLMProvider):
+    """Raises the error registered for a model, answers with the model name otherwise."""
+    def __init__(self, errors, models=("primary", "backup")):
+        super().__init__({'name': 'flaky', 'models': list(models)})
+        self.errors = errors
+        self.calls = []
+
+    def ask(self, system_prompt, user_prompt, model=None, **options):
+        self.calls.append(model)
+        if model in self.errors:
+            raise self.errors[model]
+        return model
+
+class NoRegistry:
+    def get_base(self, name):
+        return None
+
+def test_breaker_trips_and_fails_over_to_the_next_model():
+    inner = FlakyModels({"primary": ConnectionError("connection reset")})
+    provider = FailoverProvider(inner, NoRegistry())
+
+    # Below CIRCUIT_MIN_REQUESTS a failure is the caller's to retry.
+    for _ in range(CIRCUIT_MIN_REQUESTS - 1):
+        with pytest.raises(ConnectionError):
+            provider.ask("s", "u")
+    # The failure that trips the breaker is retried on the backup model straight away...
+    assert provider.ask("s", "u") == "backup"
+    # ...and later requests skip the tripped model entirely.
+    inner.calls.clear()
+    assert provider.ask("s", "u") == "backup"
+    assert inner.calls == ["backup"]
+    assert provider.last_route == "flaky/backup"
+    assert provider_health.get_health().snapshot()["flaky/primary"]["state"] == provider_health.OPEN
+
+def test_non_transient_errors_neither_trip_the_breaker_nor_fail_over():
+    inner = FlakyModels({"primary": RuntimeError("request blocked by safety filter")})
+    provider = FailoverProvider(inner, NoRegistry())
+
+    for _ in range(CIRCUIT_MIN_REQUESTS * 2):
+        with pytest.raises(RuntimeError):
+            provider.ask("s", "u")
+
+    assert "backup" not in inner.calls
+    breaker = provider_health.get_health().breaker("flaky", "primary")
+    assert breaker.snapshot()["requests"] == 0
+
+def test_health_snapshot_sees_entries_saved_by_other_processes(tmp_path):
+    health = provider_health.HealthRegistry(str(tmp_path / "health.json"))
+    health.record(health.breaker("mine", "m"), ConnectionError("down"))
+    other = provider_health.HealthRegistry(str(tmp_path / "health.json"))
+    other.record(other.breaker("theirs", "m"))
+
+    assert {"mine/m", "theirs/m"} <= set(health.snapshot())
+
+def test_concurrent_health_saves_leave_a_valid_file(tmp_path):
+    health = provider_health.HealthRegistry(str(tmp_path / "health.json"))
+    breakers = [health.breaker("p", str(i)) for i in range(8)]
+    errors = []
+
+    def hammer(breaker):
+        try:
+            for _ in range(20):
+                health.record(breaker, ConnectionError("down"))
+                health.save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(b,)) for b in breakers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(provider_health.HealthRegistry.load_file(str(tmp_path / "health.json"))) == 8
+    assert not list(tmp_path.glob("*.tmp"))
+
+class _Chunk:
+    def __init__(self, text=None):
+        self.parts = [text] if text else []
+        self._text = text
+
+    @property
+    def text(self):
+        if not self.parts:
+            raise ValueError("The `response.text` quick accessor requires the response to contain a valid `Part`")
+        return self._text
+
+def test_google_stream_skips_chunks_without_text(monkeypatch):
+    provider = GoogleProvider({'name': 'google', 'models': ['gemini'], 'api_key': 'test-key'})
+    model = types.SimpleNamespace(generate_content=lambda prompt, stream: iter([_Chunk("he"), _Chunk("llo"), _Chunk()]))
+    monkeypatch.setattr(provider, "_model_instance", lambda system_prompt, target_model: model)
+
+    assert "".join(provider.ask_stream("s", "u")) == "hello"
+
+class OptionsRecorder(LLMProvider):
+    def __init__(self):
+        super().__init__({'name': 'recorder', 'models': ['m']})
+        self.options = []
+
+    def ask(self, system_prompt, user_prompt, model=None, **options):
+        self.options.append(options)
+        return "ok"
+
+def test_default_async_and_stream_forward_request_options():
+    provider = OptionsRecorder()
+
+    assert asyncio.run(provider.ask_async("s", "u", use_cache=False)) == "ok"
+    assert list(provider.ask_stream("s", "u", use_cache=False)) == ["ok"]
+    assert provider.options == [{"use_cache": False}] * 2
+
+def test_response_cache_evicts_least_recently_used_without_rescanning(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache"), max_entries=2, max_bytes=10 ** 6, ttl_seconds=None)
+    cache.put("a", "first")
+    scans = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: scans.append(path) or real_listdir(path))
+
+    cache.put("b", "second")
+    assert cache.get("a") == "first"
+    cache.put("c", "third")
+
+    assert scans == []
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("first", None, "third")
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 2
+
+def test_response_cache_entry_removed_behind_its_back_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    cache.put("a", "first")
+    os.remove(os.path.join(cache.cache_dir, "a.json"))  # e.g. evicted by another process
+
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+class CountingProvider(LLMProvider):
+    built = []
+
+    def __init__(self, config):
+        super().__init__(config)
+        CountingProvider.built.append(config["name"])
+
+    def ask(self, system_prompt, user_prompt, model=None, **options):
+        return self.get_name()
+
+def test_registry_shares_providers_and_rebuilds_only_changed_ones(tmp_path, monkeypatch):
+    monkeypatch.setitem(llm_interface.PROVIDER_CLASSES, "counting", CountingProvider)
+    CountingProvider.built = []
+    path = tmp_path / "api_config.json"
+
+    def write(configs, mtime):
+        path.write_text(json.dumps(configs), encoding="utf-8")
+        os.utime(path, ns=(mtime, mtime))
+
+    first = {"name": "a", "type": "counting", "models": ["m1"], "cache": False}
+    second = {"name": "b", "type": "counting", "models": ["m2"], "cache": False}
+    write([first, second], 1_000_000_000)
+    registry = llm_interface.ProviderRegistry(str(path))
+
+    a, b = registry.get_base("a"), registry.get_base("b")
+    assert registry.get_base("a") is a and registry.get_base("b") is b
+    assert CountingProvider.built == ["a", "b"]
+
+    write([first, dict(second, models=["m3"])], 2_000_000_000)
+    assert registry.get_base("a") is a
+    assert registry.get_base("b") is not b
+    assert CountingProvider.built == ["a", "b", "b"]
+    assert registry.get_base("missing") is None
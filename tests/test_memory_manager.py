@@ -0,0 +1,28 @@
+import memory_manager
+import tool_store
+
+def test_tool_cache_sees_writes_from_other_processes():
+    memory_manager.save_tool("fetch", "downloads", "print('fetch')", log_func=None)
+    version = memory_manager.library_version()
+    assert memory_manager.get_tool_code("fetch") == "print('fetch')"
+
+    # Another process writing to the same database.
+    tool_store.ToolStore(tool_store.get_store().db_path, None).insert_unique("parse", "", "print('parse')")
+
+    assert memory_manager.get_tool_code("parse") == "print('parse')"
+    assert memory_manager.library_version() > version
+
+def test_reads_are_served_from_the_cache_until_the_library_changes(monkeypatch):
+    memory_manager.save_tool("fetch", "downloads", "print('fetch')", log_func=None)
+    memory_manager.load_tools()
+    loads = []
+    list_tools = tool_store.ToolStore.list_tools
+    monkeypatch.setattr(tool_store.ToolStore, "list_tools", lambda self: loads.append(1) or list_tools(self))
+
+    for _ in range(5):
+        assert memory_manager.get_tool_code("fetch") == "print('fetch')"
+    # A save in this process updates the cache in place rather than forcing a reload.
+    memory_manager.save_tool("parse", "", "print('parse')", log_func=None)
+    assert memory_manager.get_tool_code("parse") == "print('parse')"
+
+    assert loads == []
@@ -0,0 +1,12 @@
+import preflight
+
+def test_module_installed_after_a_miss_passes_once_invalidated(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    code = "import freshly_installed_mod\nprint(freshly_installed_mod.VALUE)\n"
+    assert [issue.kind for issue in preflight.check_code(code).issues] == ["import"]
+
+    # What a repair step's `pip install` amounts to: the module appears on sys.path.
+    (tmp_path / "freshly_installed_mod.py").write_text("VALUE = 1\n")
+    preflight.invalidate()
+
+    assert preflight.check_code(code).ok
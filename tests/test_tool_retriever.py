@@ -0,0 +1,25 @@
+import tool_retriever
+
+TOOLS = [
+    {"name": "download_file", "description": "下载网页并保存到文件", "code": "import urllib.request"},
+    {"name": "resize_image", "description": "缩放图片尺寸", "code": "from PIL import Image"},
+    {"name": "parse_csv_report", "description": "parse a csv report and sum columns", "code": "import csv"},
+]
+
+def test_tokenize_splits_snake_case_and_chinese_bigrams():
+    assert tool_retriever.tokenize("resize_image 图片") == ["resize", "image", "图", "片", "图片"]
+
+def test_query_ranks_relevant_tools_first_and_drops_unrelated_ones():
+    tools, _ = tool_retriever.retrieve("把这个网页下载下来", TOOLS, version=1, k=2)
+    assert [tool["name"] for tool in tools] == ["download_file"]
+
+    tools, _ = tool_retriever.retrieve("sum the columns of the csv", TOOLS, version=1, k=2)
+    assert tools[0]["name"] == "parse_csv_report"
+
+def test_index_is_rebuilt_only_when_the_library_version_changes():
+    first, _ = tool_retriever.get_index(TOOLS, 7)
+    again, build_seconds = tool_retriever.get_index(TOOLS, 7)
+    rebuilt, _ = tool_retriever.get_index(TOOLS[:1], 8)
+
+    assert again is first and build_seconds == 0.0
+    assert rebuilt is not first and len(rebuilt.tools) == 1
@@ -0,0 +1,64 @@
+import json
+import threading
+
+import tool_store
+
+def _store(tmp_path, legacy=None):
+    legacy_path = tmp_path / "tool_library.json"
+    if legacy is not None:
+        legacy_path.write_text(json.dumps(legacy), encoding="utf-8")
+    return tool_store.ToolStore(str(tmp_path / "tools.db"), str(legacy_path))
+
+def test_legacy_json_library_is_imported_once(tmp_path):
+    store = _store(tmp_path, [{"name": "fetch", "description": "downloads", "code": "print('fetch')"}])
+
+    assert [tool["name"] for tool in store.list_tools()] == ["fetch"]
+    (tmp_path / "tool_library.json").write_text(json.dumps([{"name": "other", "code": "print(1)"}]), encoding="utf-8")
+    assert [tool["name"] for tool in _store(tmp_path).list_tools()] == ["fetch"]
+
+def test_name_clash_with_different_code_gets_a_suffix(tmp_path):
+    store = _store(tmp_path)
+
+    first = store.insert_unique("fetch", "v1", "print('v1')")
+    second = store.insert_unique("fetch", "v2", "print('v2')")
+
+    assert first.name == "fetch" and second.inserted and second.name.startswith("fetch_")
+    assert store.get("fetch")["code"] == "print('v1')"
+    assert store.get(second.name)["description"] == "v2"
+
+def test_concurrent_saves_of_one_name_keep_every_version(tmp_path):
+    store = _store(tmp_path)
+    store.count()  # create the schema before the threads race
+
+    threads = [threading.Thread(target=store.insert_unique, args=("fetch", "", f"print({i})")) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.count() == 8
+    assert len({tool["code"] for tool in store.list_tools()}) == 8
+
+def test_reformatted_code_is_stored_once_under_an_alias(tmp_path):
+    store = _store(tmp_path)
+    store.insert_unique("fetch", "", "def run():\n    return 1  # one\n")
+
+    same = store.insert_unique("fetch", "", "def run():\n\n    return 1\n")
+    alias = store.insert_unique("download", "", "def run(): return 1\n")
+
+    assert not same.inserted
+    assert alias.inserted and alias.alias_of == "fetch"
+    assert store.stats() == {"names": 2, "unique_code": 1}
+
+def test_compact_drops_suffixed_duplicates_of_the_original(tmp_path):
+    store = _store(tmp_path)
+    store.insert_unique("fetch", "", "print('v1')")
+    renamed = store.insert_unique("fetch", "", "print('v2')")
+    # A copy saved under the suffixed name before deduplication existed.
+    store.insert_unique("fetch_1700000000", "", "print('v1')")
+
+    stats = store.compact()
+
+    assert stats["removed_duplicate_names"] == 1
+    assert sorted(tool["name"] for tool in store.list_tools()) == sorted(["fetch", renamed.name])
+    assert stats["unique_code"] == 2
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import tracing
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    yield path
+    tracing.configure(None)
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+def test_disabled_tracing_returns_the_shared_noop_span():
+    tracing.configure(None)
+    assert not tracing.enabled()
+    assert tracing.span("plan") is tracing.span("execute")
+    with tracing.span("plan") as span:
+        span.set(steps=3)
+
+def test_nested_spans_share_a_trace_and_link_to_their_parent(trace_file):
+    tracing.configure(str(trace_file), "jsonl")
+    with tracing.span("plan", goal="demo"):
+        with tracing.span("llm", kind="client") as child:
+            child.set(tokens=12)
+        tracing.current().set(steps=2)
+
+    child_record, root_record = _records(trace_file)  # children end first
+    assert root_record["name"] == "plan" and root_record["parent_id"] is None
+    assert root_record["attributes"] == {"goal": "demo", "steps": 2}
+    assert child_record["trace_id"] == root_record["trace_id"]
+    assert child_record["parent_id"] == root_record["span_id"]
+    assert child_record["attributes"] == {"tokens": 12}
+
+def test_errors_are_recorded_and_still_raised(trace_file):
+    tracing.configure(str(trace_file), "jsonl")
+
+    @tracing.traced("step", attributes=lambda number: {"step": number})
+    def run(number):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        run(4)
+
+    record, = _records(trace_file)
+    assert record["status"] == "error" and record["error"] == "ValueError: boom"
+    assert record["attributes"] == {"step": 4}
+
+def test_detached_span_does_not_become_the_parent(trace_file):
+    tracing.configure(str(trace_file), "jsonl")
+    with tracing.detached_span("stream"):
+        with tracing.span("inner"):
+            pass
+
+    inner, stream = _records(trace_file)
+    assert inner["parent_id"] is None
+    assert inner["trace_id"] != stream["trace_id"]
+
+def test_otlp_format_writes_export_requests(trace_file):
+    tracing.configure(str(trace_file), "otlp")
+    with tracing.span("plan"):
+        with tracing.span("llm", kind="client", ok=True, latency=0.5, model="m"):
+            pass
+
+    child_request, root_request = _records(trace_file)
+    resource_spans = child_request["resourceSpans"][0]
+    assert resource_spans["resource"]["attributes"][0]["value"] == {"stringValue": tracing.SERVICE_NAME}
+    child = resource_spans["scopeSpans"][0]["spans"][0]
+    root = root_request["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert child["kind"] == 3 and root["kind"] == 1
+    assert child["parentSpanId"] == root["spanId"] and "parentSpanId" not in root
+    assert {item["key"]: item["value"] for item in child["attributes"]} == {
+        "ok": {"boolValue": True}, "latency": {"doubleValue": 0.5}, "model": {"stringValue": "m"},
+    }
+    assert root["status"] == {"code": 1}
@@ -0,0 +1,87 @@
+# tool_retriever.py
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+from settings import RETRIEVER_CODE_WEIGHT, RETRIEVER_DESCRIPTION_WEIGHT
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    把文本切分为检索词：英文/数字按单词切分（snake_case 会拆开），
+    中文没有空格分词，因此使用单字加相邻双字(bigram)。
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text.lower()):
+        if '一' <= word[0] <= '鿿':
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif len(word) > 1:
+            tokens.append(word)
+    return tokens
+
+class BM25Index:
+    """纯Python实现的 Okapi BM25 索引，文档由工具名、描述和代码组成。"""
+    def __init__(self, tools: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.tools = tools
+        self.doc_freqs: List[Counter] = []
+        self.doc_lengths: List[int] = []
+        df: Counter = Counter()
+        for tool in tools:
+            tokens = (tokenize(tool['name']) + tokenize(tool.get('description', ''))) * RETRIEVER_DESCRIPTION_WEIGHT
+            tokens += tokenize(tool.get('code', '')) * RETRIEVER_CODE_WEIGHT
+            freqs = Counter(tokens)
+            self.doc_freqs.append(freqs)
+            self.doc_lengths.append(len(tokens))
+            df.update(freqs.keys())
+        n = len(tools)
+        self.avg_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def query(self, text: str, k: int) -> List[Tuple[Dict[str, Any], float]]:
+        """返回得分最高的 k 个工具及其得分（只包含得分大于0的工具）。"""
+        terms = [t for t in set(tokenize(text)) if t in self.idf]
+        scored = []
+        for tool, freqs, length in zip(self.tools, self.doc_freqs, self.doc_lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((tool, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:k]
+
+_index: Optional[BM25Index] = None
+_index_version: Optional[int] = None
+_index_lock = threading.Lock()
+
+def get_index(tools: List[Dict[str, Any]], version: int) -> Tuple[BM25Index, float]:
+    """
+    返回工具库的检索索引和本次构建耗时（秒，复用缓存时为0）。
+    version 是 memory_manager.library_version()，工具库变化时才会重建。
+    """
+    global _index, _index_version
+    with _index_lock:
+        if _index is not None and _index_version == version:
+            return _index, 0.0
+        start = time.perf_counter()
+        _index = BM25Index(tools)
+        _index_version = version
+        return _index, time.perf_counter() - start
+
+def retrieve(query: str, tools: List[Dict[str, Any]], version: int, k: int) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """检索与 query 最相关的 top-k 工具，并返回构建/查询耗时（毫秒）。"""
+    index, build_seconds = get_index(tools, version)
+    start = time.perf_counter()
+    results = index.query(query, k)
+    timings = {"build_ms": build_seconds * 1000, "query_ms": (time.perf_counter() - start) * 1000}
+    return [tool for tool, _ in results], timings
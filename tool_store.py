@@ -0,0 +1,265 @@
+# tool_store.py
+import ast
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, NamedTuple
+
+from settings import TOOL_DB_FILE, TOOL_LIBRARY_FILE
+import preflight
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tools (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT NOT NULL DEFAULT '',
+    code TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _execute_script(conn: sqlite3.Connection, script: str):
+    # executescript() would COMMIT the surrounding transaction, so run statements one by one.
+    for statement in script.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+def _migrate_content_addressed(conn: sqlite3.Connection):
+    """v1: 代码按规范化后的内容哈希只存一份，tools 表中的每个名称只是指向它的别名。"""
+    _execute_script(conn, """
+        CREATE TABLE tool_code (
+            hash TEXT PRIMARY KEY,
+            code TEXT NOT NULL
+        );
+        CREATE TABLE tools_v1 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT NOT NULL DEFAULT '',
+            code_hash TEXT NOT NULL REFERENCES tool_code(hash),
+            created_at REAL NOT NULL
+        );
+    """)
+    for row in conn.execute("SELECT id, name, description, code, created_at FROM tools ORDER BY id").fetchall():
+        digest = code_hash(row['code'])
+        conn.execute("INSERT OR IGNORE INTO tool_code (hash, code) VALUES (?, ?)", (digest, row['code']))
+        conn.execute(
+            "INSERT INTO tools_v1 (id, name, description, code_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+            (row['id'], row['name'], row['description'], digest, row['created_at'])
+        )
+    _execute_script(conn, """
+        DROP TABLE tools;
+        ALTER TABLE tools_v1 RENAME TO tools;
+        CREATE INDEX idx_tools_code_hash ON tools(code_hash);
+    """)
+
+# Index i upgrades a database from user_version i to i + 1.
+MIGRATIONS = [_migrate_content_addressed]
+
+def normalize_code(code: str) -> str:
+    """
+    返回代码的规范形式：AST dump 天然去掉了注释、空白和格式差异。
+    无法解析的代码退化为去掉首尾空白的原文。
+    """
+    try:
+        return ast.dump(preflight.parse(code))
+    except (SyntaxError, ValueError):
+        return code.strip()
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(normalize_code(code).encode('utf-8')).hexdigest()
+
+class SaveResult(NamedTuple):
+    name: str
+    inserted: bool
+    code_hash: str
+    alias_of: Optional[str] = None  # existing tool whose code this new name now shares
+
+class ToolStore:
+    """
+    基于SQLite(WAL模式)的工具库。工具名上有唯一索引，按名称查询为O(log n)，
+    插入在单个 IMMEDIATE 事务中完成，多个GUI任务或进程并发保存时不会互相覆盖。
+    代码按内容哈希去重存储，逻辑相同的工具只保存一份代码，可以有多个名称和描述。
+    首次打开时会把旧的 tool_library.json 一次性导入。
+    """
+    def __init__(self, db_path: str = TOOL_DB_FILE, legacy_json_path: Optional[str] = TOOL_LIBRARY_FILE):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: transactions are managed explicitly with BEGIN/COMMIT.
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._migrate(conn)
+                    self._import_legacy_json(conn)
+                    self._initialized = True
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                _execute_script(conn, SCHEMA)
+            for index in range(version, len(MIGRATIONS)):
+                MIGRATIONS[index](conn)
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy_json(self, conn: sqlite3.Connection):
+        """一次性导入旧版 JSON 工具库，导入状态记录在 meta 表中。"""
+        if not self.legacy_json_path:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                conn.execute("COMMIT")
+                return
+            try:
+                with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                    tools = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                tools = []
+            for tool in tools:
+                if tool.get('name') and not conn.execute("SELECT 1 FROM tools WHERE name = ?", (tool['name'],)).fetchone():
+                    self._insert(conn, tool['name'], tool.get('description', ''), tool.get('code', ''))
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (str(len(tools)),))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, name: str, description: str, code: str) -> str:
+        digest = code_hash(code)
+        conn.execute("INSERT OR IGNORE INTO tool_code (hash, code) VALUES (?, ?)", (digest, code))
+        conn.execute(
+            "INSERT INTO tools (name, description, code_hash, created_at) VALUES (?, ?, ?, ?)",
+            (name, description, digest, time.time())
+        )
+        return digest
+
+    @staticmethod
+    def _row_to_tool(row: sqlite3.Row) -> Dict[str, Any]:
+        return {"name": row['name'], "description": row['description'], "code": row['code'], "code_hash": row['code_hash']}
+
+    def list_tools(self) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT t.name, t.description, t.code_hash, c.code FROM tools t JOIN tool_code c ON c.hash = t.code_hash ORDER BY t.id"
+        ).fetchall()
+        return [self._row_to_tool(r) for r in rows]
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT t.name, t.description, t.code_hash, c.code FROM tools t JOIN tool_code c ON c.hash = t.code_hash WHERE t.name = ?",
+            (name,)
+        ).fetchone()
+        return self._row_to_tool(row) if row else None
+
+    def insert_unique(self, base_name: str, description: str, code: str) -> SaveResult:
+        """
+        原子地保存工具。
+        同名且逻辑相同（规范化代码哈希一致）则不插入；同名但逻辑不同则加时间戳后缀；
+        逻辑与其他名称的工具相同时只新增一个别名，代码不会重复存储。
+        """
+        digest = code_hash(code)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute("SELECT code_hash FROM tools WHERE name = ?", (base_name,)).fetchone()
+            if existing and existing['code_hash'] == digest:
+                conn.execute("COMMIT")
+                return SaveResult(base_name, False, digest)
+            final_name = base_name
+            if existing:
+                final_name = f"{base_name}_{int(time.time())}"
+                suffix = 1
+                while conn.execute("SELECT 1 FROM tools WHERE name = ?", (final_name,)).fetchone():
+                    suffix += 1
+                    final_name = f"{base_name}_{int(time.time())}_{suffix}"
+            twin = conn.execute("SELECT name FROM tools WHERE code_hash = ? ORDER BY id LIMIT 1", (digest,)).fetchone()
+            self._insert(conn, final_name, description, code)
+            conn.execute("COMMIT")
+            return SaveResult(final_name, True, digest, twin['name'] if twin else None)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def compact(self) -> Dict[str, int]:
+        """
+        原地压缩工具库：
+        1. 用当前的规范化规则重新计算哈希，合并逻辑相同的代码；
+        2. 删除自动加时间戳后缀产生、且与原名工具逻辑相同的重复名称；
+        3. 删除不再被任何名称引用的代码。
+        返回各项的数量统计。
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            merged_code = 0
+            for row in conn.execute("SELECT hash, code FROM tool_code").fetchall():
+                digest = code_hash(row['code'])
+                if digest == row['hash']:
+                    continue
+                conn.execute("INSERT OR IGNORE INTO tool_code (hash, code) VALUES (?, ?)", (digest, row['code']))
+                conn.execute("UPDATE tools SET code_hash = ? WHERE code_hash = ?", (digest, row['hash']))
+                conn.execute("DELETE FROM tool_code WHERE hash = ?", (row['hash'],))
+                merged_code += 1
+
+            removed_names = 0
+            hashes = {r['name']: r['code_hash'] for r in conn.execute("SELECT name, code_hash FROM tools")}
+            for name, digest in hashes.items():
+                match = re.fullmatch(r"(.+)_\d{9,}(?:_\d+)?", name)
+                if match and hashes.get(match.group(1)) == digest:
+                    conn.execute("DELETE FROM tools WHERE name = ?", (name,))
+                    removed_names += 1
+
+            orphaned = conn.execute("DELETE FROM tool_code WHERE hash NOT IN (SELECT code_hash FROM tools)").rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        stats = self.stats()
+        stats.update({"merged_code": merged_code, "removed_duplicate_names": removed_names, "removed_orphan_code": orphaned})
+        return stats
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "names": conn.execute("SELECT COUNT(*) FROM tools").fetchone()[0],
+            "unique_code": conn.execute("SELECT COUNT(*) FROM tool_code").fetchone()[0],
+        }
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM tools").fetchone()[0]
+
+_store: Optional[ToolStore] = None
+_store_lock = threading.Lock()
+
+def get_store() -> ToolStore:
+    """Returns the process-wide tool store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ToolStore()
+        return _store
@@ -0,0 +1,203 @@
+# tracing.py
+"""
+轻量级调用链追踪：用 span 记录 规划 -> 生成代码 -> 执行 -> 验证 各阶段以及每次LLM请求的耗时和属性，
+并导出到本地文件，每个 span 一行。支持两种格式：
+- "jsonl": 扁平的 JSON 记录，便于用 jq 或 `python main.py trace-summary` 分析；
+- "otlp": OpenTelemetry OTLP/JSON（每行一个 ExportTraceServiceRequest），可由 OpenTelemetry Collector
+  的 otlpjsonfile receiver 读取后转发到 Jaeger、Tempo 等后端。
+未启用时 span() 直接返回共享的空对象，开销只有一次全局变量检查。
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from settings import TRACING_ENABLED, TRACE_FILE, TRACE_FORMAT
+
+SERVICE_NAME = "mcaa-agent"
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional['Span'], kind: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+            "start": self.start_ns / 1e9, "duration_ms": round(self.duration_ms, 3),
+            "status": "error" if self.error else "ok", "error": self.error, "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id, "spanId": self.span_id, "name": self.name,
+            "kind": 3 if self.kind == "client" else 1,  # SPAN_KIND_CLIENT / SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [span]}],
+        }]}
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)}
+
+class Tracer:
+    """把结束的 span 追加写入 path。写入有缓冲，根 span 结束时和进程退出时刷新。"""
+    def __init__(self, path: str = TRACE_FILE, fmt: str = TRACE_FORMAT):
+        if fmt not in ("jsonl", "otlp"):
+            raise ValueError(f"unknown trace format '{fmt}' (expected 'jsonl' or 'otlp')")
+        self.path = path
+        self.format = fmt
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span: Span):
+        record = span.to_otlp() if self.format == "otlp" else span.to_record()
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            if span.parent_id is None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_tracer: Optional[Tracer] = None
+_current: contextvars.ContextVar = contextvars.ContextVar("tracing_span", default=None)
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopSpan()
+
+class _ActiveSpan:
+    __slots__ = ("tracer", "span", "activate", "token")
+
+    def __init__(self, tracer: Tracer, name: str, kind: str, attributes: Dict[str, Any], activate: bool = True):
+        self.tracer = tracer
+        self.span = Span(name, _current.get(), kind, attributes)
+        self.activate = activate
+        self.token = None
+
+    def __enter__(self) -> Span:
+        if self.activate:
+            self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if isinstance(exc, GeneratorExit):
+            self.span.attributes["cancelled"] = True  # a stream the caller stopped reading early
+        elif exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"[:500]
+        if self.token is not None:
+            _current.reset(self.token)
+        try:
+            self.tracer.export(self.span)
+        except OSError:
+            pass  # tracing must never break the traced code
+        return False
+
+def span(name: str, kind: str = "internal", **attributes):
+    """`with tracing.span("name", key=value) as s: ... s.set(other=1)`；未启用时返回空对象。"""
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP
+    return _ActiveSpan(tracer, name, kind, attributes)
+
+def detached_span(name: str, kind: str = "internal", **attributes):
+    """
+    与 span() 相同，但不成为当前 span（其中创建的 span 不会挂在它下面）。
+    用于生成器：生成器在 yield 之间运行在调用方的上下文中，不能修改当前 span。
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP
+    return _ActiveSpan(tracer, name, kind, attributes, activate=False)
+
+def current():
+    """当前线程/协程中正在进行的 span，用于在被追踪的函数内部补充属性；未启用时返回空对象。"""
+    return (_current.get() if _tracer is not None else None) or _NOOP
+
+def traced(name: str, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    装饰器：为函数的每次调用创建一个 span。attributes 接收与函数相同的参数，返回调用开始时的属性；
+    结束时的属性由函数内部通过 current().set() 补充。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with _ActiveSpan(tracer, name, "internal", attributes(*args, **kwargs) if attributes else {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enabled() -> bool:
+    return _tracer is not None
+
+def configure(path: Optional[str] = TRACE_FILE, fmt: str = TRACE_FORMAT):
+    """启用追踪并写入 path；path 为 None 时关闭追踪。"""
+    global _tracer
+    previous, _tracer = _tracer, (Tracer(path, fmt) if path else None)
+    if previous is not None:
+        previous.close()
+
+def _close():
+    if _tracer is not None:
+        _tracer.close()
+
+atexit.register(_close)
+
+if TRACING_ENABLED:
+    configure(TRACE_FILE, TRACE_FORMAT)
@@ -1,7 +1,10 @@
 # verifier.py
 from typing import Optional, Callable
 from llm_interface import LLMProvider
-from coder import _clean_code
+from coder import _clean_code, _preflight
+import preflight
+import error_handler
+import tracing
 
 VERIFIER_SYSTEM_PROMPT = """
 你是一名高级软件质量保证(QA)工程师。你的任务是为一段Python代码编写一个验收测试脚本。
@@ -18,6 +21,7 @@ VERIFIER_SYSTEM_PROMPT = """
 5.  你的输出必须是且只能是纯粹的Python代码，不含任何解释。
 """
 
+@tracing.traced("verifier.create_verification_code", lambda original_goal, *args, **kwargs: {"goal_chars": len(original_goal)})
 def create_verification_code(
     original_goal: str, 
     executed_code_description: str,
@@ -31,8 +35,13 @@ def create_verification_code(
 
     try:
         code = llm_provider.ask(VERIFIER_SYSTEM_PROMPT, user_prompt)
-        return _clean_code(code, log_func)
+        tracing.current().set(code_chars=len(code or ""))
+        return _preflight(_clean_code(code, log_func), llm_provider, log_func)
+    except preflight.PreflightError:
+        raise
     except Exception as e:
+        if error_handler.is_transient(e):
+            raise  # let Agent._execute_with_retry back off and retry
         if log_func:
             log_func(f"❌ 验收代码生成时发生错误: {e}")
         return None
\ No newline at end of file
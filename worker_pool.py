@@ -0,0 +1,337 @@
+# worker_pool.py
+"""
+预热的Python解释器进程池，用于执行生成的脚本。
+
+每个 worker 是一个常驻的单线程 fork server：启动时预先导入常用模块，之后对每个任务
+fork 出一个子进程，在全新的全局命名空间中以 __main__ 运行脚本。子进程的 stdout/stderr
+是父进程通过 UNIX socket 传递过来的管道，退出码和 `python script.py` 完全一致，
+因此调用方可以像使用 subprocess.Popen 一样使用返回的 PooledProcess。
+仅支持提供 os.fork 和 socket.send_fds 的平台；不支持时调用方应回退到 subprocess。
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def is_supported() -> bool:
+    return hasattr(os, 'fork') and hasattr(socket, 'send_fds') and hasattr(socket, 'AF_UNIX')
+
+def resolve_rlimits(rlimits: Dict[str, Tuple[int, int]]) -> List[Tuple[int, Tuple[int, int]]]:
+    """
+    把 {resource 常量名（如 "RLIMIT_CPU"）: (soft, hard)} 换算成 setrlimit/prlimit 的参数。
+    只会收紧限制：当前进程（也就是子进程继承的）硬限制更小时以它为准。
+    """
+    if resource is None:
+        return []
+    resolved = []
+    for name, (soft, hard) in rlimits.items():
+        key = getattr(resource, name, None)
+        if key is None:
+            continue
+        _, current_hard = resource.getrlimit(key)
+        if current_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current_hard), min(hard, current_hard)
+        resolved.append((key, (soft, hard)))
+    return resolved
+
+def apply_rlimits(rlimits: Dict[str, Tuple[int, int]]):
+    """在当前进程中设置资源限制，键同 resolve_rlimits()。"""
+    for key, value in resolve_rlimits(rlimits):
+        resource.setrlimit(key, value)
+
+# ---------------------------------------------------------------------------
+# Parent side
+# ---------------------------------------------------------------------------
+
+def _fd_is_open(fd: int) -> bool:
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+class _Worker:
+    def __init__(self, process: subprocess.Popen, sock: socket.socket):
+        self.process = process
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.runs = 0
+
+    def read_message(self) -> Optional[dict]:
+        line = self.reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        finally:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class PooledProcess:
+    """在 worker 中运行的脚本进程，提供与 subprocess.Popen 相同的常用接口。"""
+    def __init__(self, pool: 'WorkerPool', worker: _Worker, pid: int, stdout_fd: int, stderr_fd: int):
+        self._pool = pool
+        self._worker = worker
+        self.pid = pid
+        self.stdout = os.fdopen(stdout_fd, 'rb')
+        self.stderr = os.fdopen(stderr_fd, 'rb')
+        self.returncode: Optional[int] = None
+
+    def wait(self) -> int:
+        if self.returncode is None:
+            message = self._worker.read_message()
+            if message is None:
+                # The worker itself died; treat the script like a process killed by a signal.
+                self.returncode = -9
+                self._pool._discard(self._worker)
+            else:
+                self.returncode = message['returncode']
+                self._pool._release(self._worker)
+        return self.returncode
+
+    def communicate(self) -> Tuple[bytes, bytes]:
+        stderr_chunks: List[bytes] = []
+        reader = threading.Thread(target=lambda: stderr_chunks.append(self.stderr.read()), daemon=True)
+        reader.start()
+        stdout = self.stdout.read()
+        reader.join()
+        self.stdout.close()
+        self.stderr.close()
+        self.wait()
+        return stdout, b"".join(stderr_chunks)
+
+class WorkerPool:
+    """
+    管理预热的 worker 进程。worker 在后台启动，空闲的 worker 才会被使用；
+    没有可用 worker 时 run() 返回 None，调用方应使用普通 subprocess。
+    每个 worker 执行 max_runs 次后会被回收，崩溃的 worker 会被丢弃并补充新的。
+    """
+    def __init__(self, size: int, max_runs: int, preload: List[str]):
+        self.size = size
+        self.max_runs = max_runs
+        self.preload = preload
+        self._lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._starting = 0
+        self._live = 0
+        self._closed = False
+        self.runs = 0
+        self.fallbacks = 0
+        self.recycled = 0
+        self.crashed = 0
+
+    def warm_up(self):
+        with self._lock:
+            missing = self.size - self._live - self._starting
+            self._starting += max(0, missing)
+        for _ in range(max(0, missing)):
+            threading.Thread(target=self._spawn, name="worker-pool-spawn", daemon=True).start()
+
+    def _spawn(self):
+        worker = None
+        try:
+            parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(child_sock.fileno()), ",".join(self.preload)],
+                pass_fds=(child_sock.fileno(),), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, close_fds=True,
+            )
+            child_sock.close()
+            worker = _Worker(process, parent_sock)
+            ready = worker.read_message()
+            if not ready or not ready.get('ready'):
+                raise RuntimeError("worker failed to start")
+        except Exception:
+            if worker:
+                worker.close()
+            with self._lock:
+                self._starting -= 1
+            return
+        with self._lock:
+            self._starting -= 1
+            if self._closed:
+                worker.close()
+                return
+            self._live += 1
+            self._idle.append(worker)
+
+    def run(self, script_path: str, env: Optional[dict] = None,
+            rlimits: Optional[Dict[str, Tuple[int, int]]] = None, source_path: Optional[str] = None) -> Optional[PooledProcess]:
+        """
+        在空闲的 worker 中启动脚本；没有空闲 worker 或 worker 异常时返回 None。
+        env 默认为当前环境，rlimits 见 apply_rlimits()。
+        script_path 可以是 .pyc，此时 source_path 为编译时记录的源文件路径，用于裁剪 traceback。
+        """
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                self.fallbacks += 1
+        if worker is None:
+            self.warm_up()
+            return None
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            job = {"path": os.path.abspath(script_path), "cwd": os.getcwd(), "env": dict(os.environ if env is None else env),
+                   "rlimits": rlimits or {},
+                   "source": os.path.abspath(source_path or script_path)}
+            # The script inherits our stdin, exactly like subprocess.run() without input=.
+            fds = [stdout_w, stderr_w] + ([0] if _fd_is_open(0) else [])
+            socket.send_fds(worker.sock, [json.dumps(job).encode('utf-8') + b"\n"], fds)
+            started = worker.read_message()
+            if not started or 'pid' not in started:
+                raise ConnectionError("worker closed before starting the script")
+        except (OSError, ValueError):
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            self._discard(worker)
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+        worker.runs += 1
+        with self._lock:
+            self.runs += 1
+        return PooledProcess(self, worker, started['pid'], stdout_r, stderr_r)
+
+    def _release(self, worker: _Worker):
+        if worker.runs >= self.max_runs:
+            with self._lock:
+                self.recycled += 1
+            self._retire(worker)
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.append(worker)
+                return
+        self._retire(worker)
+
+    def _discard(self, worker: _Worker):
+        with self._lock:
+            self.crashed += 1
+        self._retire(worker)
+
+    def _retire(self, worker: _Worker):
+        with self._lock:
+            self._live -= 1
+            closed = self._closed
+        worker.close()
+        if not closed:
+            self.warm_up()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._live -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "live": self._live, "runs": self.runs,
+                    "fallbacks": self.fallbacks, "recycled": self.recycled, "crashed": self.crashed}
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+def _send(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message).encode('utf-8') + b"\n")
+
+def _receive_job(sock: socket.socket) -> Optional[Tuple[dict, List[int]]]:
+    data, fds, _, _ = socket.recv_fds(sock, 1 << 20, 3)
+    if not data:
+        return None
+    while not data.endswith(b"\n"):
+        more = sock.recv(1 << 20)
+        if not more:
+            return None
+        data += more
+    return json.loads(data), fds
+
+def _run_script_in_child(job: dict, fds: List[int], sock: socket.socket, session_ready: int):
+    """Runs in the forked child; never returns normally so the interpreter exits like `python script.py`."""
+    import runpy
+    import traceback
+    sock.close()
+    os.setsid()  # own process group, so the whole tree can be killed at once
+    os.close(session_ready)  # the worker reports our pid only now, so killpg(pid) always finds the group
+    apply_rlimits(job.get('rlimits', {}))
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    if len(fds) > 2:
+        os.dup2(fds[2], 0)
+    for fd in fds:
+        os.close(fd)
+    os.chdir(job['cwd'])
+    os.environ.clear()
+    os.environ.update(job['env'])
+    if os.environ.get('PYTHONUNBUFFERED'):
+        # The streams were created when the worker started; honour -u semantics for this script.
+        sys.stdout.reconfigure(line_buffering=True)
+        sys.stderr.reconfigure(line_buffering=True)
+    path = job['path']
+    source = job.get('source', path)
+    sys.argv = [path]
+    sys.path[0] = os.path.dirname(path)
+    try:
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # Hide the worker/runpy frames so the traceback matches a direct `python script.py` run.
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != source:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        sys.exit(1)
+    sys.exit(0)
+
+def _worker_main(sock_fd: int, preload: List[str]):
+    import gc
+    import importlib
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    # Move the preloaded objects out of the GC's view: forked children neither copy their pages
+    # when collecting nor walk them again during interpreter shutdown.
+    gc.freeze()
+    sock = socket.socket(fileno=sock_fd)
+    _send(sock, {"ready": True})
+    while True:
+        received = _receive_job(sock)
+        if received is None:
+            return
+        job, fds = received
+        session_r, session_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(session_r)
+            _run_script_in_child(job, fds, sock, session_w)
+        os.close(session_w)
+        for fd in fds:
+            os.close(fd)
+        os.read(session_r, 1)  # EOF once the child has its own session (or has died)
+        os.close(session_r)
+        _send(sock, {"pid": pid})
+        _, status = os.waitpid(pid, 0)
+        _send(sock, {"returncode": os.waitstatus_to_exitcode(status)})
+
+if __name__ == '__main__':
+    _worker_main(int(sys.argv[1]), [m for m in sys.argv[2].split(',') if m])